@@ -0,0 +1,131 @@
+import queue
+import threading
+import time
+
+from utils.timing import SearchTrace
+
+
+class _PendingQuery:
+    """等待批处理的单个查询。"""
+
+    def __init__(self, query, top_k, trace=None, filter_key=(), subset=None):
+        self.query = query
+        self.top_k = top_k
+        self.trace = trace
+        self.filter_key = filter_key
+        self.subset = subset
+        self.submitted_at = time.perf_counter()
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+# ===== 查询合并器 =====
+class QueryBatcher:
+    """
+    将短时间内并发到达的查询合并为一批，一次调用批量检索函数后再分发给各请求。
+
+    参数:
+        batch_fn (callable): 批量检索函数，签名为 batch_fn(queries, top_k, trace=None, subset=None)，
+            返回与 queries 一一对应的结果列表，如 find_similar_cases_batch 的偏函数。
+        max_batch_size (int): 每批最多合并的查询数。
+        max_wait_ms (float): 收到第一条查询后最多等待的毫秒数。
+    """
+
+    def __init__(self, batch_fn, max_batch_size=16, max_wait_ms=5):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+        self._thread.start()
+
+    def search(self, query, top_k, trace=None, filter_key=(), subset=None):
+        """
+        提交查询并阻塞等待本批结果。
+
+        参数:
+            query (str): 查询文本。
+            top_k (int): 返回的最相似案例数量。
+            trace (SearchTrace): 可选，写入排队等待耗时与整批共享的各阶段耗时。
+            filter_key (tuple): 过滤条件，相同条件的查询才合并打分。
+            subset (numpy.ndarray): 过滤条件对应的行号，为空时不过滤。
+
+        返回:
+            list: [(案例索引, 相似度分数)]
+        """
+        pending = _PendingQuery(query, top_k, trace, filter_key=filter_key, subset=subset)
+        with self._lock:
+            if self._closed:
+                # 已关闭（如语料热更新后被替换）时直接在当前线程检索
+                return self.batch_fn([query], top_k, trace=trace, subset=subset)[0]
+            self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def close(self):
+        """停止后台线程，已提交的查询仍会处理完。"""
+        with self._lock:
+            self._closed = True
+            self._queue.put(None)
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            closed = None in batch
+            batch = [pending for pending in batch if pending is not None]
+            if batch:
+                self._process(batch)
+            if closed:
+                # 处理完队列中剩余的查询后退出
+                while not self._queue.empty():
+                    pending = self._queue.get()
+                    if pending is not None:
+                        self._process([pending])
+                return
+
+    def _process(self, batch):
+        # 不同过滤条件打分的行不同，分组检索
+        groups = {}
+        for pending in batch:
+            groups.setdefault(pending.filter_key, []).append(pending)
+        for group in groups.values():
+            self._process_group(group)
+
+    def _process_group(self, batch):
+        # 按最大的 top_k 检索一次，再按各请求的 top_k 截断
+        top_k = max(pending.top_k for pending in batch)
+        batch_trace = SearchTrace()
+        started_at = time.perf_counter()
+        try:
+            results = self.batch_fn([pending.query for pending in batch], top_k, trace=batch_trace,
+                                    subset=batch[0].subset)
+            for pending, result in zip(batch, results):
+                pending.result = result[:pending.top_k]
+                if pending.trace is not None:
+                    pending.trace.record("queue_wait", started_at - pending.submitted_at)
+                    pending.trace.merge(batch_trace)
+                    pending.trace.count("batch_size", len(batch))
+        except Exception as e:
+            for pending in batch:
+                pending.error = e
+        finally:
+            for pending in batch:
+                pending.done.set()
@@ -0,0 +1,305 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from algo.index import build_case_index, l2_normalize, select_top_k, faiss
+from algo.store import open_embeddings
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BACKENDS = ("brute", "float16", "int8", "pca", "ivf", "hnsw")
+# 合成语料（百万行时约数 GB）默认放在系统临时目录，不写入仓库工作区；多次运行复用已生成的文件
+DEFAULT_WORK_DIR = os.path.join(tempfile.gettempdir(), "lawai-benchmark")
+
+
+# ===== 数据准备 =====
+def synthetic_embeddings(path, rows, dim, n_clusters=256, chunk_size=65536, seed=0):
+    """
+    生成带聚类结构的归一化随机向量（比均匀随机更接近真实语料，ANN 召回率才有参考价值），
+    分块写入 .npy，内存占用与行数无关。文件已存在且形状一致时直接复用。
+
+    参数:
+        path (str): 输出文件路径。
+        rows (int): 行数。
+        dim (int): 维度。
+        n_clusters (int): 聚类中心数。
+        chunk_size (int): 每次生成的行数。
+        seed (int): 随机种子。
+
+    返回:
+        str: 文件路径
+    """
+    if os.path.exists(path) and np.load(path, mmap_mode="r").shape == (rows, dim):
+        return path
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim), dtype=np.float32)
+    tmp_file = f"{path[:-4]}.{os.getpid()}.tmp.npy"
+    embeddings = np.lib.format.open_memmap(tmp_file, mode="w+", dtype=np.float32, shape=(rows, dim))
+    for start in range(0, rows, chunk_size):
+        n = min(chunk_size, rows - start)
+        chunk = centers[rng.integers(0, n_clusters, n)] + rng.standard_normal((n, dim), dtype=np.float32)
+        embeddings[start:start + n] = l2_normalize(chunk)
+    embeddings.flush()
+    del embeddings
+    os.replace(tmp_file, path)
+    return path
+
+def sample_queries(embeddings, n_queries, noise=0.5, seed=1):
+    """从语料中抽样并加噪声作为查询向量（真实查询与案例不会完全相同）。"""
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(embeddings.shape[0], size=min(n_queries, embeddings.shape[0]), replace=False))
+    queries = np.asarray(embeddings[rows], dtype=np.float32)
+    queries = queries + noise * rng.standard_normal(queries.shape, dtype=np.float32) / np.sqrt(queries.shape[1])
+    return l2_normalize(queries)
+
+def encode_query_file(query_file, model_name):
+    """用查询编码器编码查询文件（每行一条），得到真实查询向量。"""
+    from algo.encoder import load_query_encoder
+    from algo.search import encode_queries, preprocess_text
+
+    with open(query_file, "r", encoding="utf-8") as f:
+        queries = [preprocess_text(line) for line in f if line.strip()]
+    return encode_queries(load_query_encoder(model_name), queries)
+
+def exact_top_k(embeddings, queries, top_k, chunk_size=65536):
+    """分块精确计算 top_k，作为召回率的基准，临时内存与行数无关。"""
+    best_scores, best_indices = [], []
+    for start in range(0, embeddings.shape[0], chunk_size):
+        chunk = np.asarray(embeddings[start:start + chunk_size], dtype=np.float32)
+        scores, indices = select_top_k(queries @ chunk.T, top_k)
+        best_scores.append(scores)
+        best_indices.append(indices + start)
+    _, order = select_top_k(np.concatenate(best_scores, axis=1), top_k)
+    return np.take_along_axis(np.concatenate(best_indices, axis=1), order, axis=1)
+
+
+# ===== 指标 =====
+def rss_mb():
+    """当前进程常驻内存（MB），无法读取时返回 None。"""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    try:
+        import resource
+        # Linux 以 KB 为单位，macOS 以字节为单位；取的是峰值
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    except ImportError:
+        return None
+
+def recall_at_k(found, expected):
+    """found 与 expected 均为 (nq, k) 行号矩阵，返回平均 recall@k。"""
+    k = expected.shape[1]
+    return float(np.mean([len(set(row_found[:k]) & set(row_expected)) / k
+                          for row_found, row_expected in zip(found, expected)]))
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=_PROJECT_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ===== 单个后端 =====
+def benchmark_backend(embedding_file, backend, queries, expected, top_k, batch_size=1, warmup=5, **index_params):
+    """
+    构建一个后端的索引并逐批检索，统计延迟分位数、QPS、内存与 recall@k。
+
+    参数:
+        embedding_file (str): 嵌入向量文件。
+        backend (str): brute / float16 / int8 / pca / ivf / hnsw / sharded。
+        queries (numpy.ndarray): 查询向量。
+        expected (numpy.ndarray): 精确 top_k 行号。
+        top_k (int): 检索数量。
+        batch_size (int): 每次检索的查询数，1 即单查询延迟。
+        warmup (int): 不计入统计的预热批数。
+        index_params: 传给 build_case_index 的索引参数。
+
+    返回:
+        dict: 测试结果
+    """
+    gc.collect()
+    rss_before = rss_mb()
+    # 每个后端重新映射文件，常驻内存只包含本后端访问过的页
+    embeddings = open_embeddings(embedding_file, mmap=True)
+    build_start = time.perf_counter()
+    index = build_case_index(embeddings, backend=backend, embedding_file=embedding_file, **index_params)
+    build_seconds = time.perf_counter() - build_start
+
+    try:
+        batches = [queries[i:i + batch_size] for i in range(0, len(queries), batch_size)]
+        for batch in batches[:warmup]:
+            index.search(batch, top_k)
+
+        latencies, found = [], []
+        for batch in batches:
+            start = time.perf_counter()
+            _, indices = index.search(batch, top_k)
+            latencies.append(time.perf_counter() - start)
+            found.append(indices)
+        rss_after = rss_mb()
+        # pca 后端额外记录降维保留的方差比例
+        explained = getattr(index, "explained", None)
+    finally:
+        if hasattr(index, "close"):
+            index.close()
+    del index, embeddings
+
+    latencies_ms = np.array(latencies) * 1000
+    result = {
+        "backend": backend,
+        "build_s": round(build_seconds, 3),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 3),
+        "mean_ms": round(float(latencies_ms.mean()), 3),
+        "qps": round(len(queries) / float(np.sum(latencies)), 1),
+        f"recall@{top_k}": round(recall_at_k(np.concatenate(found), expected), 4),
+        "rss_mb": rss_after,
+        "rss_delta_mb": round(rss_after - rss_before, 1) if rss_after is not None and rss_before is not None else None,
+    }
+    if explained is not None:
+        result["pca_explained"] = round(explained, 4)
+    return result
+
+
+# ===== 测试流程 =====
+def run_benchmark(sizes, backends, dim=1024, n_queries=200, top_k=10, batch_size=1, work_dir=DEFAULT_WORK_DIR,
+                  embedding_file=None, query_file=None, model_name=None, nlist=None, nprobe=16, hnsw_m=32,
+                  ef_construction=200, ef_search=64, rescore_candidates=200, n_shards=0, pca_dims=(128,)):
+    """
+    对每种规模、每个后端运行一次测试。
+
+    参数:
+        sizes (list): 合成语料行数列表，指定 embedding_file 时忽略。
+        backends (list): 后端列表。
+        dim (int): 合成向量维度。
+        n_queries (int): 查询数。
+        top_k (int): 检索数量，recall@k 的 k。
+        batch_size (int): 每次检索的查询数。
+        work_dir (str): 合成语料与量化文件的目录。
+        embedding_file (str): 真实嵌入向量文件。
+        query_file (str): 真实查询文件（每行一条），需同时指定 model_name；为空时从语料抽样加噪声。
+        model_name (str): 查询编码模型。
+        nlist (int): IVF 聚类数，为空时取 4 * sqrt(行数)（不超过 FAISS 训练要求的 行数 / 39）。
+        pca_dims (tuple): pca 后端依次测试的降维维度，与 rescore_candidates 共同决定精度与延迟的取舍。
+        其余参数同 build_case_index。
+
+    返回:
+        dict: {"meta": 环境信息, "params": 参数, "results": 每个规模与后端的结果}
+    """
+    datasets = []
+    if embedding_file:
+        datasets.append(embedding_file)
+    else:
+        os.makedirs(work_dir, exist_ok=True)
+        for rows in sizes:
+            print(f"准备合成语料 {rows} x {dim}...")
+            datasets.append(synthetic_embeddings(os.path.join(work_dir, f"synthetic_{rows}x{dim}.npy"), rows, dim))
+
+    results = []
+    for path in datasets:
+        embeddings = np.load(path, mmap_mode="r")
+        rows = embeddings.shape[0]
+        if query_file:
+            queries = encode_query_file(query_file, model_name)
+        else:
+            queries = sample_queries(embeddings, n_queries)
+        print(f"计算精确 top_{top_k}（{rows} 行，{len(queries)} 个查询）...")
+        expected = exact_top_k(embeddings, queries, top_k)
+        del embeddings
+
+        for backend in backends:
+            if backend in ("ivf", "hnsw") and faiss is None:
+                print(f"未安装 faiss，跳过 {backend}")
+                continue
+            # pca 后端对每个降维维度各测一次
+            for variant in ([{"pca_dim": dim} for dim in pca_dims] if backend == "pca" else [{}]):
+                print(f"测试 {backend}{variant or ''}（{rows} 行）...")
+                result = benchmark_backend(
+                    path, backend, queries, expected, top_k, batch_size=batch_size,
+                    nlist=nlist or max(1, min(int(4 * np.sqrt(rows)), rows // 39)), nprobe=nprobe, hnsw_m=hnsw_m,
+                    ef_construction=ef_construction, ef_search=ef_search,
+                    rescore_candidates=rescore_candidates, n_shards=n_shards, **variant
+                )
+                result.update({"rows": rows, "dim": int(queries.shape[1]), "dataset": os.path.basename(path), **variant})
+                results.append(result)
+                print(json.dumps(result, ensure_ascii=False))
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "faiss": getattr(faiss, "__version__", None),
+            "cpu_count": os.cpu_count(),
+        },
+        "params": {
+            "queries": n_queries if not query_file else os.path.basename(query_file),
+            "top_k": top_k,
+            "batch_size": batch_size,
+            "nprobe": nprobe,
+            "hnsw_m": hnsw_m,
+            "ef_construction": ef_construction,
+            "ef_search": ef_search,
+            "rescore_candidates": rescore_candidates,
+            "n_shards": n_shards,
+            "pca_dims": list(pca_dims),
+        },
+        "results": results,
+    }
+
+
+# ===== 命令行 =====
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="案例向量检索基准测试：延迟分位数、QPS、内存与 recall@k")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="合成语料行数，逗号分隔")
+    parser.add_argument("--backends", default=",".join(DEFAULT_BACKENDS),
+                        help="逗号分隔：brute / float16 / int8 / pca / ivf / hnsw / sharded")
+    parser.add_argument("--dim", type=int, default=1024, help="合成向量维度（multilingual-e5-large 为 1024）")
+    parser.add_argument("--queries", type=int, default=200, help="查询数")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=1, help="每次检索的查询数")
+    parser.add_argument("--work-dir", default=DEFAULT_WORK_DIR, help=f"合成语料与量化文件目录，默认 {DEFAULT_WORK_DIR}")
+    parser.add_argument("--embeddings", help="使用真实的 case_embeddings.npy 代替合成语料")
+    parser.add_argument("--query-file", help="真实查询文件（每行一条），需同时指定 --model")
+    parser.add_argument("--model", help="查询编码模型")
+    parser.add_argument("--nlist", type=int, help="IVF 聚类数，默认 4 * sqrt(行数)")
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--ef-construction", type=int, default=200)
+    parser.add_argument("--ef-search", type=int, default=64)
+    parser.add_argument("--rescore-candidates", type=int, default=200)
+    parser.add_argument("--pca-dims", default="128", help="pca 后端测试的降维维度，逗号分隔，如 64,128,256")
+    parser.add_argument("--shards", type=int, default=0, help="sharded 后端的子进程数，0 为 CPU 核数")
+    parser.add_argument("--output", help="结果 JSON 路径，默认 benchmark-<commit>-<时间>.json")
+    args = parser.parse_args()
+    if args.query_file and not args.model:
+        parser.error("--query-file 需要同时指定 --model")
+
+    report = run_benchmark(
+        [int(size) for size in args.sizes.split(",") if size], [b for b in args.backends.split(",") if b],
+        dim=args.dim, n_queries=args.queries, top_k=args.top_k, batch_size=args.batch_size,
+        work_dir=args.work_dir, embedding_file=args.embeddings, query_file=args.query_file, model_name=args.model,
+        nlist=args.nlist, nprobe=args.nprobe, hnsw_m=args.hnsw_m, ef_construction=args.ef_construction,
+        ef_search=args.ef_search, rescore_candidates=args.rescore_candidates, n_shards=args.shards,
+        pca_dims=[int(dim) for dim in args.pca_dims.split(",") if dim]
+    )
+    output = args.output or f"benchmark-{report['meta']['commit'] or 'local'}-{time.strftime('%Y%m%d%H%M%S')}.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {output}")
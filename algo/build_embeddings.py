@@ -0,0 +1,372 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+
+from algo.search import preprocess_text
+
+EMBEDDING_FILE_NAME = "case_embeddings.npy"
+METADATA_FILE_NAME = "case_metadata.json"
+IDS_FILE_NAME = "case_ids.npy"
+MANIFEST_FILE_NAME = "manifest.json"
+
+# 子进程内的模型，由 _init_worker 加载一次
+_worker_model = None
+
+
+# ===== 数据读取 =====
+def iter_table_chunks(db_file, table, columns, chunk_size, min_id=0):
+    """
+    按 id 游标分块读取一张表，每次只持有一个分块。
+
+    参数:
+        db_file (str): SQLite 数据库路径。
+        table (str): 表名。
+        columns (tuple): 读取的列，第一列须为 id。
+        chunk_size (int): 每块行数。
+        min_id (int): 只读取 id 大于该值的行。
+
+    返回:
+        generator: 每次产出一个行元组列表
+    """
+    conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    try:
+        last_id = min_id
+        while True:
+            rows = conn.execute(
+                f"SELECT {', '.join(columns)} FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, chunk_size)
+            ).fetchall()
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1][0]
+    finally:
+        conn.close()
+
+def iter_case_chunks(db_file, chunk_size, min_id=0):
+    """
+    按 id 游标分块读取 judicial_cases。
+
+    返回:
+        generator: 每次产出一个 [(id, title, keywords, basic_facts)] 分块
+    """
+    return iter_table_chunks(db_file, "judicial_cases", ("id", "title", "keywords", "basic_facts"),
+                             chunk_size, min_id=min_id)
+
+def case_text(title, keywords, basic_facts):
+    """生成案例的嵌入文本：标题、关键词、基本案情，与查询使用相同的预处理。"""
+    return preprocess_text(" ".join(part for part in (title, keywords, basic_facts) if part))
+
+def case_record(case_id, title, keywords, basic_facts):
+    """生成与案例库元数据 JSON 格式一致的记录，额外保存数据库 id。"""
+    return {
+        "id": case_id,
+        "案例": title,
+        "关键词": keywords.split(" ") if keywords else [],
+        "基本案情": basic_facts or ""
+    }
+
+def table_fingerprint(row_chunks):
+    """
+    数据源内容指纹：行数、最大 id 与全部参与编码的列的 SHA-1。只依赖被编码的表，
+    数据库中其他表（会话、收藏、案例类别等）的写入不会使检查点作废，表内容被原地修改时指纹变化。
+
+    参数:
+        row_chunks (iterable): 按 id 排序的行分块，与编码时读取的列相同。
+
+    返回:
+        str: 指纹
+    """
+    digest = hashlib.sha1()
+    count, max_id = 0, None
+    for rows in row_chunks:
+        for row in rows:
+            digest.update(json.dumps(row, ensure_ascii=False).encode("utf-8"))
+        count += len(rows)
+        max_id = rows[-1][0]
+    return f"{count}:{max_id}:{digest.hexdigest()}"
+
+
+# ===== 子进程编码 =====
+def _init_worker(model_name, threads):
+    global _worker_model
+    import torch
+    from algo.encoder import load_query_encoder
+
+    if threads > 0:
+        torch.set_num_threads(threads)
+    _worker_model = load_query_encoder(model_name)
+
+def save_encoded_chunk(chunk_file, ids, texts, records, batch_size):
+    """在子进程内编码文本并原子写入检查点文件，ids / records 与 texts 逐条对应。"""
+    vectors = _worker_model.encode(
+        texts,
+        batch_size=batch_size,
+        convert_to_numpy=True,
+        normalize_embeddings=True
+    ).astype(np.float32)
+    tmp_file = f"{chunk_file}.tmp.npz"
+    np.savez(
+        tmp_file,
+        ids=np.array(ids, dtype=np.int64),
+        vectors=vectors,
+        records=np.array(json.dumps(records, ensure_ascii=False))
+    )
+    os.replace(tmp_file, chunk_file)
+    return chunk_file
+
+def _encode_chunk(chunk_file, rows, batch_size):
+    """编码一个案例分块并写入检查点文件，返回分块文件路径。"""
+    texts = [case_text(title, keywords, basic_facts) for _, title, keywords, basic_facts in rows]
+    return save_encoded_chunk(chunk_file, [row[0] for row in rows], texts, [case_record(*row) for row in rows],
+                              batch_size)
+
+
+# ===== 检查点 =====
+def _chunk_file(checkpoint_dir, first_id):
+    return os.path.join(checkpoint_dir, f"chunk_{first_id:012d}.npz")
+
+def _load_checkpoint(checkpoint_dir, fingerprint, model_name, chunk_size):
+    state_file = os.path.join(checkpoint_dir, "state.json")
+    # 分块文件以首个 id 命名，分块大小不同时旧分块会与新分块重叠，同样作废
+    state = {"fingerprint": fingerprint, "model": str(model_name), "chunk_size": chunk_size}
+    if os.path.exists(state_file):
+        with open(state_file, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        if previous == state:
+            return
+        print("数据、模型或分块大小已变化，丢弃旧的检查点。")
+        shutil.rmtree(checkpoint_dir)
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    with open(state_file, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+
+
+# ===== 产物写入 =====
+def _file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _iter_chunk_files(chunk_files):
+    for chunk_file in chunk_files:
+        with np.load(chunk_file) as chunk:
+            yield chunk["ids"], chunk["vectors"], json.loads(str(chunk["records"]))
+
+def write_corpus_artifacts(chunks, count, dim, embedding_file, metadata_file, model_name, source, ids_file=None):
+    """
+    写出嵌入向量、元数据、id 与 manifest。先写临时文件，全部完成后依次替换，
+    manifest 最后替换：线上进程以 manifest 版本判断语料是否更新，不会读到新旧混合的产物。
+    id 文件与 manifest 写在嵌入向量文件同目录下。
+
+    参数:
+        chunks (iterable): 依次产出 (ids, vectors, records) 分块，共 count 行。
+        count (int): 总行数。
+        dim (int): 向量维度。
+        embedding_file (str): 嵌入向量文件路径。
+        metadata_file (str): 元数据 JSON 路径。
+        model_name (str): 编码模型。
+        source (str): 数据来源说明。
+        ids_file (str): id 文件路径，默认为 case_ids_path(embedding_file)。
+
+    返回:
+        dict: manifest
+    """
+    output_dir = os.path.dirname(os.path.abspath(embedding_file))
+    os.makedirs(output_dir, exist_ok=True)
+    ids_file = ids_file or case_ids_path(embedding_file)
+    manifest_file = os.path.join(output_dir, MANIFEST_FILE_NAME)
+
+    suffix = f".{os.getpid()}.tmp"
+    tmp_embedding_file = embedding_file + suffix + ".npy"
+    tmp_ids_file = ids_file + suffix + ".npy"
+    tmp_metadata_file = metadata_file + suffix
+
+    embeddings = np.lib.format.open_memmap(tmp_embedding_file, mode="w+", dtype=np.float32, shape=(count, dim or 0))
+    ids = np.empty(count, dtype=np.int64)
+    position = 0
+    with open(tmp_metadata_file, "w", encoding="utf-8") as metadata_out:
+        metadata_out.write("[")
+        for chunk_ids, vectors, records in chunks:
+            n = len(chunk_ids)
+            embeddings[position:position + n] = vectors
+            ids[position:position + n] = chunk_ids
+            for i, record in enumerate(records):
+                metadata_out.write(("," if position + i else "") + json.dumps(record, ensure_ascii=False))
+            position += n
+        metadata_out.write("]")
+    embeddings.flush()
+    del embeddings
+    np.save(tmp_ids_file, ids)
+
+    manifest = {
+        "model": str(model_name),
+        "source": source,
+        "count": count,
+        "dim": dim,
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "files": {
+            os.path.basename(embedding_file): _file_sha1(tmp_embedding_file),
+            os.path.basename(metadata_file): _file_sha1(tmp_metadata_file),
+            os.path.basename(ids_file): _file_sha1(tmp_ids_file),
+        }
+    }
+    manifest["version"] = hashlib.sha1(json.dumps(manifest["files"], sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    with open(manifest_file + suffix, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    os.replace(tmp_embedding_file, embedding_file)
+    os.replace(tmp_ids_file, ids_file)
+    os.replace(tmp_metadata_file, metadata_file)
+    os.replace(manifest_file + suffix, manifest_file)
+    return manifest
+
+def publish_artifacts(chunk_files, output_dir, model_name, source, embedding_name=EMBEDDING_FILE_NAME,
+                      metadata_name=METADATA_FILE_NAME, ids_name=IDS_FILE_NAME):
+    """
+    合并分块，在 output_dir 下写出嵌入向量、元数据、id 与 manifest。
+
+    参数:
+        chunk_files (list): 按 id 排序的分块文件。
+        output_dir (str): 输出目录。
+        model_name (str): 编码模型。
+        source (str): 数据来源说明。
+        embedding_name / metadata_name / ids_name (str): 输出文件名。
+
+    返回:
+        dict: manifest
+    """
+    count, dim = 0, None
+    for chunk_file in chunk_files:
+        with np.load(chunk_file) as chunk:
+            count += len(chunk["ids"])
+            dim = chunk["vectors"].shape[1]
+    return write_corpus_artifacts(
+        _iter_chunk_files(chunk_files), count, dim,
+        os.path.join(output_dir, embedding_name),
+        os.path.join(output_dir, metadata_name),
+        model_name, source,
+        ids_file=os.path.join(output_dir, ids_name)
+    )
+
+
+def case_ids_path(embedding_file):
+    """案例 id 文件路径：与嵌入向量逐行对应，位于同一目录。"""
+    return os.path.join(os.path.dirname(os.path.abspath(embedding_file)), IDS_FILE_NAME)
+
+def read_manifest(embedding_file):
+    """
+    读取嵌入向量文件同目录下的 manifest，manifest 不存在或不描述该文件时返回 None。
+
+    参数:
+        embedding_file (str): 嵌入向量文件路径。
+
+    返回:
+        dict | None
+    """
+    manifest_file = os.path.join(os.path.dirname(embedding_file), MANIFEST_FILE_NAME)
+    if not os.path.exists(manifest_file):
+        return None
+    with open(manifest_file, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    return manifest if os.path.basename(embedding_file) in manifest.get("files", {}) else None
+
+
+# ===== 构建流程 =====
+def build_case_embeddings(db_file, output_dir, model_name, workers=2, chunk_size=2048, batch_size=32,
+                          checkpoint_dir=None):
+    """
+    从 judicial_cases 表分块读取案例，多进程编码，支持中断后从检查点继续。
+
+    参数:
+        db_file (str): SQLite 数据库路径。
+        output_dir (str): 产物输出目录。
+        model_name (str): SentenceTransformer 模型名称或路径，须与线上查询编码器一致。
+        workers (int): 编码进程数。
+        chunk_size (int): 每个分块（检查点）的行数。
+        batch_size (int): 每次前向计算的文本数。
+        checkpoint_dir (str): 检查点目录，默认为 output_dir/checkpoints。
+
+    返回:
+        dict: manifest
+    """
+    checkpoint_dir = checkpoint_dir or os.path.join(output_dir, "checkpoints")
+    chunk_files = encode_chunks(iter_case_chunks(db_file, chunk_size), _encode_chunk, checkpoint_dir,
+                                table_fingerprint(iter_case_chunks(db_file, chunk_size)), model_name,
+                                chunk_size=chunk_size, workers=workers, batch_size=batch_size)
+    manifest = publish_artifacts(chunk_files, output_dir, model_name, source=os.path.abspath(db_file))
+    shutil.rmtree(checkpoint_dir)
+    return manifest
+
+
+def encode_chunks(row_chunks, encode_chunk, checkpoint_dir, fingerprint, model_name, chunk_size, workers=2, batch_size=32):
+    """
+    多进程编码分块，每个分块写入一个检查点文件，已存在的检查点直接跳过。
+
+    参数:
+        row_chunks (iterable): 按 id 排序的行分块，每个分块的第一行第一列为 id。
+        encode_chunk (callable): 子进程内执行的 (chunk_file, rows, batch_size) -> chunk_file，须为模块级函数。
+        checkpoint_dir (str): 检查点目录。
+        fingerprint (str): 数据源指纹（table_fingerprint），变化后旧的检查点作废。
+        model_name (str): 编码模型。
+        chunk_size (int): row_chunks 的分块大小，变化后旧的检查点作废。
+        workers (int): 编码进程数。
+        batch_size (int): 每次前向计算的文本数。
+
+    返回:
+        list: 按 id 排序的分块文件
+    """
+    _load_checkpoint(checkpoint_dir, fingerprint, model_name, chunk_size)
+
+    chunk_files = []
+    skipped = 0
+    # 每个进程分到的线程数，避免多进程争抢 CPU
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    start_time = time.time()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(model_name, threads)) as executor:
+        in_flight = set()
+        for rows in row_chunks:
+            chunk_file = _chunk_file(checkpoint_dir, rows[0][0])
+            chunk_files.append(chunk_file)
+            if os.path.exists(chunk_file):
+                skipped += 1
+                continue
+            # 限制在途分块数，内存占用与语料规模无关
+            if len(in_flight) >= workers * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    print(f"已完成分块 {os.path.basename(future.result())}")
+            in_flight.add(executor.submit(encode_chunk, chunk_file, rows, batch_size))
+        for future in in_flight:
+            print(f"已完成分块 {os.path.basename(future.result())}")
+
+    print(f"编码完成：{len(chunk_files)} 个分块（{skipped} 个来自检查点），耗时 {time.time() - start_time:.1f}s")
+    return chunk_files
+
+
+# ===== 命令行 =====
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="从 judicial_cases 表重新生成案例嵌入向量与元数据")
+    parser.add_argument("--db", default="instance/database.db", help="SQLite 数据库路径")
+    parser.add_argument("--output-dir", required=True, help="产物输出目录")
+    parser.add_argument("--model", required=True, help="SentenceTransformer 模型名称或路径")
+    parser.add_argument("--workers", type=int, default=2, help="编码进程数")
+    parser.add_argument("--chunk-size", type=int, default=2048, help="每个检查点分块的行数")
+    parser.add_argument("--batch-size", type=int, default=32, help="每次前向计算的文本数")
+    parser.add_argument("--checkpoint-dir", help="检查点目录，默认为 <output-dir>/checkpoints")
+    args = parser.parse_args()
+
+    manifest = build_case_embeddings(args.db, args.output_dir, args.model, workers=args.workers,
+                                     chunk_size=args.chunk_size, batch_size=args.batch_size,
+                                     checkpoint_dir=args.checkpoint_dir)
+    print(json.dumps(manifest, ensure_ascii=False, indent=2))
@@ -0,0 +1,166 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+# ===== 通用 LRU/TTL 缓存 =====
+class LRUCache:
+    """
+    线程安全的 LRU 缓存，可选 TTL 过期，记录命中/未命中次数。
+
+    参数:
+        max_size (int): 最大条目数，超出时淘汰最久未使用的条目。
+        ttl (float): 条目有效期（秒），为空时永不过期。
+    """
+
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (写入时间, value)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _expired(self, created_at):
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    def get(self, key):
+        """命中返回缓存值并刷新 LRU 顺序，否则返回 None。"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or self._expired(item[0]):
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, created_at=None):
+        with self._lock:
+            self._data[key] = (created_at or time.time(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def items(self):
+        """返回未过期条目的快照 [(key, 写入时间, value)]，按 LRU 顺序从旧到新。"""
+        with self._lock:
+            return [(key, created_at, value) for key, (created_at, value) in self._data.items()
+                    if not self._expired(created_at)]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+# ===== 查询向量缓存 =====
+class QueryEmbeddingCache(LRUCache):
+    """
+    查询向量缓存，键为 (模型标识, preprocess_text 之后的查询文本)，更换模型后旧向量自动失效。
+
+    参数:
+        model_id (str): 模型标识（模型名称或路径）。
+        max_size (int): 最大缓存条目数。
+        ttl (float): 条目有效期（秒），为空时永不过期。
+        persist_file (str): 持久化文件路径（.npz），为空时不持久化。
+    """
+
+    def __init__(self, model_id, max_size=10000, ttl=None, persist_file=None):
+        super().__init__(max_size=max_size, ttl=ttl)
+        self.model_id = str(model_id)
+        self.persist_file = persist_file
+
+    def get_embedding(self, processed_query):
+        return self.get((self.model_id, processed_query))
+
+    def set_embedding(self, processed_query, embedding):
+        self.set((self.model_id, processed_query), embedding)
+
+    def save(self):
+        """将当前模型的缓存向量写入磁盘，供重启后的进程预热。"""
+        if not self.persist_file:
+            return
+        entries = [(key[1], created_at, value) for key, created_at, value in self.items()
+                   if key[0] == self.model_id]
+        if not entries:
+            return
+        texts, created_ats, vectors = zip(*entries)
+        # 先写临时文件再替换，避免多个进程同时退出时读到半个文件
+        tmp_file = f"{self.persist_file}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_file,
+            model_id=np.array(self.model_id),
+            texts=np.array(texts),
+            created_ats=np.array(created_ats, dtype=np.float64),
+            vectors=np.stack(vectors).astype(np.float32)
+        )
+        os.replace(tmp_file, self.persist_file)
+
+    def load(self):
+        """从磁盘加载缓存向量，模型标识不一致时忽略。"""
+        if not self.persist_file or not os.path.exists(self.persist_file):
+            return 0
+        try:
+            with np.load(self.persist_file) as data:
+                if str(data["model_id"]) != self.model_id:
+                    return 0
+                entries = list(zip(data["texts"].tolist(), data["created_ats"].tolist(), data["vectors"]))
+        except Exception as e:
+            print(f"查询向量缓存加载失败: {e}")
+            return 0
+        # 只保留最新的 max_size 条
+        for text, created_at, vector in entries[-self.max_size:]:
+            if not self._expired(created_at):
+                self.set((self.model_id, text), vector, created_at=created_at)
+        return len(self)
+
+
+# ===== 检索结果缓存 =====
+class SearchResultCache(LRUCache):
+    """
+    检索结果缓存，键为 (规范化查询, top_k, 语料版本)。
+    语料版本变化时清空，热门查询无需再经过模型。
+
+    参数:
+        max_size (int): 最大缓存条目数。
+        ttl (float): 条目有效期（秒），为空时永不过期。
+    """
+
+    def __init__(self, max_size=2048, ttl=3600):
+        super().__init__(max_size=max_size, ttl=ttl)
+        self.version = None
+
+    def set_version(self, version):
+        """切换语料版本，版本不同时清空缓存。"""
+        if version != self.version:
+            self.clear()
+            self.version = version
+
+    def get_results(self, key, version):
+        if version != self.version:
+            self.misses += 1
+            return None
+        return self.get((*key, version))
+
+    def set_results(self, key, version, results):
+        # 只缓存当前版本的结果，避免语料切换期间写入旧版本结果
+        if version == self.version:
+            self.set((*key, version), results)
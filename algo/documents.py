@@ -0,0 +1,186 @@
+import argparse
+import json
+import os
+import re
+import shutil
+
+import numpy as np
+
+from algo import build_embeddings
+from algo.build_embeddings import iter_table_chunks, table_fingerprint, encode_chunks, publish_artifacts
+from algo.search import preprocess_text
+
+DOCUMENT_EMBEDDING_FILE_NAME = "document_embeddings.npy"
+DOCUMENT_METADATA_FILE_NAME = "document_metadata.json"
+DOCUMENT_IDS_FILE_NAME = "document_ids.npy"
+
+# 每个段落一行元数据，文书级字段在各段落中重复，片段为该段落原文
+DOCUMENT_FIELDS = ("标题", "审理法院", "裁判日期", "案由", "类别", "片段")
+# 段落最大字符数 / 相邻段落重叠的字符数（e5 模型最多 512 个 token）
+PASSAGE_CHARS = 400
+PASSAGE_OVERLAP = 80
+
+_SENTENCE_END = re.compile(r"(?<=[。！？；\n])")
+
+
+# ===== 切分段落 =====
+def split_passages(text, max_chars=PASSAGE_CHARS, overlap=PASSAGE_OVERLAP):
+    """
+    按句切分长文本：句子依次拼入段落，超过 max_chars 时开始新段落，
+    新段落以上一段末尾不超过 overlap 个字符的句子开头，跨段落的表述不被截断。超长的句子按字符硬切。
+
+    参数:
+        text (str): 原文。
+        max_chars (int): 段落最大字符数。
+        overlap (int): 相邻段落重叠的字符数。
+
+    返回:
+        list: 段落列表
+    """
+    pieces = []
+    for sentence in _SENTENCE_END.split(text or ""):
+        sentence = sentence.strip()
+        pieces.extend(sentence[i:i + max_chars] for i in range(0, len(sentence), max_chars))
+
+    passages, current, length = [], [], 0
+    for piece in pieces:
+        if current and length + len(piece) > max_chars:
+            passages.append("".join(current))
+            tail, tail_length = [], 0
+            for sentence in reversed(current):
+                if tail_length + len(sentence) > overlap:
+                    break
+                tail.insert(0, sentence)
+                tail_length += len(sentence)
+            current, length = tail, tail_length
+        current.append(piece)
+        length += len(piece)
+    if current:
+        passages.append("".join(current))
+    return passages
+
+def document_passages(doc_id, title, trial_court, cause, judgment_date, category, law_basis, details):
+    """
+    将一篇裁判文书切分为段落：案由与法律依据在前，判决内容在后。每个段落的嵌入文本带上标题，
+    检索时文书的得分取其最相似段落的得分。
+
+    返回:
+        tuple: (嵌入文本列表, 元数据记录列表)
+    """
+    passages = split_passages(" ".join(part for part in (cause, law_basis) if part)) + split_passages(details)
+    if not passages:
+        passages = [""]
+    texts, records = [], []
+    for passage in passages:
+        texts.append(preprocess_text(f"{title} {passage}"))
+        records.append({
+            "id": doc_id,
+            "标题": title,
+            "审理法院": trial_court or "",
+            "裁判日期": judgment_date or "",
+            "案由": cause or "",
+            "类别": category or "",
+            "片段": passage,
+        })
+    return texts, records
+
+def iter_document_chunks(db_file, chunk_size, min_id=0):
+    """按 id 游标分块读取 judgment_documents。"""
+    return iter_table_chunks(
+        db_file, "judgment_documents",
+        ("id", "title", "trial_court", "cause", "judgment_date", "category", "law_basis", "details"),
+        chunk_size, min_id=min_id
+    )
+
+
+# ===== 构建 =====
+def _encode_document_chunk(chunk_file, rows, batch_size):
+    """编码一个文书分块的全部段落并写入检查点文件，ids 为每个段落所属的文书 id。"""
+    ids, texts, records = [], [], []
+    for row in rows:
+        passage_texts, passage_records = document_passages(*row)
+        ids.extend([row[0]] * len(passage_texts))
+        texts.extend(passage_texts)
+        records.extend(passage_records)
+    return build_embeddings.save_encoded_chunk(chunk_file, ids, texts, records, batch_size)
+
+def build_document_embeddings(db_file, output_dir, model_name, workers=2, chunk_size=256, batch_size=32,
+                              checkpoint_dir=None):
+    """
+    从 judgment_documents 表分块读取文书，切分段落后多进程编码，支持中断后从检查点继续。
+    输出目录中嵌入向量、段落元数据与文书 id 逐行对应（每个段落一行）。
+
+    参数:
+        db_file (str): SQLite 数据库路径。
+        output_dir (str): 产物输出目录，不能与案例语料目录相同（各自有 manifest）。
+        model_name (str): SentenceTransformer 模型名称或路径，须与线上查询编码器一致。
+        workers (int): 编码进程数。
+        chunk_size (int): 每个分块（检查点）的文书数。
+        batch_size (int): 每次前向计算的段落数。
+        checkpoint_dir (str): 检查点目录，默认为 output_dir/checkpoints。
+
+    返回:
+        dict: manifest
+    """
+    checkpoint_dir = checkpoint_dir or os.path.join(output_dir, "checkpoints")
+    chunk_files = encode_chunks(iter_document_chunks(db_file, chunk_size), _encode_document_chunk, checkpoint_dir,
+                                table_fingerprint(iter_document_chunks(db_file, chunk_size)), model_name,
+                                chunk_size=chunk_size, workers=workers, batch_size=batch_size)
+    manifest = publish_artifacts(
+        chunk_files, output_dir, model_name, source=os.path.abspath(db_file),
+        embedding_name=DOCUMENT_EMBEDDING_FILE_NAME, metadata_name=DOCUMENT_METADATA_FILE_NAME,
+        ids_name=DOCUMENT_IDS_FILE_NAME
+    )
+    shutil.rmtree(checkpoint_dir)
+    return manifest
+
+
+# ===== 加载与聚合 =====
+def load_document_ids(embedding_file, count):
+    """读取每个段落所属的文书 id。"""
+    ids_file = os.path.join(os.path.dirname(os.path.abspath(embedding_file)), DOCUMENT_IDS_FILE_NAME)
+    ids = np.load(ids_file)
+    if len(ids) != count:
+        raise ValueError(f"{ids_file} 有 {len(ids)} 行，与嵌入向量 {count} 行不一致")
+    return ids.astype(np.int64, copy=False)
+
+def aggregate_passage_hits(hits, passage_doc_ids, top_k):
+    """
+    段落命中聚合为文书：按得分降序遍历，每篇文书只保留得分最高的段落（max 聚合）。
+
+    参数:
+        hits (list): [(段落行号, 相似度分数)]，按分数降序。
+        passage_doc_ids (numpy.ndarray): 每个段落所属的文书 id。
+        top_k (int): 返回的文书数量。
+
+    返回:
+        list: [(文书 id, 相似度分数, 最相似段落的行号)]
+    """
+    results, seen = [], set()
+    for position, score in hits:
+        doc_id = int(passage_doc_ids[position])
+        if doc_id in seen:
+            continue
+        seen.add(doc_id)
+        results.append((doc_id, score, position))
+        if len(results) >= top_k:
+            break
+    return results
+
+
+# ===== 命令行 =====
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="从 judgment_documents 表生成分段落的裁判文书嵌入向量与元数据")
+    parser.add_argument("--db", default="instance/database.db", help="SQLite 数据库路径")
+    parser.add_argument("--output-dir", required=True, help="产物输出目录（与案例语料目录分开）")
+    parser.add_argument("--model", required=True, help="SentenceTransformer 模型名称或路径")
+    parser.add_argument("--workers", type=int, default=2, help="编码进程数")
+    parser.add_argument("--chunk-size", type=int, default=256, help="每个检查点分块的文书数")
+    parser.add_argument("--batch-size", type=int, default=32, help="每次前向计算的段落数")
+    parser.add_argument("--checkpoint-dir", help="检查点目录，默认为 <output-dir>/checkpoints")
+    args = parser.parse_args()
+
+    manifest = build_document_embeddings(args.db, args.output_dir, args.model, workers=args.workers,
+                                         chunk_size=args.chunk_size, batch_size=args.batch_size,
+                                         checkpoint_dir=args.checkpoint_dir)
+    print(json.dumps(manifest, ensure_ascii=False, indent=2))
@@ -0,0 +1,281 @@
+import argparse
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+import numpy as np
+
+# 帧格式：头部长度、负载长度（各 4 字节，网络字节序），JSON 头部，二进制负载
+_FRAME_HEADER = struct.Struct("!II")
+
+
+# ===== 帧读写 =====
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("连接已关闭")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+def send_frame(sock, header, payload=b""):
+    """发送一帧：JSON 头部 + 二进制负载。"""
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    sock.sendall(_FRAME_HEADER.pack(len(header_bytes), len(payload)) + header_bytes + payload)
+
+def recv_frame(sock):
+    """
+    接收一帧。
+
+    返回:
+        tuple: (header, payload)
+    """
+    header_size, payload_size = _FRAME_HEADER.unpack(_recv_exact(sock, _FRAME_HEADER.size))
+    header = json.loads(_recv_exact(sock, header_size).decode("utf-8"))
+    return header, _recv_exact(sock, payload_size) if payload_size else b""
+
+
+# ===== 服务端 =====
+class _PendingEncode:
+    """等待合并编码的一次请求。"""
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.vectors = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class EmbeddingService:
+    """
+    持有编码模型的进程内服务：并发到达的编码请求在短时间窗口内合并为一次 encode，
+    再按请求拆分结果。返回的向量均已归一化。
+
+    参数:
+        model (SentenceTransformer | OnnxQueryEncoder): 编码模型。
+        model_name (str): 模型名称，供客户端确认与语料一致。
+        backend (str): 编码器类型。
+        max_batch_size (int): 每次 encode 最多合并的文本数。
+        max_wait_ms (float): 收到第一条请求后最多等待的毫秒数。
+    """
+
+    def __init__(self, model, model_name, backend, max_batch_size=64, max_wait_ms=5):
+        self.model = model
+        self.model_name = model_name
+        self.backend = backend
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def info(self):
+        return {"model": str(self.model_name), "backend": self.backend}
+
+    def encode(self, texts):
+        """提交文本并阻塞等待本批结果，返回形状 (len(texts), dim) 的 float32 向量。"""
+        pending = _PendingEncode(texts)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.vectors
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        size = len(batch[0].texts)
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                pending = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(pending)
+            size += len(pending.texts)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            texts = [text for pending in batch for text in pending.texts]
+            try:
+                vectors = self.model.encode(
+                    texts,
+                    batch_size=len(texts),
+                    convert_to_numpy=True,
+                    normalize_embeddings=True
+                ).astype(np.float32)
+                start = 0
+                for pending in batch:
+                    pending.vectors = vectors[start:start + len(pending.texts)]
+                    start += len(pending.texts)
+            except Exception as e:
+                for pending in batch:
+                    pending.error = e
+            finally:
+                for pending in batch:
+                    pending.done.set()
+
+
+class _EmbeddingRequestHandler(socketserver.BaseRequestHandler):
+    """一个连接上可连续发送多个请求，直到客户端断开。"""
+
+    def handle(self):
+        service = self.server.service
+        while True:
+            try:
+                header, _ = recv_frame(self.request)
+            except (ConnectionError, OSError):
+                return
+            try:
+                if header.get("op") == "info":
+                    send_frame(self.request, service.info())
+                elif header.get("op") == "encode":
+                    vectors = service.encode(header["texts"])
+                    send_frame(self.request, {"shape": list(vectors.shape)}, vectors.tobytes())
+                else:
+                    send_frame(self.request, {"error": f"未知的请求类型: {header.get('op')}"})
+            except (ConnectionError, OSError):
+                return
+            except Exception as e:
+                send_frame(self.request, {"error": f"{type(e).__name__}: {e}"})
+
+
+class _EmbeddingServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve_embeddings(socket_path, model_name, backend="sentence_transformers", onnx_model_dir=None,
+                     intra_op_threads=0, max_batch_size=64, max_wait_ms=5):
+    """
+    加载编码模型并在 Unix 套接字上提供编码服务，直到进程退出。
+
+    参数:
+        socket_path (str): Unix 套接字路径。
+        model_name (str): SentenceTransformer 模型名称或路径。
+        backend (str): sentence_transformers / onnx / onnx_fp32。
+        onnx_model_dir (str): ONNX 导出目录。
+        intra_op_threads (int): ONNX Runtime 单算子线程数。
+        max_batch_size (int): 每次 encode 最多合并的文本数。
+        max_wait_ms (float): 合并等待的毫秒数。
+    """
+    from algo.encoder import load_query_encoder
+
+    model = load_query_encoder(model_name, backend=backend, onnx_model_dir=onnx_model_dir,
+                               intra_op_threads=intra_op_threads)
+    service = EmbeddingService(model, model_name, backend, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+    # 先预热再监听，客户端连上即可获得正常延迟
+    service.encode(["预热"])
+
+    if os.path.exists(socket_path):
+        # 上次退出残留的套接字文件
+        os.remove(socket_path)
+    with _EmbeddingServer(socket_path, _EmbeddingRequestHandler) as server:
+        server.service = service
+        print(f"编码服务已启动：{socket_path}（{backend}: {model_name}）")
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(socket_path)
+
+
+# ===== 客户端 =====
+class EmbeddingServiceClient:
+    """
+    编码服务客户端，接口与 SentenceTransformer.encode 一致，可直接替代查询编码器，
+    web worker 不再各自加载模型。每个线程复用一条连接，断开后自动重连。
+
+    参数:
+        socket_path (str): 编码服务的 Unix 套接字路径。
+        timeout (float): 单次请求超时秒数。
+        connect_timeout (float): 服务未启动（或仍在加载模型）时等待连接的最长秒数。
+    """
+
+    def __init__(self, socket_path, timeout=30, connect_timeout=60):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.socket_path)
+                return sock
+            except (FileNotFoundError, ConnectionRefusedError):
+                sock.close()
+                if time.monotonic() >= deadline:
+                    raise ConnectionError(f"无法连接编码服务 {self.socket_path}")
+                time.sleep(0.5)
+
+    def _request(self, header):
+        # 连接可能因服务重启失效，重连后重试一次
+        for attempt in range(2):
+            sock = getattr(self._local, "sock", None)
+            if sock is None:
+                sock = self._local.sock = self._connect()
+            try:
+                send_frame(sock, header)
+                response, payload = recv_frame(sock)
+                break
+            except (ConnectionError, OSError):
+                sock.close()
+                self._local.sock = None
+                if attempt:
+                    raise
+        if "error" in response:
+            raise RuntimeError(f"编码服务出错: {response['error']}")
+        return response, payload
+
+    def info(self):
+        """返回服务端的模型名称与编码器类型。"""
+        return self._request({"op": "info"})[0]
+
+    def encode(self, sentences, batch_size=None, convert_to_numpy=True, normalize_embeddings=True, **kwargs):
+        """
+        编码文本，服务端合并并发请求后统一 encode。
+
+        参数:
+            sentences (list | str): 文本或文本列表。
+            batch_size (int): 兼容 SentenceTransformer 的参数，批大小由服务端决定。
+            convert_to_numpy (bool): 兼容参数，始终返回 numpy 数组。
+            normalize_embeddings (bool): 兼容参数，服务端返回的向量始终已归一化。
+
+        返回:
+            numpy.ndarray: float32 向量
+        """
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        response, payload = self._request({"op": "encode", "texts": texts})
+        vectors = np.frombuffer(payload, dtype=np.float32).reshape(response["shape"])
+        return vectors[0] if single else vectors
+
+
+# ===== 命令行 =====
+if __name__ == "__main__":
+    from config import SearchConfig
+
+    parser = argparse.ArgumentParser(description="在 Unix 套接字上提供查询编码服务，多个 web worker 共享一份模型")
+    parser.add_argument("--socket", default=SearchConfig.EMBEDDING_SERVICE_SOCKET, help="Unix 套接字路径")
+    parser.add_argument("--model", default=SearchConfig.MODEL_NAME, help="SentenceTransformer 模型名称或路径")
+    parser.add_argument("--backend", default="sentence_transformers", choices=("sentence_transformers", "onnx", "onnx_fp32"))
+    parser.add_argument("--onnx-dir", default=SearchConfig.ONNX_MODEL_DIR, help="ONNX 导出目录")
+    parser.add_argument("--threads", type=int, default=SearchConfig.ENCODER_THREADS, help="ONNX Runtime 单算子线程数")
+    parser.add_argument("--max-batch-size", type=int, default=64, help="每次 encode 最多合并的文本数")
+    parser.add_argument("--max-wait-ms", type=float, default=5, help="合并等待的毫秒数")
+    args = parser.parse_args()
+    serve_embeddings(args.socket, args.model, backend=args.backend, onnx_model_dir=args.onnx_dir,
+                     intra_op_threads=args.threads, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
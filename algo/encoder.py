@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+from algo.index import select_top_k
+from algo.store import open_embeddings
+
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_INT8_MODEL_FILE = "model.int8.onnx"
+ENCODER_CONFIG_FILE = "encoder_config.json"
+
+
+# ===== ONNX Runtime 查询编码器 =====
+class OnnxQueryEncoder:
+    """
+    基于 ONNX Runtime 的查询编码器，encode 接口与 SentenceTransformer 一致，
+    默认加载动态 int8 量化后的图。
+
+    参数:
+        model_dir (str): export_onnx_encoder 导出的目录。
+        intra_op_threads (int): 单个算子内的线程数，0 为 ONNX Runtime 默认值。
+        quantized (bool): 是否加载 int8 量化图。
+    """
+
+    def __init__(self, model_dir, intra_op_threads=0, quantized=True):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(model_dir, ENCODER_CONFIG_FILE), "r", encoding="utf-8") as f:
+            encoder_config = json.load(f)
+        self.pooling = encoder_config["pooling"]
+        self.max_seq_length = encoder_config["max_seq_length"]
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        model_file = os.path.join(model_dir, ONNX_INT8_MODEL_FILE if quantized else ONNX_MODEL_FILE)
+        self.session = ort.InferenceSession(model_file, options, providers=["CPUExecutionProvider"])
+        self.input_names = {item.name for item in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+
+    def _pool(self, token_embeddings, attention_mask):
+        if self.pooling == "cls":
+            return token_embeddings[:, 0]
+        mask = attention_mask[:, :, None].astype(np.float32)
+        return (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, normalize_embeddings=True, **kwargs):
+        """
+        生成文本向量。
+
+        参数:
+            sentences (str | list): 文本或文本列表。
+            batch_size (int): 每次前向计算的文本数。
+            normalize_embeddings (bool): 是否 L2 归一化。
+
+        返回:
+            numpy.ndarray: 单条文本时形状 (dim,)，否则 (n, dim)
+        """
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else list(sentences)
+        outputs = []
+        for start in range(0, len(sentences), batch_size):
+            features = self.tokenizer(
+                sentences[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np"
+            )
+            inputs = {name: value.astype(np.int64) for name, value in features.items() if name in self.input_names}
+            token_embeddings = self.session.run(None, inputs)[0]
+            outputs.append(self._pool(token_embeddings, features["attention_mask"]))
+
+        vectors = np.concatenate(outputs).astype(np.float32)
+        if normalize_embeddings:
+            vectors /= np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        return vectors[0] if single else vectors
+
+
+def load_query_encoder(model_name, backend="sentence_transformers", onnx_model_dir=None, intra_op_threads=0,
+                       service_socket=None, service_timeout=30):
+    """
+    加载查询编码器。
+
+    参数:
+        model_name (str): SentenceTransformer 模型名称或路径。
+        backend (str): sentence_transformers / onnx（int8 量化）/ onnx_fp32 / service（独立编码服务）。
+        onnx_model_dir (str): ONNX 导出目录。
+        intra_op_threads (int): ONNX Runtime 单算子线程数。
+        service_socket (str): 编码服务的 Unix 套接字路径。
+        service_timeout (float): 编码服务单次请求超时秒数。
+
+    返回:
+        SentenceTransformer | OnnxQueryEncoder | EmbeddingServiceClient
+    """
+    if backend == "sentence_transformers":
+        # 在此导入 sentence_transformers，避免导入本模块时就加载 torch
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name, device="cpu")  # 使用CPU推理
+    if backend in ("onnx", "onnx_fp32"):
+        if not onnx_model_dir:
+            raise ValueError("使用 onnx 编码器需要配置 ONNX 导出目录")
+        return OnnxQueryEncoder(onnx_model_dir, intra_op_threads=intra_op_threads, quantized=backend == "onnx")
+    if backend == "service":
+        if not service_socket:
+            raise ValueError("使用编码服务需要配置套接字路径")
+        from algo.embedding_service import EmbeddingServiceClient
+        client = EmbeddingServiceClient(service_socket, timeout=service_timeout)
+        # 确认服务端加载的是同一个模型，否则查询向量与案例向量不在同一空间
+        served_model = client.info()["model"]
+        if served_model != str(model_name):
+            raise ValueError(f"编码服务加载的模型 {served_model} 与配置的 {model_name} 不一致")
+        return client
+    raise ValueError(f"未知的编码器类型: {backend}")
+
+
+# ===== 导出 ONNX 模型 =====
+def export_onnx_encoder(model_name, output_dir, quantize=True, opset=17):
+    """
+    将 SentenceTransformer 的 Transformer 部分导出为 ONNX 图，并可选做动态 int8 量化。
+
+    参数:
+        model_name (str): SentenceTransformer 模型名称或路径。
+        output_dir (str): 输出目录。
+        quantize (bool): 是否生成动态 int8 量化图。
+        opset (int): ONNX opset 版本。
+
+    返回:
+        str: 输出目录
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(output_dir, exist_ok=True)
+    st_model = SentenceTransformer(model_name, device="cpu")
+    transformer = st_model[0]
+    pooling = st_model[1].get_pooling_mode_str() if len(st_model) > 1 else "mean"
+    if pooling not in ("mean", "cls"):
+        raise ValueError(f"暂不支持的池化方式: {pooling}")
+
+    tokenizer = transformer.tokenizer
+    auto_model = transformer.auto_model.eval()
+    sample = tokenizer(["导出样例"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["token_embeddings"] = {0: "batch", 1: "sequence"}
+
+    model_file = os.path.join(output_dir, ONNX_MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            auto_model,
+            tuple(sample[name] for name in input_names),
+            model_file,
+            input_names=input_names,
+            output_names=["token_embeddings"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset
+        )
+    tokenizer.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, ENCODER_CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump({"pooling": pooling, "max_seq_length": st_model.max_seq_length, "source_model": str(model_name)}, f)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(model_file, os.path.join(output_dir, ONNX_INT8_MODEL_FILE), weight_type=QuantType.QInt8)
+    return output_dir
+
+
+# ===== 一致性校验 =====
+def check_encoder_parity(reference_model, encoder, embeddings, queries, top_k=20):
+    """
+    对比候选编码器与原模型：查询向量的余弦相似度，以及在现有 case_embeddings.npy 上 top_k 结果的重合率。
+    重合率接近 1 说明现有嵌入向量文件可直接配合候选编码器使用，无需重新生成。
+
+    参数:
+        reference_model (SentenceTransformer): 生成 case_embeddings.npy 的原模型。
+        encoder (OnnxQueryEncoder): 候选编码器。
+        embeddings (numpy.ndarray): 归一化的案例嵌入向量。
+        queries (list): 校验用查询文本。
+        top_k (int): 比较的结果数量。
+
+    返回:
+        dict: 余弦相似度最小值/均值与 top_k 重合率
+    """
+    reference = reference_model.encode(queries, convert_to_numpy=True, normalize_embeddings=True).astype(np.float32)
+    candidate = encoder.encode(queries, convert_to_numpy=True, normalize_embeddings=True).astype(np.float32)
+    cosine = (reference * candidate).sum(axis=1)
+
+    _, reference_top = select_top_k(reference @ embeddings.T, top_k)
+    _, candidate_top = select_top_k(candidate @ embeddings.T, top_k)
+    overlap = [len(set(a) & set(b)) / top_k for a, b in zip(reference_top.tolist(), candidate_top.tolist())]
+
+    return {
+        "queries": len(queries),
+        "cosine_min": round(float(cosine.min()), 4),
+        "cosine_mean": round(float(cosine.mean()), 4),
+        f"top{top_k}_overlap_mean": round(float(np.mean(overlap)), 4),
+        f"top{top_k}_overlap_min": round(float(np.min(overlap)), 4),
+    }
+
+
+# ===== 命令行 =====
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="导出 ONNX 查询编码器并校验与原模型的一致性")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="导出 ONNX（含 int8 量化）")
+    export_parser.add_argument("--model", required=True, help="SentenceTransformer 模型名称或路径")
+    export_parser.add_argument("--output", required=True, help="输出目录")
+    export_parser.add_argument("--no-quantize", action="store_true", help="不生成 int8 量化图")
+
+    parity_parser = subparsers.add_parser("parity", help="与原模型对比一致性")
+    parity_parser.add_argument("--model", required=True, help="SentenceTransformer 模型名称或路径")
+    parity_parser.add_argument("--onnx-dir", required=True, help="ONNX 导出目录")
+    parity_parser.add_argument("--embeddings", required=True, help="case_embeddings.npy")
+    parity_parser.add_argument("--queries", required=True, help="校验查询文件，每行一条")
+    parity_parser.add_argument("--fp32", action="store_true", help="校验未量化的 ONNX 图")
+    parity_parser.add_argument("--threads", type=int, default=0, help="ONNX Runtime 单算子线程数")
+    parity_parser.add_argument("--top-k", type=int, default=20)
+
+    args = parser.parse_args()
+    if args.command == "export":
+        print(export_onnx_encoder(args.model, args.output, quantize=not args.no_quantize))
+    else:
+        with open(args.queries, "r", encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+        reference_model = load_query_encoder(args.model)
+        encoder = OnnxQueryEncoder(args.onnx_dir, intra_op_threads=args.threads, quantized=not args.fp32)
+        report = check_encoder_parity(reference_model, encoder, open_embeddings(args.embeddings), queries, args.top_k)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
@@ -0,0 +1,175 @@
+import json
+import os
+
+import numpy as np
+
+# 与 judicial_cases_board 的分类一致：关键词包含匹配词即属于该类别（国家赔偿按“赔偿”匹配），
+# 一个案例可以属于多个类别
+CASE_CATEGORIES = {"刑事": "刑事", "民事": "民事", "行政": "行政", "国家赔偿": "赔偿", "执行": "执行"}
+
+
+def case_categories(keywords):
+    """
+    根据关键词判断案例所属类别。
+
+    参数:
+        keywords (list | str): 关键词列表或以空格分隔的关键词。
+
+    返回:
+        list: 所属类别
+    """
+    text = " ".join(keywords) if isinstance(keywords, list) else (keywords or "")
+    return [category for category, pattern in CASE_CATEGORIES.items() if pattern in text]
+
+
+# ===== 过滤位图 =====
+class CaseFilterIndex:
+    """
+    预先计算的过滤位图：每个字段的每个取值对应一个布尔数组。检索时按过滤条件合并为允许的行号，
+    向量索引只对这些行打分，带过滤的检索开销不超过不带过滤的检索。
+    同一字段的多个取值取并集，不同字段取交集。目前支持 category，法院、日期等字段可按同样方式追加。
+
+    参数:
+        bitmaps (dict): {字段: {取值: 布尔数组}}，数组长度均为语料行数。
+    """
+
+    def __init__(self, bitmaps):
+        self.bitmaps = bitmaps
+        self._subsets = {}
+
+    @property
+    def ntotal(self):
+        for values in self.bitmaps.values():
+            for bitmap in values.values():
+                return len(bitmap)
+        return 0
+
+    @classmethod
+    def build(cls, metadata):
+        """
+        从案例元数据构建位图。
+
+        参数:
+            metadata (CaseMetadataStore | list): 案例库元数据。
+
+        返回:
+            CaseFilterIndex
+        """
+        positions = {category: i for i, category in enumerate(CASE_CATEGORIES)}
+        categories = np.zeros((len(CASE_CATEGORIES), len(metadata)), dtype=bool)
+        for i in range(len(metadata)):
+            for category in case_categories(metadata[i]["关键词"]):
+                categories[positions[category], i] = True
+        return cls({"category": dict(zip(CASE_CATEGORIES, categories))})
+
+    def save(self, index_file):
+        # 先写临时文件再替换，避免并发启动的 worker 读到半个文件
+        layout = {field: list(values) for field, values in self.bitmaps.items()}
+        arrays = {f"{field}_bitmaps": np.stack(list(values.values())) for field, values in self.bitmaps.items()}
+        tmp_file = f"{index_file}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_file, layout=np.array(json.dumps(layout, ensure_ascii=False)), **arrays)
+        os.replace(tmp_file, index_file)
+
+    @classmethod
+    def load(cls, index_file):
+        with np.load(index_file) as data:
+            layout = json.loads(str(data["layout"]))
+            return cls({
+                field: dict(zip(values, data[f"{field}_bitmaps"]))
+                for field, values in layout.items()
+            })
+
+    def normalize(self, filters):
+        """
+        校验并规范化过滤条件，作为缓存键。
+
+        参数:
+            filters (dict): {字段: 取值或取值列表}，空值表示不过滤。
+
+        返回:
+            tuple: 规范化的过滤条件，不过滤时为空元组
+
+        异常:
+            ValueError: 字段或取值不受支持。
+        """
+        key = []
+        for field, values in sorted((filters or {}).items()):
+            if not values:
+                continue
+            if field not in self.bitmaps:
+                raise ValueError(f"不支持的过滤字段: {field}")
+            values = [values] if isinstance(values, str) else list(values)
+            unknown = [value for value in values if value not in self.bitmaps[field]]
+            if unknown:
+                raise ValueError(f"不支持的{field}取值: {', '.join(map(str, unknown))}")
+            key.append((field, tuple(sorted(set(values)))))
+        return tuple(key)
+
+    def subset(self, filters):
+        """
+        返回满足过滤条件的行号，同一过滤条件只计算一次。
+
+        参数:
+            filters (dict | tuple): 过滤条件或 normalize 的结果。
+
+        返回:
+            numpy.ndarray | None: 升序的 int64 行号，不过滤时为 None
+        """
+        key = filters if isinstance(filters, tuple) else self.normalize(filters)
+        if not key:
+            return None
+        positions = self._subsets.get(key)
+        if positions is None:
+            mask = np.ones(self.ntotal, dtype=bool)
+            for field, values in key:
+                mask &= np.logical_or.reduce([self.bitmaps[field][value] for value in values])
+            positions = self._subsets[key] = np.flatnonzero(mask)
+        return positions
+
+    def extend(self, deleted, records):
+        """
+        叠加增量：基础语料中失效的行不再命中任何取值，增量行按其元数据计算。
+
+        参数:
+            deleted (numpy.ndarray): 基础语料各行是否已失效的布尔数组。
+            records (list): 增量案例元数据。
+
+        返回:
+            CaseFilterIndex: 合并视图上的位图
+        """
+        delta = CaseFilterIndex.build(records)
+        return CaseFilterIndex({
+            field: {
+                value: np.concatenate([bitmap & ~deleted, delta.bitmaps[field][value]])
+                for value, bitmap in values.items()
+            }
+            for field, values in self.bitmaps.items()
+        })
+
+
+def filter_index_path(metadata_file):
+    """过滤位图文件路径：与元数据同目录、同名前缀。"""
+    return f"{os.path.splitext(metadata_file)[0]}.filters.npz"
+
+def open_filter_index(metadata_file, metadata):
+    """
+    打开过滤位图，不存在、旧于原始元数据或条数不一致时重新构建并写入磁盘。
+
+    参数:
+        metadata_file (str): 原始元数据 JSON 路径，用于定位位图文件。
+        metadata (CaseMetadataStore | list): 案例库元数据。
+
+    返回:
+        CaseFilterIndex
+    """
+    index_file = filter_index_path(metadata_file)
+    if os.path.exists(index_file) and (
+            not os.path.exists(metadata_file) or os.path.getmtime(index_file) >= os.path.getmtime(metadata_file)):
+        index = CaseFilterIndex.load(index_file)
+        if index.ntotal == len(metadata) and set(index.bitmaps.get("category", {})) == set(CASE_CATEGORIES):
+            return index
+
+    print("正在构建案例过滤位图...")
+    index = CaseFilterIndex.build(metadata)
+    index.save(index_file)
+    return index
@@ -0,0 +1,521 @@
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+
+import numpy as np
+
+from algo.index import select_top_k
+from algo.lexical import BM25Index
+from algo.metadata_store import open_metadata_store
+from algo.build_embeddings import (iter_case_chunks, case_text, case_record, case_ids_path,
+                                   write_corpus_artifacts, read_manifest)
+from utils.timing import span
+
+
+class CorpusLocked(RuntimeError):
+    """另一个增量更新或压缩正在进行。"""
+
+
+# ===== 语料版本与 id =====
+def artifact_version(*paths):
+    """
+    根据语料文件的路径、大小与修改时间计算版本号，文件被重新生成后版本号随之改变。
+
+    参数:
+        paths (str): 嵌入向量、元数据等语料文件路径。
+
+    返回:
+        str: 12 位十六进制版本号
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns};".encode("utf-8"))
+    return digest.hexdigest()[:12]
+
+def base_corpus_version(embedding_file, metadata_file):
+    """
+    基础语料版本：由 build_embeddings 生成的语料使用 manifest 中的版本号（manifest 最后替换，
+    不会在产物替换到一半时判定为新版本），否则使用文件大小与修改时间。
+    """
+    manifest = read_manifest(embedding_file)
+    if manifest is not None:
+        return manifest["version"]
+    return artifact_version(embedding_file, metadata_file)
+
+def load_case_ids(embedding_file, count):
+    """
+    读取与嵌入向量逐行对应的案例 id。旧语料没有 id 文件，沿用 id = 行号 + 1。
+
+    参数:
+        embedding_file (str): 嵌入向量文件路径。
+        count (int): 嵌入向量行数。
+
+    返回:
+        numpy.ndarray: int64 id 数组
+    """
+    ids_file = case_ids_path(embedding_file)
+    if read_manifest(embedding_file) is not None and os.path.exists(ids_file):
+        ids = np.load(ids_file)
+        if len(ids) != count:
+            raise ValueError(f"{ids_file} 有 {len(ids)} 行，与嵌入向量 {count} 行不一致")
+        return ids.astype(np.int64, copy=False)
+    return np.arange(1, count + 1, dtype=np.int64)
+
+
+class CaseIdLookup:
+    """案例 id -> 语料行号，按排序后的 id 二分查找，不为每个 id 创建 Python 对象。"""
+
+    def __init__(self, ids):
+        self._order = np.argsort(ids, kind="stable")
+        self._sorted = np.asarray(ids)[self._order]
+
+    def position(self, case_id):
+        """返回案例所在行号，不存在时返回 None。"""
+        i = int(np.searchsorted(self._sorted, case_id))
+        if i < len(self._sorted) and self._sorted[i] == case_id:
+            return int(self._order[i])
+        return None
+
+
+# ===== 增量文件 =====
+def delta_path(embedding_file):
+    """增量文件路径：新增 / 修改案例的向量与元数据，以及被删除或替换的基础语料 id。"""
+    return f"{os.path.splitext(embedding_file)[0]}.delta.npz"
+
+def _lock_path(embedding_file):
+    return f"{os.path.splitext(embedding_file)[0]}.update.lock"
+
+@contextmanager
+def corpus_update_lock(embedding_file):
+    """
+    增量更新与压缩互斥（跨进程），避免压缩丢掉压缩期间写入的增量。
+    使用 flock 文件锁，持有锁的进程退出（包括 worker 重启时被终止的后台线程）后由内核释放，
+    锁文件本身保留，不会因残留而永久阻塞更新。
+
+    异常:
+        CorpusLocked: 锁已被其他进程占用。
+    """
+    lock_file = _lock_path(embedding_file)
+    fd = os.open(lock_file, os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            holder = os.read(fd, 32).decode("utf-8", "replace").strip() or "未知"
+            raise CorpusLocked(f"语料正在更新或压缩（锁文件 {lock_file}，进程 {holder}）")
+        # 记录持有锁的进程，便于排查
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode("utf-8"))
+        try:
+            yield
+        finally:
+            os.ftruncate(fd, 0)
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+class CaseDelta:
+    """
+    基础语料之上的增量：新增 / 修改后的案例整行写入增量，被删除或被替换的基础语料行记为墓碑。
+    增量记录所基于的基础语料版本，基础语料重新生成或压缩后旧增量自动失效。
+
+    参数:
+        base_version (str): 基础语料版本。
+        model (str): 编码模型，须与基础语料一致。
+        ids (numpy.ndarray): 增量案例 id。
+        vectors (numpy.ndarray): 增量案例向量（已归一化）。
+        records (list): 增量案例元数据。
+        tombstones (numpy.ndarray): 基础语料中失效的案例 id（已排序）。
+    """
+
+    def __init__(self, base_version, model, ids, vectors, records, tombstones):
+        self.base_version = base_version
+        self.model = model
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.vectors = np.asarray(vectors, dtype=np.float32)
+        self.records = records
+        self.tombstones = np.unique(np.asarray(tombstones, dtype=np.int64))
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def size(self):
+        """增量行数与墓碑数之和，用于判断是否需要压缩。"""
+        return len(self.ids) + len(self.tombstones)
+
+    @classmethod
+    def empty(cls, base_version, model, dim):
+        return cls(base_version, model, [], np.empty((0, dim), dtype=np.float32), [], [])
+
+    def save(self, path):
+        tmp_file = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_file,
+            base_version=np.array(self.base_version),
+            model=np.array(self.model),
+            ids=self.ids,
+            vectors=self.vectors,
+            records=np.array(json.dumps(self.records, ensure_ascii=False)),
+            tombstones=self.tombstones
+        )
+        os.replace(tmp_file, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(str(data["base_version"]), str(data["model"]), data["ids"], data["vectors"],
+                       json.loads(str(data["records"])), data["tombstones"])
+
+
+def load_case_delta(embedding_file, base_version):
+    """
+    读取增量文件，不存在或基于其他版本的基础语料时返回 None。
+
+    参数:
+        embedding_file (str): 嵌入向量文件路径。
+        base_version (str): 当前基础语料版本。
+
+    返回:
+        CaseDelta | None
+    """
+    path = delta_path(embedding_file)
+    if not os.path.exists(path):
+        return None
+    delta = CaseDelta.load(path)
+    if delta.base_version != base_version:
+        print(f"增量文件 {path} 基于旧的基础语料 {delta.base_version}，已忽略。")
+        return None
+    return delta
+
+
+# ===== 基础语料 + 增量的合并视图 =====
+# 行号编排：[0, 基础语料行数) 为基础语料，之后依次为增量行
+class SegmentedIndex:
+    """
+    基础语料索引 + 增量向量：失效行（墓碑）以允许行号的形式下推到基础索引（FAISS 为 IDSelector），
+    检索开销不随墓碑数增长；增量部分精确打分，两路按相似度合并。增量通常远小于基础语料，无需重建基础索引。
+
+    参数:
+        base_index: 基础语料索引（BruteForceIndex / QuantizedEmbeddingStore / FaissIndex）。
+        deleted (numpy.ndarray): 基础语料各行是否已失效的布尔数组。
+        delta_vectors (numpy.ndarray): 增量向量。
+    """
+
+    def __init__(self, base_index, deleted, delta_vectors):
+        self.base_index = base_index
+        self.backend = base_index.backend
+        self.deleted = deleted
+        self.n_deleted = int(deleted.sum())
+        # 基础语料中仍有效的行号，没有墓碑时为 None（不过滤）
+        self.live_rows = np.flatnonzero(~deleted) if self.n_deleted else None
+        self.delta_vectors = delta_vectors
+
+    @property
+    def ntotal(self):
+        return self.base_index.ntotal + len(self.delta_vectors)
+
+    def set_search_params(self, **params):
+        self.base_index.set_search_params(**params)
+
+    def search(self, query_embeddings, top_k, trace=None, subset=None):
+        """
+        检索最相似的 top_k 个案例。
+
+        参数:
+            query_embeddings (numpy.ndarray): 查询向量，形状 (nq, dim)。
+            top_k (int): 返回数量。
+            trace (SearchTrace): 可选，记录 score / top_k / delta 阶段耗时。
+            subset (numpy.ndarray): 可选，合并视图中允许的行号（升序，已排除失效行）。
+
+        返回:
+            tuple: (scores, indices)，按相似度降序，indices 为合并视图中的行号。
+        """
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        base_n = self.base_index.ntotal
+        if subset is None:
+            base_scores, base_indices = self.base_index.search(queries, top_k, trace=trace, subset=self.live_rows)
+            delta_rows = np.arange(len(self.delta_vectors))
+        else:
+            split = np.searchsorted(subset, base_n)
+            base_scores, base_indices = self.base_index.search(queries, top_k, trace=trace, subset=subset[:split])
+            delta_rows = subset[split:] - base_n
+        with span(trace, "delta"):
+            delta_scores, delta_indices = select_top_k(queries @ self.delta_vectors[delta_rows].T, top_k)
+            delta_indices = delta_rows[delta_indices]
+
+        # 近似索引候选不足时以 -1 填充，按行去掉后合并；各行结果数不同时以 -1 / -inf 补齐到相同宽度
+        width = min(top_k, base_n + len(delta_rows) if subset is None else len(subset))
+        out_scores = np.full((len(queries), width), -np.inf, dtype=np.float32)
+        out_indices = np.full((len(queries), width), -1, dtype=np.int64)
+        for row, (scores, indices, extra_scores, extra_indices) in enumerate(zip(base_scores, base_indices,
+                                                                                 delta_scores, delta_indices)):
+            live = indices >= 0
+            live[live] = ~self.deleted[indices[live]]
+            scores = np.concatenate([scores[live], extra_scores])
+            indices = np.concatenate([indices[live], extra_indices + base_n])
+            order = np.argsort(-scores, kind="stable")[:width]
+            out_scores[row, :len(order)] = scores[order]
+            out_indices[row, :len(order)] = indices[order]
+        return out_scores, out_indices
+
+
+class SegmentedLexicalIndex:
+    """
+    基础语料 BM25 + 增量 BM25：增量部分单独构建，沿用基础语料的 idf 与平均长度，得分可直接比较，
+    基础语料的失效行以允许行号下推，两路按得分合并。压缩后回到单一索引。
+    """
+    backend = "bm25"
+
+    def __init__(self, base_index, deleted, delta_index):
+        self.base_index = base_index
+        self.deleted = deleted
+        self.n_deleted = int(deleted.sum())
+        self.live_rows = np.flatnonzero(~deleted) if self.n_deleted else None
+        self.delta_index = delta_index
+
+    @property
+    def ntotal(self):
+        return self.base_index.ntotal + (self.delta_index.ntotal if self.delta_index is not None else 0)
+
+    def search(self, query, top_k, subset=None):
+        base_n = self.base_index.ntotal
+        if subset is None:
+            results = self.base_index.search(query, top_k, subset=self.live_rows)
+            delta_subset = None
+        else:
+            split = np.searchsorted(subset, base_n)
+            results = self.base_index.search(query, top_k, subset=subset[:split])
+            delta_subset = subset[split:] - base_n
+        if self.delta_index is not None:
+            results.extend((i + base_n, score) for i, score in self.delta_index.search(query, top_k, subset=delta_subset))
+        results.sort(key=lambda item: -item[1])
+        return results[:top_k]
+
+
+class SegmentedMetadata:
+    """基础语料元数据 + 增量元数据，按合并视图的行号寻址。"""
+
+    def __init__(self, base_metadata, delta_records):
+        self.base_metadata = base_metadata
+        self.delta_records = delta_records
+
+    def __len__(self):
+        return len(self.base_metadata) + len(self.delta_records)
+
+    def __getitem__(self, index):
+        base_n = len(self.base_metadata)
+        return self.base_metadata[index] if index < base_n else self.delta_records[index - base_n]
+
+
+def segment_corpus(base_ids, base_metadata, base_index, base_lexical_index, base_filter_index, delta,
+                   tokenizer="bigram"):
+    """
+    将增量叠加到基础语料上。
+
+    参数:
+        base_ids (numpy.ndarray): 基础语料案例 id。
+        base_metadata (CaseMetadataStore | list): 基础语料元数据。
+        base_index: 基础语料向量索引。
+        base_lexical_index (BM25Index): 基础语料 BM25 索引，为空时不做关键词检索。
+        base_filter_index (CaseFilterIndex): 基础语料过滤位图。
+        delta (CaseDelta): 增量。
+        tokenizer (str): 增量 BM25 的分词方式，须与基础语料一致。
+
+    返回:
+        tuple: (ids, metadata, index, lexical_index, filter_index)，ids 为合并视图各行的案例 id
+    """
+    deleted = np.isin(base_ids, delta.tombstones)
+    # 失效行的 id 记为 -1，按 id 查找时只命中生效的那一行
+    ids = np.concatenate([np.where(deleted, -1, base_ids), delta.ids])
+    metadata = SegmentedMetadata(base_metadata, delta.records)
+    index = SegmentedIndex(base_index, deleted, delta.vectors)
+    lexical_index = None
+    if base_lexical_index is not None:
+        delta_lexical_index = BM25Index.build(delta.records, tokenizer=tokenizer,
+                                              reference=base_lexical_index) if len(delta) else None
+        lexical_index = SegmentedLexicalIndex(base_lexical_index, deleted, delta_lexical_index)
+    filter_index = base_filter_index.extend(deleted, delta.records)
+    return ids, metadata, index, lexical_index, filter_index
+
+
+# ===== 增量同步 =====
+def _content_digest(title, keywords, basic_facts):
+    text = case_text(title, keywords, basic_facts)
+    return int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+
+def _record_digest(record):
+    return _content_digest(record["案例"], " ".join(record["关键词"]), record["基本案情"])
+
+def _base_digests(embedding_file, metadata, base_version):
+    """基础语料各行的内容摘要，按基础语料版本缓存，之后的同步不再逐行读取元数据。"""
+    digest_file = f"{os.path.splitext(embedding_file)[0]}.digests.npz"
+    if os.path.exists(digest_file):
+        with np.load(digest_file) as data:
+            if str(data["base_version"]) == base_version:
+                return data["digests"]
+    print("正在计算基础语料内容摘要...")
+    digests = np.fromiter((_record_digest(metadata[i]) for i in range(len(metadata))),
+                          dtype=np.uint64, count=len(metadata))
+    tmp_file = f"{digest_file}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_file, base_version=np.array(base_version), digests=digests)
+    os.replace(tmp_file, digest_file)
+    return digests
+
+def sync_case_updates(db_file, embedding_file, metadata_file, model_name=None, batch_size=32, chunk_size=4096):
+    """
+    将 judicial_cases 表的变化写入增量文件：按内容摘要找出新增与修改的案例，只编码这些案例；
+    表中已不存在的案例记为墓碑。编码量与变化量成正比，线上进程检测到增量文件变化后
+    只重新叠加增量，基础语料索引不变。
+
+    参数:
+        db_file (str): SQLite 数据库路径。
+        embedding_file (str): 基础语料嵌入向量路径（须由 build_embeddings 生成）。
+        metadata_file (str): 基础语料元数据路径。
+        model_name (str): 编码模型，默认为 manifest 中记录的模型。
+        batch_size (int): 每次前向计算的文本数。
+        chunk_size (int): 读取数据库的分块行数。
+
+    返回:
+        dict: 新增 / 修改 / 删除的案例数及增量规模
+    """
+    with corpus_update_lock(embedding_file):
+        manifest = read_manifest(embedding_file)
+        if manifest is None:
+            raise ValueError("增量更新需要由 python -m algo.build_embeddings 生成的语料（含 manifest 与案例 id）")
+        model_name = model_name or manifest["model"]
+        if str(model_name) != manifest["model"]:
+            raise ValueError(f"编码模型 {model_name} 与基础语料的 {manifest['model']} 不一致")
+
+        base_version = manifest["version"]
+        base_ids = load_case_ids(embedding_file, manifest["count"])
+        delta = load_case_delta(embedding_file, base_version) or CaseDelta.empty(base_version, manifest["model"],
+                                                                               manifest["dim"])
+        metadata = open_metadata_store(metadata_file)
+
+        # 当前生效的案例 id 及内容摘要：未失效的基础语料行 + 增量行
+        base_live = ~np.isin(base_ids, delta.tombstones)
+        live_ids = np.concatenate([base_ids[base_live], delta.ids])
+        live_digests = np.concatenate([
+            _base_digests(embedding_file, metadata, base_version)[base_live],
+            np.array([_record_digest(record) for record in delta.records], dtype=np.uint64)
+        ])
+        order = np.argsort(live_ids)
+        live_ids, live_digests = live_ids[order], live_digests[order]
+
+        seen = np.zeros(len(live_ids), dtype=bool)
+        changed_rows, added = [], 0
+        for rows in iter_case_chunks(db_file, chunk_size):
+            ids = np.array([row[0] for row in rows], dtype=np.int64)
+            digests = np.array([_content_digest(*row[1:]) for row in rows], dtype=np.uint64)
+            if len(live_ids):
+                positions = np.minimum(np.searchsorted(live_ids, ids), len(live_ids) - 1)
+                found = live_ids[positions] == ids
+                seen[positions[found]] = True
+                stale = ~found | (live_digests[positions] != digests)
+            else:
+                found = np.zeros(len(ids), dtype=bool)
+                stale = ~found
+            changed_rows.extend(row for row, is_stale in zip(rows, stale) if is_stale)
+            added += int((~found).sum())
+        deleted_ids = live_ids[~seen]
+
+        summary = {"added": added, "updated": len(changed_rows) - added, "deleted": len(deleted_ids)}
+        if changed_rows or len(deleted_ids):
+            vectors = np.empty((0, delta.vectors.shape[1]), dtype=np.float32)
+            if changed_rows:
+                from algo.encoder import load_query_encoder
+                model = load_query_encoder(model_name)
+                vectors = model.encode(
+                    [case_text(title, keywords, basic_facts) for _, title, keywords, basic_facts in changed_rows],
+                    batch_size=batch_size,
+                    convert_to_numpy=True,
+                    normalize_embeddings=True
+                ).astype(np.float32)
+
+            removed = np.concatenate([np.array([row[0] for row in changed_rows], dtype=np.int64), deleted_ids])
+            keep = ~np.isin(delta.ids, removed)
+            delta = CaseDelta(
+                base_version, manifest["model"],
+                np.concatenate([delta.ids[keep], [row[0] for row in changed_rows]]),
+                np.concatenate([delta.vectors[keep], vectors]),
+                [record for record, kept in zip(delta.records, keep) if kept] + [case_record(*row) for row in changed_rows],
+                np.concatenate([delta.tombstones, base_ids[np.isin(base_ids, removed)]])
+            )
+            delta.save(delta_path(embedding_file))
+
+        summary.update({"delta_rows": len(delta), "tombstones": len(delta.tombstones), "base_rows": len(base_ids)})
+        return summary
+
+
+# ===== 压缩 =====
+def compact_case_corpus(embedding_file, metadata_file, chunk_size=4096):
+    """
+    将增量合并进基础语料：去掉墓碑行、追加增量行，原子写出新的基础语料后删除增量文件。
+    新 manifest 替换后旧增量即失效，线上进程不会把增量重复叠加到新语料上。
+
+    参数:
+        embedding_file (str): 基础语料嵌入向量路径。
+        metadata_file (str): 基础语料元数据路径。
+        chunk_size (int): 每次复制的行数。
+
+    返回:
+        dict | None: 新的 manifest，没有增量时返回 None
+    """
+    with corpus_update_lock(embedding_file):
+        manifest = read_manifest(embedding_file)
+        if manifest is None:
+            return None
+        delta = load_case_delta(embedding_file, manifest["version"])
+        if delta is None:
+            return None
+
+        embeddings = np.load(embedding_file, mmap_mode="r")
+        ids = load_case_ids(embedding_file, len(embeddings))
+        metadata = open_metadata_store(metadata_file)
+        keep = ~np.isin(ids, delta.tombstones)
+
+        def chunks():
+            for start in range(0, len(ids), chunk_size):
+                positions = np.flatnonzero(keep[start:start + chunk_size]) + start
+                if len(positions):
+                    yield ids[positions], embeddings[positions], [
+                        dict(metadata[int(i)], id=int(ids[i])) for i in positions
+                    ]
+            if len(delta):
+                yield delta.ids, delta.vectors, delta.records
+
+        print(f"正在压缩语料：{int(keep.sum())} 行基础语料 + {len(delta)} 行增量...")
+        new_manifest = write_corpus_artifacts(chunks(), int(keep.sum()) + len(delta), manifest["dim"],
+                                              embedding_file, metadata_file, manifest["model"], manifest["source"])
+        os.remove(delta_path(embedding_file))
+        return new_manifest
+
+
+# ===== 命令行 =====
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="案例语料增量更新与压缩")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    sync_parser = subparsers.add_parser("sync", help="将数据库中新增 / 修改 / 删除的案例写入增量文件")
+    sync_parser.add_argument("--db", default="instance/database.db", help="SQLite 数据库路径")
+    sync_parser.add_argument("--embedding-file", required=True, help="基础语料嵌入向量路径")
+    sync_parser.add_argument("--metadata-file", required=True, help="基础语料元数据路径")
+    sync_parser.add_argument("--batch-size", type=int, default=32, help="每次前向计算的文本数")
+
+    compact_parser = subparsers.add_parser("compact", help="将增量合并进基础语料")
+    compact_parser.add_argument("--embedding-file", required=True, help="基础语料嵌入向量路径")
+    compact_parser.add_argument("--metadata-file", required=True, help="基础语料元数据路径")
+
+    args = parser.parse_args()
+    if args.command == "sync":
+        summary = sync_case_updates(args.db, args.embedding_file, args.metadata_file, batch_size=args.batch_size)
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+    else:
+        manifest = compact_case_corpus(args.embedding_file, args.metadata_file)
+        print("没有需要压缩的增量。" if manifest is None else json.dumps(manifest, ensure_ascii=False, indent=2))
@@ -0,0 +1,272 @@
+import os
+import numpy as np
+
+from utils.timing import span
+
+try:
+    import faiss
+except ImportError:  # faiss 为可选依赖，缺失时只能使用精确检索
+    faiss = None
+
+
+# ===== 向量工具函数 =====
+def l2_normalize(vectors):
+    """
+    将向量转为 float32 并按行做 L2 归一化，加载时执行一次，检索时直接用内积代替余弦相似度。
+
+    参数:
+        vectors (numpy.ndarray): 形状 (n, dim) 的向量矩阵。
+
+    返回:
+        numpy.ndarray: 归一化后的 float32 矩阵。
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    # 已归一化（normalize_embeddings=True 生成）时不复制
+    if np.allclose(norms, 1.0, atol=1e-4):
+        return vectors
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def select_top_k(scores, top_k):
+    """
+    部分选择 top_k：先 argpartition 取出候选，再只对 top_k 个候选排序，复杂度 O(n + k log k)。
+
+    参数:
+        scores (numpy.ndarray): 形状 (nq, n) 的相似度矩阵。
+        top_k (int): 返回数量。
+
+    返回:
+        tuple: (scores, indices)，形状均为 (nq, top_k)，按相似度降序。
+    """
+    n = scores.shape[1]
+    top_k = min(top_k, n)
+    if top_k <= 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(scores.dtype), empty.astype(np.int64)
+    if top_k < n:
+        candidates = np.argpartition(scores, n - top_k, axis=1)[:, n - top_k:]
+    else:
+        candidates = np.tile(np.arange(n), (scores.shape[0], 1))
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1)
+    indices = np.take_along_axis(candidates, order, axis=1)
+    return np.take_along_axis(candidate_scores, order, axis=1), indices
+
+# 分块打分每块的行数：临时 float32 矩阵约 SCORE_CHUNK_SIZE x dim x 4 字节（1024 维约 16MB）
+SCORE_CHUNK_SIZE = 4096
+
+def chunked_top_k(queries, vectors, top_k, subset=None, scales=None, chunk_size=SCORE_CHUNK_SIZE):
+    """
+    分块打分并逐块合并当前的 top_k：每次只读取并转换 chunk_size 行，
+    临时内存与语料规模、过滤条件覆盖的行数无关（量化向量或内存映射上的过滤检索）。
+
+    参数:
+        queries (numpy.ndarray): float32 查询向量，形状 (nq, dim)。
+        vectors (numpy.ndarray): 被检索的向量（float32 / float16 / int8，可为内存映射）。
+        top_k (int): 返回数量。
+        subset (numpy.ndarray): 可选，只对这些行号（升序）打分。
+        scales (numpy.ndarray): 可选，每行的缩放系数（int8 量化）。
+        chunk_size (int): 每块行数。
+
+    返回:
+        tuple: (scores, indices)，形状均为 (nq, min(top_k, 行数))，按相似度降序，indices 为 vectors 中的行号。
+    """
+    total = vectors.shape[0] if subset is None else len(subset)
+    best_scores = np.empty((len(queries), 0), dtype=np.float32)
+    best_indices = np.empty((len(queries), 0), dtype=np.int64)
+    for start in range(0, total, chunk_size):
+        rows = np.arange(start, min(start + chunk_size, total)) if subset is None else subset[start:start + chunk_size]
+        chunk = vectors[start:start + chunk_size] if subset is None else vectors[rows]
+        scores = queries @ np.asarray(chunk, dtype=np.float32).T
+        if scales is not None:
+            scores *= np.asarray(scales[start:start + chunk_size] if subset is None else scales[rows])
+        best_scores, order = select_top_k(np.concatenate([best_scores, scores], axis=1), top_k)
+        candidates = np.concatenate([best_indices, np.broadcast_to(rows, scores.shape)], axis=1)
+        best_indices = np.take_along_axis(candidates, order, axis=1)
+    return best_scores, best_indices
+
+
+# ===== 精确检索索引 =====
+class BruteForceIndex:
+    """
+    精确检索：案例向量在加载时已归一化，直接用内积打分并部分选择 top_k。
+    """
+    backend = "brute"
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+    @property
+    def ntotal(self):
+        return self.embeddings.shape[0]
+
+    def set_search_params(self, **params):
+        # 精确检索没有可调参数
+        pass
+
+    def search(self, query_embeddings, top_k, trace=None, subset=None):
+        """
+        检索最相似的 top_k 个案例。
+
+        参数:
+            query_embeddings (numpy.ndarray): 查询向量，形状 (nq, dim)。
+            top_k (int): 返回数量。
+            trace (SearchTrace): 可选，记录 score / top_k 阶段耗时。
+            subset (numpy.ndarray): 可选，只在这些行号（升序）中检索，只对这些行打分。
+
+        返回:
+            tuple: (scores, indices)，形状均为 (nq, top_k)，按相似度降序。
+        """
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if subset is not None:
+            # 分块读取允许的行，不复制整个过滤后的子矩阵；打分与选择交替进行，整体记为 score
+            with span(trace, "score"):
+                return chunked_top_k(queries, self.embeddings, top_k, subset=subset)
+        with span(trace, "score"):
+            similarities = queries @ self.embeddings.T
+        with span(trace, "top_k"):
+            return select_top_k(similarities, top_k)
+
+
+# ===== FAISS 近似检索索引 =====
+class FaissIndex:
+    """
+    FAISS 近似最近邻索引（IVF / HNSW），使用内积度量（向量已归一化，等价于余弦相似度）。
+    """
+
+    def __init__(self, index, backend):
+        self.index = index
+        self.backend = backend
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal
+
+    def set_search_params(self, nprobe=None, ef_search=None):
+        """
+        调整召回率/延迟参数，可在运行时修改。
+
+        参数:
+            nprobe (int): IVF 每次查询扫描的聚类数，越大召回越高、延迟越大。
+            ef_search (int): HNSW 查询时的候选队列长度，越大召回越高、延迟越大。
+        """
+        if self.backend == "ivf" and nprobe is not None:
+            self.index.nprobe = nprobe
+        if self.backend == "hnsw" and ef_search is not None:
+            self.index.hnsw.efSearch = ef_search
+
+    def _subset_params(self, subset):
+        # 过滤条件以位图 IDSelector 下推到 faiss，检索过程中跳过不满足条件的向量
+        mask = np.zeros(self.ntotal, dtype=bool)
+        mask[subset] = True
+        bitmap = np.packbits(mask, bitorder="little")
+        selector = faiss.IDSelectorBitmap(self.ntotal, faiss.swig_ptr(bitmap))
+        if self.backend == "ivf":
+            params = faiss.SearchParametersIVF(sel=selector, nprobe=self.index.nprobe)
+        else:
+            params = faiss.SearchParametersHNSW(sel=selector, efSearch=self.index.hnsw.efSearch)
+        # 位图须在检索结束前保持存活
+        return params, bitmap
+
+    def search(self, query_embeddings, top_k, trace=None, subset=None):
+        """
+        检索最相似的 top_k 个案例，接口与 BruteForceIndex 一致。
+
+        返回:
+            tuple: (scores, indices)，按相似度降序；某个查询的候选不足 top_k 时，该行末尾 indices 为 -1、scores 为 -inf。
+        """
+        queries = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+        # faiss 内部打分与选择不可拆分，整体记为 score
+        with span(trace, "score"):
+            if subset is None:
+                scores, indices = self.index.search(queries, min(top_k, self.ntotal))
+            elif len(subset) == 0:
+                return np.empty((len(queries), 0), dtype=np.float32), np.empty((len(queries), 0), dtype=np.int64)
+            else:
+                params, bitmap = self._subset_params(subset)
+                scores, indices = self.index.search(queries, min(top_k, len(subset)), params=params)
+        # 候选不足时 faiss 以 -1 填充：保持 (nq, top_k) 形状，填充位置的得分置为 -inf，
+        # 由调用方按行过滤 indices < 0 的位置（同一批中其他查询的结果不受影响）
+        scores[indices < 0] = -np.inf
+        return scores, indices
+
+
+def _build_faiss_index(embeddings, backend, nlist, hnsw_m, ef_construction):
+    vectors = np.ascontiguousarray(l2_normalize(embeddings))
+    dim = vectors.shape[1]
+
+    if backend == "ivf":
+        # 聚类数不能超过样本数
+        nlist = max(1, min(nlist, vectors.shape[0]))
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+    else:
+        index = faiss.IndexHNSWFlat(dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction
+
+    index.add(vectors)
+    return index
+
+
+# ===== 索引构建函数 =====
+def build_case_index(embeddings, backend="brute", index_file=None, nlist=1024, nprobe=16,
+                     hnsw_m=32, ef_construction=200, ef_search=64, embedding_file=None, rescore_candidates=0,
+                     n_shards=0, pca_dim=128):
+    """
+    根据配置构建案例向量索引。
+
+    参数:
+        embeddings (numpy.ndarray): 预计算的案例嵌入向量。
+        backend (str): 索引类型，brute（精确）/ float16 / int8（量化全量扫描）/ pca（降维打分 + 精确重排）/ ivf / hnsw /
+            sharded（多进程分片精确检索）。
+        index_file (str): FAISS 索引缓存文件路径，存在且条数一致时直接加载，否则构建后写入。
+        nlist (int): IVF 聚类数。
+        nprobe (int): IVF 查询扫描的聚类数。
+        hnsw_m (int): HNSW 每个节点的邻居数。
+        ef_construction (int): HNSW 构建时的候选队列长度。
+        ef_search (int): HNSW 查询时的候选队列长度。
+        embedding_file (str): 原始嵌入向量文件路径，量化索引据此定位/生成量化文件，FAISS 索引据此判断缓存是否过期。
+        rescore_candidates (int): 量化 / 降维索引用 float32 向量精确重排的候选数。
+        n_shards (int): 分片检索的子进程数，0 为 CPU 核数。
+        pca_dim (int): pca 索引降维后的维度。
+
+    返回:
+        BruteForceIndex | QuantizedEmbeddingStore | PCAEmbeddingStore | FaissIndex | ShardedIndex
+    """
+    if backend == "brute":
+        return BruteForceIndex(embeddings)
+    if backend in ("float16", "int8"):
+        # 在函数内导入，避免与 algo.store 循环导入
+        from algo.store import QuantizedEmbeddingStore
+        return QuantizedEmbeddingStore(embeddings, embedding_file, dtype=backend,
+                                       rescore_candidates=rescore_candidates)
+    if backend == "pca":
+        from algo.store import PCAEmbeddingStore
+        return PCAEmbeddingStore(embeddings, embedding_file, dim=pca_dim, rescore_candidates=rescore_candidates)
+    if backend == "sharded":
+        from algo.shards import ShardedIndex
+        return ShardedIndex(embedding_file, embeddings.shape[0], n_shards=n_shards)
+    if backend not in ("ivf", "hnsw"):
+        raise ValueError(f"未知的索引类型: {backend}")
+    if faiss is None:
+        raise ImportError("使用 ivf / hnsw 索引需要安装 faiss-cpu")
+
+    index = None
+    if index_file and os.path.exists(index_file):
+        index = faiss.read_index(index_file)
+        if index.ntotal != embeddings.shape[0] or (
+                embedding_file and os.path.getmtime(index_file) < os.path.getmtime(embedding_file)):
+            print(f"索引文件 {index_file} 与嵌入向量不一致，重新构建。")
+            index = None
+
+    if index is None:
+        print(f"正在构建 {backend} 索引...")
+        index = _build_faiss_index(embeddings, backend, nlist, hnsw_m, ef_construction)
+        if index_file:
+            faiss.write_index(index, index_file)
+
+    case_index = FaissIndex(index, backend)
+    case_index.set_search_params(nprobe=nprobe, ef_search=ef_search)
+    return case_index
@@ -0,0 +1,256 @@
+import argparse
+import os
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from algo.index import select_top_k
+from algo.metadata_store import open_metadata_store
+
+try:
+    import jieba
+    jieba.setLogLevel(60)
+except ImportError:  # jieba 缺失时退化为字符二元组
+    jieba = None
+
+# 参与检索的字段及权重（标题、关键词中的法条名、当事人名更重要）
+DEFAULT_FIELD_WEIGHTS = {"案例": 2, "关键词": 2, "基本案情": 1}
+# 去掉标点、空白等不参与检索的字符
+_NON_WORD = re.compile(r"[^\w]+", re.UNICODE)
+
+
+# ===== 分词 =====
+def char_bigrams(text):
+    """字符二元组，单字文本返回单字。"""
+    tokens = []
+    for segment in _NON_WORD.split(text):
+        if len(segment) == 1:
+            tokens.append(segment)
+        tokens.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+    return tokens
+
+def tokenize(text, tokenizer="bigram"):
+    """
+    中文分词。
+
+    参数:
+        text (str): 输入文本。
+        tokenizer (str): bigram（字符二元组）/ jieba（搜索引擎模式）。
+
+    返回:
+        list: 词项列表
+    """
+    text = text.lower()
+    if tokenizer == "jieba" and jieba is not None:
+        return [token for token in jieba.lcut_for_search(text) if not _NON_WORD.fullmatch(token)]
+    return char_bigrams(text)
+
+
+# ===== BM25 倒排索引 =====
+class BM25Index:
+    """
+    BM25 倒排索引，倒排表以 CSR 数组存储：词项 t 的倒排为
+    doc_ids[offsets[t]:offsets[t+1]] 与对应的词频 tfs。
+
+    参数:
+        vocab (dict): 词项 -> 词项编号。
+        offsets (numpy.ndarray): 每个词项倒排表的起始位置，长度为词表大小 + 1。
+        doc_ids (numpy.ndarray): 倒排表中的案例索引。
+        tfs (numpy.ndarray): 倒排表中的（加权）词频。
+        doc_lengths (numpy.ndarray): 每个案例的（加权）长度。
+        tokenizer (str): 构建时使用的分词方式，查询须一致。
+        k1 (float): BM25 词频饱和参数。
+        b (float): BM25 长度归一化参数。
+    """
+    backend = "bm25"
+
+    def __init__(self, vocab, offsets, doc_ids, tfs, doc_lengths, tokenizer="bigram", k1=1.2, b=0.75,
+                 reference=None):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.tokenizer = tokenizer
+        self.k1 = k1
+        self.b = b
+
+        n = len(doc_lengths)
+        document_frequency = np.diff(offsets).astype(np.float32)
+        if reference is None:
+            self.idf = np.log(1 + (n - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+            self.average_length = float(doc_lengths.mean()) if n else 1.0
+        else:
+            # 沿用参照索引的词项统计，得分与参照索引可比；参照中没有的词项按只出现一次计算
+            unseen_idf = np.log(1 + (reference.ntotal + 0.5) / 1.5)
+            terms = sorted(vocab, key=vocab.get)
+            self.idf = np.array([reference.idf[reference.vocab[term]] if term in reference.vocab else unseen_idf
+                                 for term in terms], dtype=np.float32)
+            self.average_length = reference.average_length
+        average_length = self.average_length
+        # 预先计算每个案例的长度归一化项
+        self._length_norm = (k1 * (1 - b + b * doc_lengths / max(average_length, 1e-9))).astype(np.float32)
+
+    @property
+    def ntotal(self):
+        return len(self.doc_lengths)
+
+    @classmethod
+    def build(cls, metadata, field_weights=None, tokenizer="bigram", reference=None):
+        """
+        从案例元数据构建索引。
+
+        参数:
+            metadata (CaseMetadataStore | list): 案例库元数据。
+            field_weights (dict): 字段 -> 权重。
+            tokenizer (str): bigram / jieba。
+            reference (BM25Index): 可选，沿用其 idf 与平均长度（如为增量案例单独建索引时）。
+
+        返回:
+            BM25Index
+        """
+        field_weights = field_weights or DEFAULT_FIELD_WEIGHTS
+        postings = defaultdict(list)
+        doc_lengths = np.zeros(len(metadata), dtype=np.float32)
+
+        for doc_id in range(len(metadata)):
+            record = metadata[doc_id]
+            counts = Counter()
+            for field, weight in field_weights.items():
+                value = record[field]
+                if isinstance(value, list):
+                    value = " ".join(value)
+                for token in tokenize(value or "", tokenizer):
+                    counts[token] += weight
+            doc_lengths[doc_id] = sum(counts.values())
+            for token, tf in counts.items():
+                postings[token].append((doc_id, tf))
+
+        terms = sorted(postings)
+        vocab = {term: i for i, term in enumerate(terms)}
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(postings[term]) for term in terms])
+        doc_ids = np.empty(offsets[-1], dtype=np.int32)
+        tfs = np.empty(offsets[-1], dtype=np.float32)
+        for term in terms:
+            start, end = offsets[vocab[term]], offsets[vocab[term] + 1]
+            doc_ids[start:end], tfs[start:end] = zip(*postings[term])
+        return cls(vocab, offsets, doc_ids, tfs, doc_lengths, tokenizer=tokenizer, reference=reference)
+
+    def save(self, index_file):
+        # 先写临时文件再替换，避免并发启动的 worker 读到半个文件
+        tmp_file = f"{index_file}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_file,
+            terms=np.array(sorted(self.vocab, key=self.vocab.get)),
+            offsets=self.offsets,
+            doc_ids=self.doc_ids,
+            tfs=self.tfs,
+            doc_lengths=self.doc_lengths,
+            tokenizer=np.array(self.tokenizer)
+        )
+        os.replace(tmp_file, index_file)
+
+    @classmethod
+    def load(cls, index_file):
+        with np.load(index_file) as data:
+            vocab = {term: i for i, term in enumerate(data["terms"].tolist())}
+            return cls(vocab, data["offsets"], data["doc_ids"], data["tfs"], data["doc_lengths"],
+                       tokenizer=str(data["tokenizer"]))
+
+    def search(self, query, top_k, subset=None):
+        """
+        检索与查询文本 BM25 得分最高的 top_k 个案例，只返回得分大于 0 的案例。
+
+        参数:
+            query (str): 查询文本。
+            top_k (int): 返回数量。
+            subset (numpy.ndarray): 可选，只返回这些行号（升序）中的案例。
+
+        返回:
+            list: [(案例索引, BM25 得分)]
+        """
+        term_ids = [self.vocab[token] for token in set(tokenize(query, self.tokenizer)) if token in self.vocab]
+        if not term_ids:
+            return []
+
+        # 只在查询词项的倒排表上打分：拼接各词项的 (案例, 得分贡献)，按案例合并，
+        # 开销与命中的倒排长度成正比，不随案例总数分配 ntotal 大小的数组
+        doc_parts, contribution_parts = [], []
+        for term_id in term_ids:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs, tfs = self.doc_ids[start:end], self.tfs[start:end]
+            doc_parts.append(docs)
+            contribution_parts.append(self.idf[term_id] * tfs * (self.k1 + 1) / (tfs + self._length_norm[docs]))
+        matched, inverse = np.unique(np.concatenate(doc_parts), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(contribution_parts)).astype(np.float32)
+
+        if subset is not None:
+            # subset 可能接近全部行（如只排除墓碑），二分查找的开销只与命中数有关
+            positions = np.minimum(np.searchsorted(subset, matched), len(subset) - 1)
+            keep = subset[positions] == matched if len(subset) else np.zeros(len(matched), dtype=bool)
+            matched, scores = matched[keep], scores[keep]
+        top_scores, top_positions = select_top_k(scores.reshape(1, -1), top_k)
+        return [(int(matched[i]), float(score)) for i, score in zip(top_positions[0], top_scores[0])]
+
+
+def lexical_index_path(metadata_file):
+    prefix = metadata_file[:-5] if metadata_file.endswith(".json") else metadata_file
+    return f"{prefix}.bm25.npz"
+
+def open_lexical_index(metadata_file, metadata, tokenizer="bigram"):
+    """
+    打开 BM25 索引，不存在、旧于原始元数据或分词方式不同时重新构建并写入磁盘。
+
+    参数:
+        metadata_file (str): 原始元数据 JSON 路径，用于定位索引文件。
+        metadata (CaseMetadataStore | list): 案例库元数据。
+        tokenizer (str): bigram / jieba。
+
+    返回:
+        BM25Index
+    """
+    index_file = lexical_index_path(metadata_file)
+    if os.path.exists(index_file) and (
+            not os.path.exists(metadata_file) or os.path.getmtime(index_file) >= os.path.getmtime(metadata_file)):
+        index = BM25Index.load(index_file)
+        if index.ntotal == len(metadata) and index.tokenizer == tokenizer:
+            return index
+
+    print("正在构建 BM25 关键词索引...")
+    index = BM25Index.build(metadata, tokenizer=tokenizer)
+    index.save(index_file)
+    return index
+
+
+# ===== 结果融合 =====
+def reciprocal_rank_fusion(result_lists, top_k, k=60):
+    """
+    倒数排名融合（RRF）：score(d) = Σ 1 / (k + rank)，再除以理论最大值归一化到 [0, 1]。
+
+    参数:
+        result_lists (list): 多路检索结果，每路为按得分降序的 [(案例索引, 得分)]。
+        top_k (int): 返回数量。
+        k (int): RRF 平滑参数。
+
+    返回:
+        list: [(案例索引, 融合得分)]
+    """
+    fused = defaultdict(float)
+    for results in result_lists:
+        for rank, (idx, _) in enumerate(results, 1):
+            fused[idx] += 1 / (k + rank)
+    max_score = len(result_lists) / (k + 1)
+    ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]
+    return [(idx, score / max_score) for idx, score in ranked]
+
+
+# ===== 命令行：预先构建 BM25 索引 =====
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="构建案例库 BM25 关键词索引")
+    parser.add_argument("metadata_file", help="案例库元数据 JSON 文件")
+    parser.add_argument("--tokenizer", choices=("bigram", "jieba"), default="bigram")
+    args = parser.parse_args()
+    open_lexical_index(args.metadata_file, open_metadata_store(args.metadata_file), tokenizer=args.tokenizer)
+    print(lexical_index_path(args.metadata_file))
@@ -0,0 +1,159 @@
+import argparse
+import json
+import mmap
+import os
+from collections.abc import Mapping
+
+import numpy as np
+
+# /search 只用到的字段
+DEFAULT_FIELDS = ("案例", "关键词", "基本案情")
+# 列表字段在字符串块中以该分隔符拼接
+LIST_SEPARATOR = "\x1f"
+
+
+def metadata_store_paths(metadata_file):
+    """返回列式元数据的 (头文件, 偏移量文件, 字符串块文件) 路径。"""
+    prefix = metadata_file[:-5] if metadata_file.endswith(".json") else metadata_file
+    return f"{prefix}.meta.json", f"{prefix}.meta.offsets.npy", f"{prefix}.meta.bin"
+
+# ===== 构建列式元数据 =====
+def build_metadata_store(records, metadata_file, fields=DEFAULT_FIELDS):
+    """
+    将案例元数据写为列式存储：所有字段值以 UTF-8 顺序写入一个字符串块，
+    偏移量数组记录第 i 条记录第 j 个字段在字符串块中的起止位置。
+
+    参数:
+        records (iterable): 案例元数据字典序列。
+        metadata_file (str): 原始元数据 JSON 路径，输出文件与其同目录同名。
+        fields (tuple): 需要保存的字段。
+
+    返回:
+        str: 头文件路径
+    """
+    header_file, offsets_file, blob_file = metadata_store_paths(metadata_file)
+    suffix = f".{os.getpid()}.tmp"
+    list_fields = set()
+    offsets = [0]
+
+    with open(blob_file + suffix, "wb") as blob:
+        position = 0
+        for record in records:
+            for field in fields:
+                value = record.get(field)
+                if isinstance(value, list):
+                    list_fields.add(field)
+                    value = LIST_SEPARATOR.join(str(item) for item in value)
+                data = ("" if value is None else str(value)).encode("utf-8")
+                blob.write(data)
+                position += len(data)
+                offsets.append(position)
+
+    count = (len(offsets) - 1) // len(fields)
+    np.save(offsets_file + suffix + ".npy", np.array(offsets, dtype=np.int64))
+    with open(header_file + suffix, "w", encoding="utf-8") as f:
+        json.dump({
+            "count": count,
+            "fields": list(fields),
+            "list_fields": [field for field in fields if field in list_fields]
+        }, f, ensure_ascii=False)
+
+    # 头文件最后替换，头文件存在即表示数据完整
+    os.replace(blob_file + suffix, blob_file)
+    os.replace(offsets_file + suffix + ".npy", offsets_file)
+    os.replace(header_file + suffix, header_file)
+    return header_file
+
+
+# ===== 列式元数据读取 =====
+class CaseRecord(Mapping):
+    """单条案例元数据的只读视图，字段在访问时才解码。"""
+
+    __slots__ = ("_store", "_index")
+
+    def __init__(self, store, index):
+        self._store = store
+        self._index = index
+
+    def __getitem__(self, field):
+        return self._store.get_field(self._index, field)
+
+    def __iter__(self):
+        return iter(self._store.fields)
+
+    def __len__(self):
+        return len(self._store.fields)
+
+
+class CaseMetadataStore:
+    """
+    基于内存映射的列式案例元数据，按索引寻址，替代整份 JSON 解析成的字典列表。
+    字符串块由操作系统页缓存在 worker 间共享，每条案例不再产生 Python 对象开销。
+
+    参数:
+        metadata_file (str): 原始元数据 JSON 路径，用于定位列式文件。
+    """
+
+    def __init__(self, metadata_file):
+        header_file, offsets_file, blob_file = metadata_store_paths(metadata_file)
+        with open(header_file, "r", encoding="utf-8") as f:
+            header = json.load(f)
+        self.fields = header["fields"]
+        self.list_fields = set(header["list_fields"])
+        self._count = header["count"]
+        self._field_positions = {field: i for i, field in enumerate(self.fields)}
+        self._offsets = np.load(offsets_file, mmap_mode="r")
+
+        with open(blob_file, "rb") as f:
+            # 空文件无法映射
+            self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(blob_file) else b""
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        return CaseRecord(self, index)
+
+    def get_field(self, index, field):
+        """解码第 index 条案例的 field 字段。"""
+        position = index * len(self.fields) + self._field_positions[field]
+        start, end = int(self._offsets[position]), int(self._offsets[position + 1])
+        value = self._blob[start:end].decode("utf-8")
+        if field in self.list_fields:
+            return value.split(LIST_SEPARATOR) if value else []
+        return value
+
+
+def open_metadata_store(metadata_file, fields=DEFAULT_FIELDS):
+    """
+    打开列式元数据，不存在或旧于原始 JSON 时先构建一次。
+
+    参数:
+        metadata_file (str): 原始元数据 JSON 路径。
+        fields (tuple): 构建时保存的字段。
+
+    返回:
+        CaseMetadataStore
+    """
+    header_file = metadata_store_paths(metadata_file)[0]
+    if not os.path.exists(header_file) or (
+            os.path.exists(metadata_file) and os.path.getmtime(header_file) < os.path.getmtime(metadata_file)):
+        print("正在生成列式案例元数据...")
+        with open(metadata_file, "r", encoding="utf-8") as f:
+            records = json.load(f)
+        build_metadata_store(records, metadata_file, fields=fields)
+        del records
+    return CaseMetadataStore(metadata_file)
+
+
+# ===== 命令行：预先生成列式元数据 =====
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="将案例库元数据 JSON 转换为列式存储")
+    parser.add_argument("metadata_file", help="案例库元数据 JSON 文件")
+    args = parser.parse_args()
+    with open(args.metadata_file, "r", encoding="utf-8") as f:
+        print(build_metadata_store(json.load(f), args.metadata_file))
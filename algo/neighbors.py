@@ -0,0 +1,261 @@
+import argparse
+import json
+import os
+from collections import defaultdict
+
+import numpy as np
+
+from algo.index import build_case_index, l2_normalize
+from algo.incremental import CaseIdLookup, base_corpus_version, load_case_ids
+from algo.metadata_store import open_metadata_store
+from algo.store import open_embeddings
+
+# 每个案例 / 文书保存的近邻数 / 相关标签数
+NEIGHBOR_COUNT = 10
+LABEL_COUNT = 5
+
+
+def neighbor_graph_path(embedding_file):
+    """近邻图文件路径：与嵌入向量同目录、同名前缀。"""
+    return f"{os.path.splitext(embedding_file)[0]}.neighbors.npz"
+
+
+# ===== 近邻图 =====
+class NeighborGraph:
+    """
+    预先计算的 k 近邻邻接表：第 i 行为 ids[i] 的近邻 id 与相似度（不足 k 个时以 -1 补齐），
+    以及由近邻聚合出的相关标签（案例关键词 / 文书案由）。查询只是一次二分查找，不做向量计算。
+
+    参数:
+        ids (numpy.ndarray): 源 id。
+        neighbors (numpy.ndarray): 形状 (n, k) 的近邻 id。
+        scores (numpy.ndarray): 形状 (n, k) 的相似度。
+        label_names (list): 标签名称表。
+        labels (numpy.ndarray): 形状 (n, LABEL_COUNT) 的标签序号，-1 为空。
+        label_scores (numpy.ndarray): 形状 (n, LABEL_COUNT) 的标签得分（0-100）。
+        version (str): 构建时的语料版本。
+    """
+
+    def __init__(self, ids, neighbors, scores, label_names, labels, label_scores, version=None):
+        self.ids = ids
+        self.neighbors = neighbors
+        self.scores = scores
+        self.label_names = label_names
+        self.labels = labels
+        self.label_scores = label_scores
+        self.version = version
+        self._lookup = CaseIdLookup(ids)
+
+    def save(self, path):
+        # 先写临时文件再替换，线上进程不会读到半个文件
+        tmp_file = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_file,
+            ids=self.ids, neighbors=self.neighbors, scores=self.scores,
+            labels=self.labels, label_scores=self.label_scores,
+            label_names=np.array(json.dumps(self.label_names, ensure_ascii=False)),
+            version=np.array(self.version or "")
+        )
+        os.replace(tmp_file, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(
+                data["ids"], data["neighbors"], data["scores"],
+                json.loads(str(data["label_names"])), data["labels"], data["label_scores"],
+                version=str(data["version"]) or None
+            )
+
+    def related(self, source_id, limit=None):
+        """
+        返回 [(近邻 id, 相似度)]，按相似度降序；源 id 不在图中（如构建后新增）时返回空列表。
+        """
+        row = self._lookup.position(source_id)
+        if row is None:
+            return []
+        return [
+            (int(neighbor), round(float(score), 4))
+            for neighbor, score in zip(self.neighbors[row][:limit], self.scores[row][:limit])
+            if neighbor >= 0
+        ]
+
+    def related_labels(self, source_id, limit=None):
+        """返回 [(标签, 得分)]，得分为近邻中带该标签的相似度占比（0-100）。"""
+        row = self._lookup.position(source_id)
+        if row is None:
+            return []
+        return [
+            (self.label_names[label], int(score))
+            for label, score in zip(self.labels[row][:limit], self.label_scores[row][:limit])
+            if label >= 0
+        ]
+
+
+_graphs = {}
+
+def open_neighbor_graph(path):
+    """
+    打开近邻图，按文件修改时间缓存，重新构建后自动重新加载。
+
+    返回:
+        NeighborGraph | None: 文件不存在时返回 None
+    """
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    cached = _graphs.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = _graphs[path] = (mtime, NeighborGraph.load(path))
+    return cached[1]
+
+
+# ===== 构建 =====
+def nearest_neighbors(vectors, k, backend="brute", block_size=1024, **index_params):
+    """
+    计算每一行的 k 个最近邻（不含自身）。
+
+    参数:
+        vectors (numpy.ndarray): 归一化的向量。
+        k (int): 近邻数。
+        backend (str): brute（精确）/ ivf / hnsw。
+        block_size (int): 每次检索的行数。
+        index_params: 传给 build_case_index 的索引参数。
+
+    返回:
+        tuple: (rows, scores)，形状均为 (n, k)，rows 为近邻行号，不足时为 -1
+    """
+    n = vectors.shape[0]
+    index = build_case_index(vectors, backend=backend, **index_params)
+    k_found = max(0, min(k, n - 1))
+    rows = np.full((n, k), -1, dtype=np.int64)
+    scores = np.zeros((n, k), dtype=np.float32)
+    if not k_found:
+        return rows, scores
+
+    for start in range(0, n, block_size):
+        block = np.asarray(vectors[start:start + block_size], dtype=np.float32)
+        block_scores, block_rows = index.search(block, k_found + 1)
+        # 去掉自身（以及 ANN 未填满的 -1），保留其余结果的原有顺序
+        valid = (block_rows >= 0) & (block_rows != np.arange(start, start + len(block))[:, None])
+        order = np.argsort(~valid, axis=1, kind="stable")[:, :k_found]
+        kept = np.take_along_axis(valid, order, axis=1)
+        rows[start:start + len(block), :k_found] = np.where(kept, np.take_along_axis(block_rows, order, axis=1), -1)
+        scores[start:start + len(block), :k_found] = np.where(kept, np.take_along_axis(block_scores, order, axis=1), 0)
+    return rows, scores
+
+def aggregate_labels(neighbor_rows, neighbor_scores, row_labels, limit=LABEL_COUNT):
+    """
+    由近邻聚合相关标签：每个标签的得分为带该标签的近邻相似度之和占全部近邻相似度之和的百分比。
+
+    参数:
+        neighbor_rows (numpy.ndarray): 近邻行号。
+        neighbor_scores (numpy.ndarray): 近邻相似度。
+        row_labels (list): 每一行的标签列表。
+        limit (int): 每行保留的标签数。
+
+    返回:
+        tuple: (label_names, labels, label_scores)
+    """
+    names, positions = [], {}
+    labels = np.full((len(neighbor_rows), limit), -1, dtype=np.int32)
+    label_scores = np.zeros((len(neighbor_rows), limit), dtype=np.int16)
+    for i, (rows, scores) in enumerate(zip(neighbor_rows, neighbor_scores)):
+        weights, total = defaultdict(float), 0.0
+        for row, score in zip(rows, scores):
+            if row < 0 or score <= 0:
+                continue
+            total += score
+            for label in set(row_labels[row]):
+                weights[label] += score
+        top = sorted(weights.items(), key=lambda item: -item[1])[:limit]
+        for j, (label, weight) in enumerate(top):
+            if label not in positions:
+                positions[label] = len(names)
+                names.append(label)
+            labels[i, j] = positions[label]
+            label_scores[i, j] = round(100 * weight / total)
+    return names, labels, label_scores
+
+def _graph_from_rows(ids, rows, scores, row_labels, version):
+    names, labels, label_scores = aggregate_labels(rows, scores, row_labels)
+    neighbors = np.where(rows >= 0, ids[np.maximum(rows, 0)], -1)
+    return NeighborGraph(ids, neighbors, scores.astype(np.float16), names, labels, label_scores, version=version)
+
+def build_case_neighbors(embedding_file, metadata_file, k=NEIGHBOR_COUNT, backend="brute", **index_params):
+    """
+    构建案例近邻图（相关案例 + 由近邻关键词聚合的相关类别），写到 neighbor_graph_path(embedding_file)。
+    近邻图对应基础语料，增量中新增的案例在下次全量构建或压缩后重新构建时纳入。
+
+    返回:
+        NeighborGraph
+    """
+    embeddings = open_embeddings(embedding_file, mmap=True)
+    metadata = open_metadata_store(metadata_file)
+    ids = load_case_ids(embedding_file, embeddings.shape[0])
+    rows, scores = nearest_neighbors(embeddings, k, backend=backend, **index_params)
+    row_labels = [[keyword for keyword in metadata[i]["关键词"] if keyword] for i in range(len(metadata))]
+    graph = _graph_from_rows(ids, rows, scores, row_labels, base_corpus_version(embedding_file, metadata_file))
+    graph.save(neighbor_graph_path(embedding_file))
+    return graph
+
+def _mean_vectors(embeddings, starts, block_size=4096):
+    """按分组起始行求每组向量的均值（归一化），分块读取，内存与段落总数无关。"""
+    vectors = np.empty((len(starts), embeddings.shape[1]), dtype=np.float32)
+    bounds = np.r_[starts, embeddings.shape[0]]
+    for i in range(0, len(starts), block_size):
+        group_starts = starts[i:i + block_size]
+        block = np.asarray(embeddings[group_starts[0]:bounds[i + len(group_starts)]], dtype=np.float32)
+        vectors[i:i + len(group_starts)] = np.add.reduceat(block, group_starts - group_starts[0], axis=0)
+    return l2_normalize(vectors)
+
+def build_document_neighbors(embedding_file, metadata_file, k=NEIGHBOR_COUNT, backend="brute", **index_params):
+    """
+    构建裁判文书近邻图（相关判决 + 由近邻案由聚合的相关关键词）。文书向量为其全部段落向量的均值，
+    段落按文书连续存放（python -m algo.documents 按 id 顺序写出）。
+
+    返回:
+        NeighborGraph
+    """
+    from algo.documents import DOCUMENT_FIELDS, load_document_ids
+
+    embeddings = open_embeddings(embedding_file, mmap=True)
+    metadata = open_metadata_store(metadata_file, fields=DOCUMENT_FIELDS)
+    passage_ids = load_document_ids(embedding_file, embeddings.shape[0])
+    starts = np.flatnonzero(np.r_[True, passage_ids[1:] != passage_ids[:-1]])
+    ids = passage_ids[starts]
+    vectors = _mean_vectors(embeddings, starts)
+    rows, scores = nearest_neighbors(vectors, k, backend=backend, **index_params)
+    row_labels = [[cause for cause in metadata[start]["案由"].split("、") if cause] for start in starts]
+    graph = _graph_from_rows(ids, rows, scores, row_labels, base_corpus_version(embedding_file, metadata_file))
+    graph.save(neighbor_graph_path(embedding_file))
+    return graph
+
+
+# ===== 命令行 =====
+if __name__ == "__main__":
+    from config import SearchConfig
+
+    parser = argparse.ArgumentParser(description="离线构建案例 / 裁判文书的 k 近邻图")
+    parser.add_argument("corpus", choices=("cases", "documents"), help="cases：司法案例 / documents：裁判文书")
+    parser.add_argument("--embedding-file", help="嵌入向量文件，默认取 SEARCH_EMBEDDING_FILE / SEARCH_DOCUMENT_EMBEDDING_FILE")
+    parser.add_argument("--metadata-file", help="元数据文件，默认取 SEARCH_METADATA_FILE / SEARCH_DOCUMENT_METADATA_FILE")
+    parser.add_argument("--k", type=int, default=NEIGHBOR_COUNT, help="每个节点保存的近邻数")
+    parser.add_argument("--backend", default="brute", choices=("brute", "ivf", "hnsw"),
+                        help="近邻检索方式，brute 为精确计算")
+    args = parser.parse_args()
+
+    index_params = dict(nlist=SearchConfig.IVF_NLIST, nprobe=SearchConfig.IVF_NPROBE, hnsw_m=SearchConfig.HNSW_M,
+                        ef_construction=SearchConfig.HNSW_EF_CONSTRUCTION, ef_search=SearchConfig.HNSW_EF_SEARCH)
+    if args.corpus == "cases":
+        embedding_file = args.embedding_file or SearchConfig.EMBEDDING_FILE
+        graph = build_case_neighbors(embedding_file, args.metadata_file or SearchConfig.METADATA_FILE,
+                                     k=args.k, backend=args.backend, **index_params)
+    else:
+        embedding_file = args.embedding_file or SearchConfig.DOCUMENT_EMBEDDING_FILE
+        if not embedding_file:
+            parser.error("未指定 --embedding-file，且未配置 SEARCH_DOCUMENT_EMBEDDING_FILE")
+        graph = build_document_neighbors(embedding_file, args.metadata_file or SearchConfig.DOCUMENT_METADATA_FILE,
+                                         k=args.k, backend=args.backend, **index_params)
+    print(f"近邻图已写入 {neighbor_graph_path(embedding_file)}：{len(graph.ids)} 个节点，每个 {args.k} 个近邻。")
@@ -0,0 +1,559 @@
+import atexit
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from algo.search import load_case_corpus, find_similar_cases_batch, preprocess_text
+from algo.store import open_embeddings
+from algo.metadata_store import open_metadata_store
+from algo.documents import DOCUMENT_FIELDS, load_document_ids, aggregate_passage_hits
+from algo.index import build_case_index
+from algo.batcher import QueryBatcher
+from algo.cache import QueryEmbeddingCache, SearchResultCache
+from algo.encoder import load_query_encoder
+from algo.lexical import open_lexical_index, reciprocal_rank_fusion
+from algo.filters import open_filter_index
+from algo.incremental import (artifact_version, base_corpus_version, delta_path, load_case_ids, load_case_delta,
+                              segment_corpus, compact_case_corpus, CaseIdLookup, CorpusLocked)
+from utils.timing import span
+
+# 预热查询，触发模型首次前向计算与索引页加载
+WARMUP_QUERY = "劳动合同纠纷"
+
+
+# 语料替换后旧索引（如分片子进程）的释放延迟秒数
+RELEASE_DELAY = 30
+
+
+class RetrievalNotReady(Exception):
+    """案例检索系统尚未加载完成。"""
+
+
+def corpus_version(embedding_file, metadata_file):
+    """
+    语料版本：基础语料版本，存在增量文件时再叠加增量文件的版本，增量变化后检索结果随之失效。
+    """
+    version = base_corpus_version(embedding_file, metadata_file)
+    path = delta_path(embedding_file)
+    if os.path.exists(path):
+        version = f"{version}+{artifact_version(path)}"
+    return version
+
+
+class _CaseBase:
+    """整份构建的基础语料及其索引，只有增量变化时重新加载可直接复用。"""
+
+    def __init__(self, version, ids, embeddings, metadata, index, lexical_index, filter_index):
+        self.version = version
+        self.ids = ids
+        self.embeddings = embeddings
+        self.metadata = metadata
+        self.index = index
+        self.lexical_index = lexical_index
+        self.filter_index = filter_index
+
+
+class _CaseCorpus:
+    """一个版本的语料（基础语料 + 增量）及其索引，整体替换，保证单次检索内各部分版本一致。"""
+
+    def __init__(self, version, base, delta, ids, metadata, index, lexical_index, filter_index, batcher):
+        self.version = version
+        self.base = base
+        self.delta = delta
+        self.ids = ids
+        self.id_lookup = CaseIdLookup(ids)
+        self.metadata = metadata
+        self.index = index
+        self.lexical_index = lexical_index
+        self.filter_index = filter_index
+        self.batcher = batcher
+
+    @property
+    def embeddings(self):
+        return self.base.embeddings
+
+
+# ===== 案例检索系统 =====
+class CaseRetrievalSystem:
+    """
+    延迟加载的案例检索系统：模型、嵌入向量、元数据、索引在后台线程中加载并预热，
+    导入时不阻塞，非检索路由可立即提供服务。语料文件更新后在后台重新加载并整体替换，
+    检索结果缓存按语料版本失效。
+
+    参数:
+        embedding_file (str): 预计算的案例嵌入向量文件路径。
+        metadata_file (str): 案例库元数据文件路径。
+        model_name (str): 使用的模型名称或路径。
+        config (SearchConfig): 检索相关配置。
+    """
+
+    name = "案例检索系统"
+
+    def __init__(self, embedding_file, metadata_file, model_name, config):
+        self.embedding_file = embedding_file
+        self.metadata_file = metadata_file
+        self.model_name = model_name
+        self.config = config
+
+        self.model = None
+        self.query_cache = None
+        self.result_cache = SearchResultCache(max_size=config.RESULT_CACHE_SIZE, ttl=config.RESULT_CACHE_TTL)
+        self._corpus = None
+        # 关键词检索与向量检索并行执行
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="lexical-search")
+
+        # pending / loading / ready / failed（failed 时后台按退避间隔重试）
+        self.state = "pending"
+        self.error = None
+        self.load_time = None
+        self._ready = threading.Event()
+        # 加载结束（成功或失败）
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._reloading = False
+        self._compacting = False
+        # 连续因锁被占用而跳过压缩的次数
+        self._compact_lock_misses = 0
+        self._last_version_check = 0.0
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    @property
+    def corpus_version(self):
+        return self._corpus.version if self._corpus is not None else None
+
+    @property
+    def embeddings(self):
+        return self._corpus.embeddings if self._corpus is not None else None
+
+    @property
+    def metadata(self):
+        return self._corpus.metadata if self._corpus is not None else None
+
+    @property
+    def index(self):
+        return self._corpus.index if self._corpus is not None else None
+
+    @property
+    def lexical_index(self):
+        return self._corpus.lexical_index if self._corpus is not None else None
+
+    @property
+    def score_type(self):
+        """search 返回的得分类型：cosine（余弦相似度）/ rrf（混合检索的归一化 RRF 得分，[0, 1]）。"""
+        return "rrf" if self.lexical_index is not None else "cosine"
+
+    def start(self):
+        """在后台线程开始加载，重复调用无副作用。"""
+        with self._lock:
+            if self._thread is None:
+                self.state = "loading"
+                self._thread = threading.Thread(target=self._load, name="case-retrieval-loader", daemon=True)
+                self._thread.start()
+
+    def wait_ready(self, timeout=None):
+        """
+        等待加载完成，未开始加载时先启动加载。
+
+        参数:
+            timeout (float): 最长等待秒数，为空时一直等待。
+
+        返回:
+            bool: 是否已就绪
+        """
+        self.start()
+        self._done.wait(timeout)
+        return self.ready
+
+    def _load_base(self, version):
+        config = self.config
+        embeddings, metadata = load_case_corpus(self.embedding_file, self.metadata_file, mmap=config.EMBEDDING_MMAP)
+        ids = load_case_ids(self.embedding_file, embeddings.shape[0])
+        index = build_case_index(
+            embeddings,
+            backend=config.INDEX_BACKEND,
+            index_file=config.INDEX_FILE,
+            nlist=config.IVF_NLIST,
+            nprobe=config.IVF_NPROBE,
+            hnsw_m=config.HNSW_M,
+            ef_construction=config.HNSW_EF_CONSTRUCTION,
+            ef_search=config.HNSW_EF_SEARCH,
+            embedding_file=self.embedding_file,
+            rescore_candidates=config.RESCORE_CANDIDATES,
+            n_shards=config.SHARD_COUNT,
+            pca_dim=config.PCA_DIM
+        )
+        lexical_index = None
+        if config.HYBRID_SEARCH:
+            lexical_index = open_lexical_index(self.metadata_file, metadata, tokenizer=config.LEXICAL_TOKENIZER)
+        filter_index = open_filter_index(self.metadata_file, metadata)
+        return _CaseBase(version, ids, embeddings, metadata, index, lexical_index, filter_index)
+
+    def _load_corpus(self, model):
+        config = self.config
+        version = corpus_version(self.embedding_file, self.metadata_file)
+        base_version = base_corpus_version(self.embedding_file, self.metadata_file)
+        # 只有增量变化时复用已加载的基础语料与索引，重新加载的开销与变化量成正比
+        previous = self._corpus
+        if previous is not None and previous.base.version == base_version:
+            base = previous.base
+        else:
+            base = self._load_base(base_version)
+
+        delta = load_case_delta(self.embedding_file, base_version)
+        if delta is None:
+            ids, metadata, index = base.ids, base.metadata, base.index
+            lexical_index, filter_index = base.lexical_index, base.filter_index
+        else:
+            ids, metadata, index, lexical_index, filter_index = segment_corpus(
+                base.ids, base.metadata, base.index, base.lexical_index, base.filter_index, delta,
+                tokenizer=config.LEXICAL_TOKENIZER
+            )
+
+        # 预热：首次 encode 明显慢于后续调用，在就绪前完成
+        find_similar_cases_batch(model, base.embeddings, metadata, [WARMUP_QUERY], 1, index=index)
+
+        # 合并并发的 /search 查询，一次 encode + 一次矩阵乘法
+        batcher = QueryBatcher(
+            partial(find_similar_cases_batch, model, base.embeddings, metadata, index=index, cache=self.query_cache),
+            max_batch_size=config.BATCH_MAX_SIZE,
+            max_wait_ms=config.BATCH_MAX_WAIT_MS
+        )
+        return _CaseCorpus(version, base, delta, ids, metadata, index, lexical_index, filter_index, batcher)
+
+    def _swap_corpus(self, corpus):
+        previous, self._corpus = self._corpus, corpus
+        # 语料版本变化，旧的检索结果全部失效
+        self.result_cache.set_version(corpus.version)
+        if previous is not None:
+            previous.batcher.close()
+            if previous.base is not corpus.base and hasattr(previous.base.index, "close"):
+                # 分片子进程等资源延后释放，替换前已取得旧语料的检索仍可完成
+                threading.Timer(RELEASE_DELAY, previous.base.index.close).start()
+        self._maybe_compact(corpus)
+
+    def _maybe_compact(self, corpus):
+        """增量超过基础语料的一定比例时在后台压缩，压缩完成后由版本检查重新加载。"""
+        threshold = self.config.COMPACT_THRESHOLD
+        if threshold <= 0 or corpus.delta is None or self._compacting:
+            return
+        if corpus.delta.size <= threshold * max(len(corpus.base.ids), 1):
+            return
+        self._compacting = True
+        threading.Thread(target=self._compact, name="case-corpus-compactor", daemon=True).start()
+
+    def _compact(self):
+        try:
+            manifest = compact_case_corpus(self.embedding_file, self.metadata_file)
+            self._compact_lock_misses = 0
+            if manifest is not None:
+                print(f"语料压缩完成，新版本 {manifest['version']}。")
+        except CorpusLocked as e:
+            # 其他进程正在更新或压缩，下次语料替换时再尝试
+            self._compact_lock_misses += 1
+            print(f"语料压缩跳过（已连续 {self._compact_lock_misses} 次）: {e}")
+        except Exception as e:
+            print(f"语料压缩失败: {e}")
+            traceback.print_exc()
+        finally:
+            self._compacting = False
+
+    def _load_encoder(self):
+        """加载查询编码器与查询向量缓存。"""
+        config = self.config
+        model = load_query_encoder(self.model_name, backend=config.ENCODER_BACKEND,
+                                   onnx_model_dir=config.ONNX_MODEL_DIR,
+                                   intra_op_threads=config.ENCODER_THREADS,
+                                   service_socket=config.EMBEDDING_SERVICE_SOCKET,
+                                   service_timeout=config.EMBEDDING_SERVICE_TIMEOUT)
+        # 查询向量缓存，退出时持久化，重启后预热；不同编码器的向量略有差异，分开缓存
+        query_cache = QueryEmbeddingCache(
+            f"{config.ENCODER_BACKEND}:{self.model_name}",
+            max_size=config.QUERY_CACHE_SIZE,
+            ttl=config.QUERY_CACHE_TTL,
+            persist_file=config.QUERY_CACHE_FILE
+        )
+        query_cache.load()
+        atexit.register(query_cache.save)
+        return model, query_cache
+
+    def _load(self):
+        # 加载失败（如编码服务晚于 web worker 启动）时按指数退避在后台重试，期间请求返回未就绪
+        delay = self.config.LOAD_RETRY_INTERVAL
+        while True:
+            start_time = time.time()
+            try:
+                if self.model is None:
+                    self.model, self.query_cache = self._load_encoder()
+
+                self._swap_corpus(self._load_corpus(self.model))
+                self._last_version_check = time.monotonic()
+                self.load_time = round(time.time() - start_time, 2)
+                self.error = None
+                self.state = "ready"
+                print(f"{self.name}就绪，耗时 {self.load_time}s，语料版本 {self.corpus_version}。")
+                self._ready.set()
+                return
+            except Exception as e:
+                self.state = "failed"
+                self.error = str(e)
+                print(f"{self.name}加载失败: {e}")
+                traceback.print_exc()
+                if delay <= 0:
+                    return
+                print(f"{delay:g}s 后重试加载{self.name}。")
+            finally:
+                self._done.set()
+            time.sleep(delay)
+            delay = min(delay * 2, self.config.LOAD_RETRY_MAX)
+            self.state = "loading"
+
+    def _reload(self):
+        try:
+            print("检测到语料文件更新，正在后台重新加载...")
+            self._swap_corpus(self._load_corpus(self.model))
+            print(f"语料重新加载完成，版本 {self.corpus_version}。")
+        except Exception as e:
+            # 加载失败时继续使用旧语料
+            print(f"语料重新加载失败: {e}")
+            traceback.print_exc()
+        finally:
+            self._reloading = False
+
+    def check_corpus_version(self):
+        """
+        按配置的间隔检查语料文件版本，变化时在后台重新加载，加载完成前继续使用旧语料。
+
+        返回:
+            bool: 是否触发了重新加载
+        """
+        interval = self.config.CORPUS_CHECK_INTERVAL
+        if interval <= 0 or time.monotonic() - self._last_version_check < interval:
+            return False
+        with self._lock:
+            if self._reloading:
+                return False
+            self._last_version_check = time.monotonic()
+            try:
+                version = corpus_version(self.embedding_file, self.metadata_file)
+            except (OSError, ValueError):
+                # 文件正在被替换
+                return False
+            if version == self.corpus_version:
+                return False
+            self._reloading = True
+        threading.Thread(target=self._reload, name="case-retrieval-reloader", daemon=True).start()
+        return True
+
+    def _lexical_search(self, lexical_index, query, top_k, trace, subset):
+        with span(trace, "lexical"):
+            return lexical_index.search(query, top_k, subset=subset)
+
+    def search(self, query, top_k, timeout=None, trace=None, filters=None):
+        """
+        检索与查询文本最相似的案例。开启混合检索时，BM25 关键词检索与向量检索并行执行，
+        两路结果以倒数排名融合（RRF），分数为归一化的融合得分。
+        结果按 (规范化查询, top_k, 过滤条件, 语料版本) 缓存。
+
+        参数:
+            query (str): 查询文本。
+            top_k (int): 返回的最相似案例数量。
+            timeout (float): 等待加载完成的最长秒数。
+            trace (SearchTrace): 可选，记录 queue_wait / encode / score / top_k / lexical / fusion 等阶段耗时。
+            filters (dict): 可选，如 {"category": ["刑事", "民事"]}，同一字段取并集。
+
+        异常:
+            RetrievalNotReady: 超时仍未加载完成。
+            ValueError: 过滤字段或取值不受支持。
+
+        返回:
+            list: [(案例 id, 相似度分数)]，案例元数据通过 get_case 读取
+        """
+        if not self.wait_ready(timeout):
+            raise RetrievalNotReady(self.error or self.state)
+        self.check_corpus_version()
+        corpus = self._corpus
+
+        # 过滤条件由预先计算的位图转为行号，向量索引与 BM25 只在这些行中检索
+        filter_key = corpus.filter_index.normalize(filters)
+        subset = corpus.filter_index.subset(filter_key)
+
+        cache_key = (" ".join(preprocess_text(query).split()), top_k, filter_key)
+        results = self.result_cache.get_results(cache_key, corpus.version)
+        if trace is not None:
+            trace.count("result_cache_hit", results is not None)
+        if results is not None:
+            return results
+
+        if corpus.lexical_index is None:
+            with span(trace, "dense"):
+                results = corpus.batcher.search(query, top_k, trace=trace, filter_key=filter_key, subset=subset)
+        else:
+            candidates = max(top_k, self.config.HYBRID_CANDIDATES)
+            lexical_future = self._executor.submit(self._lexical_search, corpus.lexical_index, query, candidates,
+                                                   trace, subset)
+            with span(trace, "dense"):
+                dense_results = corpus.batcher.search(query, candidates, trace=trace, filter_key=filter_key,
+                                                      subset=subset)
+            lexical_results = lexical_future.result()
+            with span(trace, "fusion"):
+                results = reciprocal_rank_fusion([dense_results, lexical_results], top_k, k=self.config.RRF_K)
+
+        # 行号随增量与压缩变化，对外只暴露案例 id
+        results = [(int(corpus.ids[position]), score) for position, score in results]
+        self.result_cache.set_results(cache_key, corpus.version, results)
+        return results
+
+    def get_case(self, case_id):
+        """
+        按案例 id 读取元数据。
+
+        参数:
+            case_id (int): 案例 id。
+
+        返回:
+            Mapping | None: 案例元数据，案例已被删除时返回 None
+        """
+        corpus = self._corpus
+        if corpus is None:
+            return None
+        position = corpus.id_lookup.position(case_id)
+        return corpus.metadata[position] if position is not None else None
+
+    def status(self):
+        res = {
+            "state": self.state,
+            "load_time": self.load_time,
+            "corpus_version": self.corpus_version,
+            "index_backend": self.index.backend if self.index is not None else None,
+            "encoder_backend": self.config.ENCODER_BACKEND,
+            "hybrid_search": self.lexical_index is not None,
+            "score_type": self.score_type,
+            "result_cache": self.result_cache.stats(),
+        }
+        corpus = self._corpus
+        if corpus is not None:
+            res["corpus_size"] = int((corpus.ids >= 0).sum())
+            res["delta"] = {
+                "rows": len(corpus.delta),
+                "tombstones": len(corpus.delta.tombstones),
+            } if corpus.delta is not None else None
+        if self.error:
+            res["error"] = self.error
+        if self.query_cache is not None:
+            res["query_cache"] = self.query_cache.stats()
+        return res
+
+
+
+# ===== 裁判文书检索系统 =====
+class DocumentRetrievalSystem(CaseRetrievalSystem):
+    """
+    裁判文书检索：文书按段落编码（python -m algo.documents 生成），检索段落后按文书聚合，
+    文书得分为其最相似段落的得分。与案例检索共用编码模型与查询向量缓存，
+    加载、预热、语料更新后重新加载的流程与案例检索一致；不支持过滤与混合检索。
+
+    参数:
+        embedding_file (str): 段落嵌入向量文件路径。
+        metadata_file (str): 段落元数据文件路径。
+        encoder_source (CaseRetrievalSystem): 提供编码模型的案例检索系统。
+        config (SearchConfig): 检索相关配置。
+    """
+    name = "裁判文书检索系统"
+
+    def __init__(self, embedding_file, metadata_file, encoder_source, config):
+        super().__init__(embedding_file, metadata_file, encoder_source.model_name, config)
+        self.encoder_source = encoder_source
+
+    def _load_encoder(self):
+        # 不重复加载模型，等待案例检索系统加载完成后共用
+        source = self.encoder_source
+        if not source.wait_ready():
+            raise RetrievalNotReady(f"案例检索系统加载失败，无法共用编码模型: {source.error or source.state}")
+        return source.model, source.query_cache
+
+    def _load_base(self, version):
+        config = self.config
+        embeddings = open_embeddings(self.embedding_file, mmap=config.EMBEDDING_MMAP)
+        metadata = open_metadata_store(self.metadata_file, fields=DOCUMENT_FIELDS)
+        ids = load_document_ids(self.embedding_file, embeddings.shape[0])
+        index = build_case_index(
+            embeddings,
+            backend=config.DOCUMENT_INDEX_BACKEND,
+            index_file=config.DOCUMENT_INDEX_FILE,
+            nlist=config.IVF_NLIST,
+            nprobe=config.IVF_NPROBE,
+            hnsw_m=config.HNSW_M,
+            ef_construction=config.HNSW_EF_CONSTRUCTION,
+            ef_search=config.HNSW_EF_SEARCH,
+            embedding_file=self.embedding_file,
+            rescore_candidates=config.RESCORE_CANDIDATES,
+            n_shards=config.SHARD_COUNT,
+            pca_dim=config.PCA_DIM
+        )
+        return _CaseBase(version, ids, embeddings, metadata, index, None, None)
+
+    def search(self, query, top_k, timeout=None, trace=None, filters=None):
+        """
+        检索与查询文本最相似的裁判文书。每篇文书取 DOCUMENT_PASSAGE_OVERSAMPLE 倍的段落候选后按文书聚合，
+        同一文书的多个段落命中时候选不足，返回的文书数可能少于 top_k。
+
+        参数:
+            query (str): 查询文本。
+            top_k (int): 返回的文书数量。
+            timeout (float): 等待加载完成的最长秒数。
+            trace (SearchTrace): 可选，记录 queue_wait / encode / score / top_k / aggregate 等阶段耗时。
+            filters (dict): 不支持，非空时抛出 ValueError。
+
+        异常:
+            RetrievalNotReady: 超时仍未加载完成。
+            ValueError: 传入了过滤条件。
+
+        返回:
+            list: [(文书 id, 相似度分数, 最相似段落的行号)]，元数据通过 get_document 读取
+        """
+        if any((filters or {}).values()):
+            raise ValueError("裁判文书检索不支持过滤条件")
+        if not self.wait_ready(timeout):
+            raise RetrievalNotReady(self.error or self.state)
+        self.check_corpus_version()
+        corpus = self._corpus
+
+        cache_key = (" ".join(preprocess_text(query).split()), top_k)
+        results = self.result_cache.get_results(cache_key, corpus.version)
+        if trace is not None:
+            trace.count("result_cache_hit", results is not None)
+        if results is not None:
+            return results
+
+        candidates = min(top_k * self.config.DOCUMENT_PASSAGE_OVERSAMPLE, len(corpus.ids))
+        with span(trace, "dense"):
+            hits = corpus.batcher.search(query, candidates, trace=trace)
+        with span(trace, "aggregate"):
+            results = aggregate_passage_hits(hits, corpus.ids, top_k)
+        self.result_cache.set_results(cache_key, corpus.version, results)
+        return results
+
+    def get_document(self, doc_id, position=None):
+        """
+        读取文书元数据。
+
+        参数:
+            doc_id (int): 文书 id。
+            position (int): 可选，检索返回的段落行号，片段取该段落；语料已替换时改取文书的第一个段落。
+
+        返回:
+            Mapping | None: 段落元数据（文书字段 + 片段），文书不存在时返回 None
+        """
+        corpus = self._corpus
+        if corpus is None:
+            return None
+        if position is None or position >= len(corpus.ids) or corpus.ids[position] != doc_id:
+            position = corpus.id_lookup.position(doc_id)
+        return corpus.metadata[position] if position is not None else None
@@ -1,11 +1,16 @@
 import json
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+from algo.index import BruteForceIndex
+from algo.store import open_embeddings
+from algo.metadata_store import open_metadata_store
+from algo.encoder import load_query_encoder
+from utils.timing import span
 
 
 # ===== 初始化函数 =====
-def initialize_case_retrieval_system(embedding_file, metadata_file, model_name):
+def initialize_case_retrieval_system(embedding_file, metadata_file, model_name, mmap=True,
+                                     encoder_backend="sentence_transformers", onnx_model_dir=None,
+                                     intra_op_threads=0):
     """
     初始化案例检索系统，加载预计算数据和模型。
     
@@ -13,20 +18,45 @@ def initialize_case_retrieval_system(embedding_file, metadata_file, model_name):
         embedding_file (str): 预计算的案例嵌入向量文件路径。
         metadata_file (str): 案例库元数据文件路径。
         model_name (str): 使用的模型名称或路径。
+        mmap (bool): 是否以内存映射方式打开嵌入向量与列式元数据，多个 worker 共享页缓存。
+        encoder_backend (str): 查询编码器，sentence_transformers / onnx（int8 量化）/ onnx_fp32。
+        onnx_model_dir (str): ONNX 导出目录。
+        intra_op_threads (int): ONNX Runtime 单算子线程数，0 为默认值。
     
     返回:
-        tuple: (model, embeddings, metadata)
+        tuple: (model, embeddings, metadata)，embeddings 为归一化后的 float32 矩阵，
+            metadata 为 CaseMetadataStore（mmap=False 时为字典列表）
     """
-    print("正在加载案例数据库...")
-    embeddings = np.load(embedding_file)
-    with open(metadata_file, "r", encoding="utf-8") as f:
-        metadata = json.load(f)
+    embeddings, metadata = load_case_corpus(embedding_file, metadata_file, mmap=mmap)
     
     # 初始化模型
-    model = SentenceTransformer(model_name, device="cpu")  # 使用CPU推理
+    model = load_query_encoder(model_name, backend=encoder_backend, onnx_model_dir=onnx_model_dir,
+                               intra_op_threads=intra_op_threads)
     print("案例检索系统初始化完成。")
     return model, embeddings, metadata
 
+def load_case_corpus(embedding_file, metadata_file, mmap=True):
+    """
+    加载案例嵌入向量与元数据（不含模型），语料更新后可单独重新加载。
+    
+    参数:
+        embedding_file (str): 预计算的案例嵌入向量文件路径。
+        metadata_file (str): 案例库元数据文件路径。
+        mmap (bool): 是否以内存映射方式打开。
+    
+    返回:
+        tuple: (embeddings, metadata)
+    """
+    print("正在加载案例数据库...")
+    # 加载时归一化一次，检索时直接使用内积
+    embeddings = open_embeddings(embedding_file, mmap=mmap)
+    if mmap:
+        metadata = open_metadata_store(metadata_file)
+    else:
+        with open(metadata_file, "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+    return embeddings, metadata
+
 # ===== 文本预处理函数 =====
 def preprocess_text(text):
     """
@@ -41,55 +71,118 @@ def preprocess_text(text):
     return text.replace("\n", " ").replace("  ", " ").strip()
 
 # ===== 相似案例检索函数 =====
-def find_similar_cases(model, embeddings, metadata, query, top_k):
+def find_similar_cases(model, embeddings, metadata, query, top_k, index=None, cache=None):
     """
     检索与查询文本最相似的案例。
     
     参数:
-        model (SentenceTransformer): 用于生成文本嵌入的模型。
-        embeddings (numpy.ndarray): 预计算的案例嵌入向量。
-        metadata (list): 案例库元数据。
+        model (SentenceTransformer | OnnxQueryEncoder | EmbeddingServiceClient): 用于生成文本嵌入的模型。
+        embeddings (numpy.ndarray): 预计算的案例嵌入向量（已归一化）。
+        metadata (CaseMetadataStore | list): 案例库元数据。
         query (str): 查询文本。
         top_k (int): 返回的最相似案例数量。
+        index (BruteForceIndex | FaissIndex): 可选的案例向量索引，为空时精确计算全部相似度。
+        cache (QueryEmbeddingCache): 可选的查询向量缓存。
     
     返回:
         list: [(案例索引, 相似度分数)]
     """
-    # 预处理查询文本
-    processed_query = preprocess_text(query)
+    return find_similar_cases_batch(model, embeddings, metadata, [query], top_k, index=index, cache=cache)[0]
+
+# ===== 查询向量生成函数 =====
+def encode_queries(model, processed_queries, cache=None):
+    """
+    生成查询向量，命中缓存的查询跳过模型前向计算，其余整批一次 encode。
     
-    # 生成查询embedding
-    query_embedding = model.encode(
-        processed_query,
-        convert_to_numpy=True,
-        normalize_embeddings=True
-    )
+    参数:
+        model (SentenceTransformer | OnnxQueryEncoder | EmbeddingServiceClient): 用于生成文本嵌入的模型。
+        processed_queries (list): 预处理后的查询文本列表。
+        cache (QueryEmbeddingCache): 可选的查询向量缓存。
+    
+    返回:
+        numpy.ndarray: 形状 (len(processed_queries), dim) 的归一化 float32 向量
+    """
+    cached = [cache.get_embedding(query) if cache is not None else None for query in processed_queries]
+    # 同一批内的重复查询只计算一次
+    missing = list(dict.fromkeys(query for query, vector in zip(processed_queries, cached) if vector is None))
+
+    encoded = {}
+    if missing:
+        vectors = model.encode(
+            missing,
+            batch_size=len(missing),
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        ).astype(np.float32)
+        for query, vector in zip(missing, vectors):
+            encoded[query] = vector
+            if cache is not None:
+                cache.set_embedding(query, vector)
+
+    return np.stack([
+        vector if vector is not None else encoded[query]
+        for query, vector in zip(processed_queries, cached)
+    ])
+
+# ===== 批量相似案例检索函数 =====
+def find_similar_cases_batch(model, embeddings, metadata, queries, top_k, index=None, cache=None, trace=None,
+                             subset=None):
+    """
+    批量检索：一次 encode 生成全部查询向量，一次矩阵乘法完成打分。
+    
+    参数:
+        model (SentenceTransformer | OnnxQueryEncoder | EmbeddingServiceClient): 用于生成文本嵌入的模型。
+        embeddings (numpy.ndarray): 预计算的案例嵌入向量（已归一化）。
+        metadata (CaseMetadataStore | list): 案例库元数据。
+        queries (list): 查询文本列表。
+        top_k (int): 每个查询返回的最相似案例数量。
+        index (BruteForceIndex | FaissIndex): 可选的案例向量索引，为空时精确计算全部相似度。
+        cache (QueryEmbeddingCache): 可选的查询向量缓存。
+        trace (SearchTrace): 可选，记录 encode / score / top_k 阶段耗时。
+        subset (numpy.ndarray): 可选，只在这些行号（升序）中检索，如类别过滤位图对应的行号。
+    
+    返回:
+        list: 与 queries 一一对应的 [(案例索引, 相似度分数)] 列表
+    """
+    if not queries:
+        return []
+
+    # 预处理查询文本
+    processed_queries = [preprocess_text(query) for query in queries]
     
-    # 计算相似度
-    similarities = cosine_similarity([query_embedding], embeddings)[0]
+    # 生成查询embedding（未命中缓存的整批一次前向计算）
+    with span(trace, "encode"):
+        query_embeddings = encode_queries(model, processed_queries, cache=cache)
     
-    # 获取Top K结果
-    top_indices = np.argsort(similarities)[-top_k:][::-1]
+    if index is None:
+        # 没有索引时按精确检索处理（向量均已归一化，内积即余弦相似度）
+        index = BruteForceIndex(embeddings)
+    scores, indices = index.search(query_embeddings, top_k, trace=trace, subset=subset)
     
-    return [(i, similarities[i]) for i in top_indices]
+    # 近似索引候选不足时以 -1 填充，按行去掉
+    return [
+        [(int(i), float(score)) for i, score in zip(row_indices, row_scores) if i >= 0]
+        for row_indices, row_scores in zip(indices, scores)
+    ]
 
 # ===== 搜索函数 =====
-def search(query, model, embeddings, metadata, top_k):
+def search(query, model, embeddings, metadata, top_k, index=None):
     """
     执行案例搜索并展示结果。
     
     参数:
         query (str): 查询文本。
-        model (SentenceTransformer): 用于生成文本嵌入的模型。
+        model (SentenceTransformer | OnnxQueryEncoder | EmbeddingServiceClient): 用于生成文本嵌入的模型。
         embeddings (numpy.ndarray): 预计算的案例嵌入向量。
-        metadata (list): 案例库元数据。
+        metadata (CaseMetadataStore | list): 案例库元数据。
         top_k (int): 返回的最相似案例数量。
+        index (BruteForceIndex | FaissIndex): 可选的案例向量索引。
     
     返回:
         None
     """
     # 执行检索
-    results = find_similar_cases(model, embeddings, metadata, query, top_k)
+    results = find_similar_cases(model, embeddings, metadata, query, top_k, index=index)
     
     # 展示结果
     print(f"\n找到 {len(results)} 个相似案例：")
@@ -0,0 +1,241 @@
+import argparse
+import os
+import pickle
+import subprocess
+import sys
+import threading
+
+import numpy as np
+
+from algo.index import chunked_top_k, l2_normalize, select_top_k
+from utils.timing import span
+
+# 子进程以 python -m algo.shards 启动，工作目录为项目根目录
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# ===== 分片子进程 =====
+def _open_shard(embedding_file, start, end):
+    """以内存映射打开嵌入向量的 [start, end) 行，子进程只访问自己分片的页。"""
+    shard = np.load(embedding_file, mmap_mode="r")[start:end]
+    sample = np.asarray(shard[:1024], dtype=np.float32)
+    if shard.dtype == np.float32 and np.allclose(np.linalg.norm(sample, axis=1), 1.0, atol=1e-4):
+        return shard
+    # 未归一化时只复制本分片
+    return l2_normalize(np.asarray(shard))
+
+def _serve_shard(embedding_file, start, end):
+    """
+    分片检索循环：从标准输入读取 (查询向量, top_k, 分片内行号)，返回分片内的 top_k。
+    父进程退出（标准输入关闭）时随之退出。
+    """
+    requests, responses = sys.stdin.buffer, sys.stdout.buffer
+    # 标准输出只用于回传结果，日志改写到标准错误
+    sys.stdout = sys.stderr
+    shard = _open_shard(embedding_file, start, end)
+    pickle.dump(("ready", shard.shape[0]), responses)
+    responses.flush()
+
+    while True:
+        try:
+            queries, top_k, subset = pickle.load(requests)
+        except EOFError:
+            return
+        try:
+            if subset is None:
+                scores, indices = select_top_k(queries @ shard.T, top_k)
+            else:
+                # 分块读取允许的行，不复制整个过滤后的子矩阵
+                scores, indices = chunked_top_k(queries, shard, top_k, subset=subset)
+            response = ("ok", scores, indices + start)
+        except Exception as e:
+            response = ("error", f"{type(e).__name__}: {e}")
+        pickle.dump(response, responses)
+        responses.flush()
+
+
+class _ShardError(RuntimeError):
+    """分片在处理请求时出错（子进程仍正常）。"""
+
+
+class _ShardProcess:
+    """一个分片子进程及其管道。"""
+
+    def __init__(self, embedding_file, start, end, threads):
+        self.embedding_file = embedding_file
+        self.start = start
+        self.end = end
+        self.threads = threads
+        self._spawn()
+
+    def _spawn(self):
+        env = dict(os.environ)
+        # 每个分片限制 BLAS 线程数，分片之间并行，避免超额订阅 CPU
+        for name in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+            env[name] = str(self.threads)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [_PROJECT_ROOT, env.get("PYTHONPATH")]))
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "algo.shards", self.embedding_file, "--start", str(self.start), "--end", str(self.end)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=_PROJECT_ROOT, env=env
+        )
+
+    def wait_ready(self):
+        """等待子进程打开分片，异常: 子进程启动失败或行数不符时抛出 RuntimeError。"""
+        try:
+            status, rows = pickle.load(self.process.stdout)
+        except Exception:
+            raise RuntimeError(f"案例检索分片 [{self.start}, {self.end}) 的子进程启动失败")
+        if rows != self.end - self.start:
+            raise RuntimeError(f"分片 [{self.start}, {self.end}) 只读到 {rows} 行")
+
+    def restart(self):
+        """结束当前子进程（连同管道中残留的请求与结果）并重新启动。"""
+        self.close(timeout=0)
+        self._spawn()
+        self.wait_ready()
+
+    def send(self, queries, top_k, subset):
+        pickle.dump((queries, top_k, subset), self.process.stdin)
+        self.process.stdin.flush()
+
+    def receive(self):
+        """
+        读取一组结果。
+
+        异常:
+            _ShardError: 分片返回了错误，管道仍然同步，子进程可继续使用。
+            其他异常: 子进程退出或管道损坏，需要重启。
+        """
+        response = pickle.load(self.process.stdout)
+        if response[0] == "error":
+            raise _ShardError(f"案例检索分片 [{self.start}, {self.end}) 出错: {response[1]}")
+        return response[1:]
+
+    def close(self, timeout=5):
+        if self.process.poll() is None:
+            # 关闭标准输入，子进程读到 EOF 后退出
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+            try:
+                self.process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        for pipe in (self.process.stdin, self.process.stdout):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+
+
+# ===== 分片索引 =====
+class ShardedIndex:
+    """
+    分片精确检索：嵌入向量按行切成 N 个分片，每个分片由一个子进程以内存映射持有，
+    查询同时发往全部分片并行打分，各分片的 top_k 在父进程合并。
+    单个查询可用满多个 CPU 核，每个进程只访问 1/N 的向量。接口与 BruteForceIndex 一致。
+
+    参数:
+        embedding_file (str): 嵌入向量文件路径。
+        ntotal (int): 嵌入向量行数。
+        n_shards (int): 分片数，0 为 CPU 核数。
+        threads (int): 每个分片的 BLAS 线程数。
+    """
+    backend = "sharded"
+
+    def __init__(self, embedding_file, ntotal, n_shards=0, threads=1):
+        n_shards = max(1, min(n_shards or os.cpu_count() or 1, ntotal or 1))
+        self._ntotal = ntotal
+        self.boundaries = np.linspace(0, ntotal, n_shards + 1).astype(np.int64)
+        self._lock = threading.Lock()
+        # 子进程的工作目录为项目根目录，相对路径需先转为绝对路径
+        embedding_file = os.path.abspath(embedding_file)
+        self.shards = [
+            _ShardProcess(embedding_file, int(start), int(end), threads)
+            for start, end in zip(self.boundaries[:-1], self.boundaries[1:])
+        ]
+        try:
+            for shard in self.shards:
+                shard.wait_ready()
+        except Exception:
+            self.close()
+            raise
+        print(f"案例检索分片已启动：{len(self.shards)} 个子进程，共 {ntotal} 行。")
+
+    @property
+    def ntotal(self):
+        return self._ntotal
+
+    def set_search_params(self, **params):
+        # 分片内为精确检索，没有可调参数
+        pass
+
+    def search(self, query_embeddings, top_k, trace=None, subset=None):
+        """
+        检索最相似的 top_k 个案例。
+
+        参数:
+            query_embeddings (numpy.ndarray): 查询向量，形状 (nq, dim)。
+            top_k (int): 返回数量。
+            trace (SearchTrace): 可选，score 记录分片并行打分（含进程间传输），top_k 记录合并。
+            subset (numpy.ndarray): 可选，只在这些行号（升序）中检索，按分片拆分后下发。
+
+        返回:
+            tuple: (scores, indices)，形状均为 (nq, top_k)，按相似度降序。
+        """
+        queries = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+        if subset is not None:
+            splits = np.searchsorted(subset, self.boundaries)
+
+        with span(trace, "score"):
+            # 同一时刻只有一组请求在管道中，保证请求与结果一一对应
+            with self._lock:
+                sent, errors, broken = [], [], []
+                for i, shard in enumerate(self.shards):
+                    local = None if subset is None else subset[splits[i]:splits[i + 1]] - shard.start
+                    try:
+                        shard.send(queries, top_k, local)
+                        sent.append(shard)
+                    except Exception as e:
+                        errors.append(e)
+                        broken.append(shard)
+                # 读完每个已发送分片的结果（即使其他分片出错），管道中不残留本组结果
+                results = []
+                for shard in sent:
+                    try:
+                        results.append(shard.receive())
+                    except _ShardError as e:
+                        errors.append(e)
+                    except Exception as e:
+                        errors.append(e)
+                        broken.append(shard)
+                # 子进程退出或管道损坏的分片重新启动，下一次检索不会读到错位的结果
+                for shard in broken:
+                    try:
+                        shard.restart()
+                    except Exception as e:
+                        print(f"案例检索分片 [{shard.start}, {shard.end}) 重启失败: {e}")
+        if errors:
+            raise RuntimeError(f"案例检索分片出错: {type(errors[0]).__name__}: {errors[0]}")
+        with span(trace, "top_k"):
+            scores = np.concatenate([shard_scores for shard_scores, _ in results], axis=1)
+            indices = np.concatenate([shard_indices for _, shard_indices in results], axis=1)
+            top_scores, order = select_top_k(scores, top_k)
+            return top_scores, np.take_along_axis(indices, order, axis=1)
+
+    def close(self):
+        """停止全部分片子进程。"""
+        for shard in self.shards:
+            shard.close()
+
+
+# ===== 命令行：分片子进程入口 =====
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="案例检索分片子进程（由 ShardedIndex 启动）")
+    parser.add_argument("embedding_file", help="嵌入向量文件(.npy)")
+    parser.add_argument("--start", type=int, required=True, help="分片起始行")
+    parser.add_argument("--end", type=int, required=True, help="分片结束行（不含）")
+    args = parser.parse_args()
+    _serve_shard(args.embedding_file, args.start, args.end)
@@ -0,0 +1,291 @@
+import argparse
+import os
+
+import numpy as np
+
+from algo.index import chunked_top_k, l2_normalize, select_top_k
+from utils.timing import span
+
+QUANTIZED_DTYPES = ("float16", "int8")
+# 精确重排的候选数至少为 top_k 的倍数，/search 的排名窗口较大时重排仍然生效
+RESCORE_FACTOR = 2
+
+
+# ===== 嵌入向量文件 =====
+def open_embeddings(embedding_file, mmap=True, sample_size=1024):
+    """
+    打开案例嵌入向量矩阵。mmap 模式下多个 worker 进程共享操作系统页缓存，不各自持有副本。
+
+    参数:
+        embedding_file (str): .npy 嵌入向量文件路径。
+        mmap (bool): 是否以只读内存映射方式打开。
+        sample_size (int): 抽样检查归一化的行数。
+
+    返回:
+        numpy.ndarray: 归一化的 float32 矩阵（文件本身已归一化且为 float32 时为内存映射）
+    """
+    embeddings = np.load(embedding_file, mmap_mode="r" if mmap else None)
+    if not mmap:
+        return l2_normalize(embeddings)
+
+    # 抽样检查即可，避免为整块矩阵计算范数
+    sample = np.asarray(embeddings[:sample_size], dtype=np.float32)
+    norms = np.linalg.norm(sample, axis=1)
+    if embeddings.dtype == np.float32 and np.allclose(norms, 1.0, atol=1e-4):
+        return embeddings
+    print(f"{embedding_file} 不是归一化的 float32 矩阵，无法共享内存映射，改为载入内存。")
+    return l2_normalize(np.asarray(embeddings))
+
+def quantized_paths(embedding_file, dtype):
+    """返回量化向量文件及 int8 每行缩放系数文件的路径。"""
+    prefix = embedding_file[:-4] if embedding_file.endswith(".npy") else embedding_file
+    return f"{prefix}.{dtype}.npy", f"{prefix}.{dtype}.scales.npy"
+
+def quantize_embeddings(embedding_file, dtype, chunk_size=65536):
+    """
+    生成 float16 或 int8（每行一个缩放系数）量化向量文件，分块写入，内存占用与语料规模无关。
+
+    参数:
+        embedding_file (str): float32 嵌入向量文件路径。
+        dtype (str): float16 / int8。
+        chunk_size (int): 每次处理的行数。
+
+    返回:
+        tuple: (量化向量文件路径, 缩放系数文件路径或 None)
+    """
+    if dtype not in QUANTIZED_DTYPES:
+        raise ValueError(f"不支持的量化类型: {dtype}")
+    embeddings = np.load(embedding_file, mmap_mode="r")
+    vectors_file, scales_file = quantized_paths(embedding_file, dtype)
+    n = embeddings.shape[0]
+
+    # 先写临时文件，完成后原子替换，避免并发启动的 worker 读到半个文件
+    tmp_vectors_file = f"{vectors_file[:-4]}.{os.getpid()}.tmp.npy"
+    vectors = np.lib.format.open_memmap(tmp_vectors_file, mode="w+", dtype=dtype, shape=embeddings.shape)
+    scales = np.empty(n, dtype=np.float32) if dtype == "int8" else None
+
+    for start in range(0, n, chunk_size):
+        chunk = l2_normalize(embeddings[start:start + chunk_size])
+        if dtype == "float16":
+            vectors[start:start + len(chunk)] = chunk.astype(np.float16)
+        else:
+            chunk_scales = np.abs(chunk).max(axis=1) / 127.0
+            chunk_scales[chunk_scales == 0] = 1.0
+            vectors[start:start + len(chunk)] = np.round(chunk / chunk_scales[:, None]).astype(np.int8)
+            scales[start:start + len(chunk)] = chunk_scales
+    vectors.flush()
+    del vectors
+
+    if scales is not None:
+        tmp_scales_file = f"{scales_file[:-4]}.{os.getpid()}.tmp.npy"
+        np.save(tmp_scales_file, scales)
+        os.replace(tmp_scales_file, scales_file)
+    os.replace(tmp_vectors_file, vectors_file)
+    return vectors_file, scales_file if scales is not None else None
+
+
+# ===== 量化向量存储 =====
+class QuantizedEmbeddingStore:
+    """
+    以 float16 / int8 量化向量做全量打分，可选用原始 float32 向量对前若干候选精确重排。
+    量化文件与原始文件均以内存映射打开，重排只读取候选行。
+
+    参数:
+        embeddings (numpy.ndarray): 归一化的 float32 嵌入向量（通常为内存映射）。
+        embedding_file (str): 原始嵌入向量文件路径，用于定位量化文件，不存在时自动生成。
+        dtype (str): float16 / int8。
+        rescore_candidates (int): 精确重排的最少候选数（实际取 max(rescore_candidates, RESCORE_FACTOR * top_k)），0 为不重排。
+        chunk_size (int): 生成量化文件时每次处理的行数。
+    """
+
+    def __init__(self, embeddings, embedding_file, dtype="int8", rescore_candidates=0, chunk_size=65536):
+        if dtype not in QUANTIZED_DTYPES:
+            raise ValueError(f"不支持的量化类型: {dtype}")
+        self.backend = dtype
+        self.embeddings = embeddings
+        self.rescore_candidates = rescore_candidates
+        self.chunk_size = chunk_size
+
+        vectors_file, scales_file = quantized_paths(embedding_file, dtype)
+        if not os.path.exists(vectors_file) or os.path.getmtime(vectors_file) < os.path.getmtime(embedding_file):
+            print(f"正在生成 {dtype} 量化向量...")
+            quantize_embeddings(embedding_file, dtype, chunk_size=chunk_size)
+        self.vectors = np.load(vectors_file, mmap_mode="r")
+        self.scales = np.load(scales_file, mmap_mode="r") if dtype == "int8" else None
+        if self.vectors.shape[0] != embeddings.shape[0]:
+            raise ValueError(f"量化向量 {vectors_file} 与嵌入向量条数不一致，请删除后重新生成")
+
+    @property
+    def ntotal(self):
+        return self.vectors.shape[0]
+
+    def set_search_params(self, rescore_candidates=None, **params):
+        if rescore_candidates is not None:
+            self.rescore_candidates = rescore_candidates
+
+    def _candidate_count(self, top_k, total):
+        """精确重排的候选数，0 为不重排。"""
+        if self.rescore_candidates <= 0:
+            return 0
+        return min(max(self.rescore_candidates, RESCORE_FACTOR * top_k), total)
+
+    def _approximate_top_k(self, queries, top_k, subset=None):
+        # 有过滤条件时只读取、只打分允许的行；每块只转换 SCORE_CHUNK_SIZE 行，临时内存不抵消量化节省的内存
+        return chunked_top_k(queries, self.vectors, top_k, subset=subset, scales=self.scales)
+
+    def _rescore(self, queries, candidates, top_k):
+        rescored_scores, rescored_indices = [], []
+        for query, row_candidates in zip(queries, candidates):
+            # 排序后按行号顺序读取内存映射，减少随机 IO
+            row_candidates = np.sort(row_candidates)
+            exact = np.asarray(self.embeddings[row_candidates], dtype=np.float32) @ query
+            scores, order = select_top_k(exact.reshape(1, -1), top_k)
+            rescored_scores.append(scores[0])
+            rescored_indices.append(row_candidates[order[0]])
+        return np.stack(rescored_scores), np.stack(rescored_indices)
+
+    def search(self, query_embeddings, top_k, trace=None, subset=None):
+        """
+        检索最相似的 top_k 个案例，接口与 BruteForceIndex 一致。
+        分块打分与选择交替进行，整体记为 score，精确重排记为 rescore。
+
+        返回:
+            tuple: (scores, indices)，形状均为 (nq, top_k)，按相似度降序。
+        """
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        total = self.ntotal if subset is None else len(subset)
+        top_k = min(top_k, total)
+        n_candidates = self._candidate_count(top_k, total)
+        if not n_candidates:
+            with span(trace, "score"):
+                return self._approximate_top_k(queries, top_k, subset=subset)
+        with span(trace, "score"):
+            _, candidates = self._approximate_top_k(queries, n_candidates, subset=subset)
+        with span(trace, "rescore"):
+            return self._rescore(queries, candidates, top_k)
+
+
+# ===== PCA 降维 =====
+def pca_paths(embedding_file, dim):
+    """返回 PCA 降维向量文件及投影参数（均值、主成分）文件的路径。"""
+    prefix = embedding_file[:-4] if embedding_file.endswith(".npy") else embedding_file
+    return f"{prefix}.pca{dim}.npy", f"{prefix}.pca{dim}.model.npz"
+
+def fit_pca_projection(embedding_file, dim, sample_size=100000, chunk_size=65536, seed=0):
+    """
+    在抽样的行上拟合 PCA，并将全部向量投影到前 dim 个主成分，分块写入，内存占用与语料规模无关。
+
+    参数:
+        embedding_file (str): float32 嵌入向量文件路径。
+        dim (int): 降维后的维度。
+        sample_size (int): 拟合使用的行数。
+        chunk_size (int): 每次处理的行数。
+        seed (int): 抽样随机种子。
+
+    返回:
+        tuple: (降维向量文件路径, 投影参数文件路径)
+    """
+    embeddings = np.load(embedding_file, mmap_mode="r")
+    n, full_dim = embeddings.shape
+    if not 0 < dim < full_dim:
+        raise ValueError(f"PCA 维度须在 1 到 {full_dim - 1} 之间: {dim}")
+    vectors_file, model_file = pca_paths(embedding_file, dim)
+
+    # 在抽样行上累加一阶、二阶矩（float64），协方差矩阵只有 full_dim x full_dim
+    sample = np.sort(np.random.default_rng(seed).choice(n, size=min(n, sample_size), replace=False))
+    total = np.zeros(full_dim, dtype=np.float64)
+    gram = np.zeros((full_dim, full_dim), dtype=np.float64)
+    for start in range(0, len(sample), chunk_size):
+        chunk = l2_normalize(embeddings[sample[start:start + chunk_size]]).astype(np.float64)
+        total += chunk.sum(axis=0)
+        gram += chunk.T @ chunk
+    mean = total / len(sample)
+    eigenvalues, eigenvectors = np.linalg.eigh(gram / len(sample) - np.outer(mean, mean))
+    # eigh 按特征值升序返回
+    components = eigenvectors[:, ::-1][:, :dim].T.astype(np.float32)
+    explained = float(eigenvalues[::-1][:dim].sum() / max(eigenvalues.sum(), 1e-12))
+
+    tmp_vectors_file = f"{vectors_file[:-4]}.{os.getpid()}.tmp.npy"
+    vectors = np.lib.format.open_memmap(tmp_vectors_file, mode="w+", dtype=np.float32, shape=(n, dim))
+    offset = mean.astype(np.float32) @ components.T
+    for start in range(0, n, chunk_size):
+        chunk = l2_normalize(embeddings[start:start + chunk_size])
+        vectors[start:start + len(chunk)] = chunk @ components.T - offset
+    vectors.flush()
+    del vectors
+
+    tmp_model_file = f"{model_file[:-4]}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_model_file, mean=mean.astype(np.float32), components=components, explained=explained)
+    # 投影参数文件最后替换，存在即表示降维向量完整
+    os.replace(tmp_vectors_file, vectors_file)
+    os.replace(tmp_model_file, model_file)
+    print(f"PCA 降维 {full_dim} -> {dim}，保留方差 {explained:.1%}")
+    return vectors_file, model_file
+
+
+class PCAEmbeddingStore(QuantizedEmbeddingStore):
+    """
+    两阶段检索：先用 PCA 降维向量全量打分选出 rescore_candidates 个候选，再用原始 float32 向量精确重排。
+    全量扫描读取的数据量为原来的 dim / 原始维度。PCA 向量为 (x - mean) 的投影，
+    查询只需投影到主成分，q·mean 对同一查询为常数，不影响排序。
+
+    参数:
+        embeddings (numpy.ndarray): 归一化的 float32 嵌入向量（通常为内存映射）。
+        embedding_file (str): 原始嵌入向量文件路径，用于定位降维文件，不存在或过期时自动生成。
+        dim (int): 降维后的维度。
+        rescore_candidates (int): 精确重排的最少候选数（实际取 max(rescore_candidates, RESCORE_FACTOR * top_k)），0 为只返回降维打分的结果。
+        chunk_size (int): 拟合与生成降维文件时每次处理的行数。
+    """
+
+    def __init__(self, embeddings, embedding_file, dim=128, rescore_candidates=200, chunk_size=65536):
+        self.backend = "pca"
+        self.embeddings = embeddings
+        self.rescore_candidates = rescore_candidates
+        self.chunk_size = chunk_size
+
+        vectors_file, model_file = pca_paths(embedding_file, dim)
+        if not os.path.exists(model_file) or os.path.getmtime(model_file) < os.path.getmtime(embedding_file):
+            print(f"正在拟合 PCA 降维（{dim} 维）...")
+            fit_pca_projection(embedding_file, dim, chunk_size=chunk_size)
+        with np.load(model_file) as model:
+            self.mean = model["mean"]
+            self.components = model["components"]
+            self.explained = float(model["explained"])
+        self.vectors = np.load(vectors_file, mmap_mode="r")
+        self.scales = None
+        if self.vectors.shape[0] != embeddings.shape[0]:
+            raise ValueError(f"PCA 向量 {vectors_file} 与嵌入向量条数不一致，请删除后重新生成")
+
+    def search(self, query_embeddings, top_k, trace=None, subset=None):
+        """
+        检索最相似的 top_k 个案例，接口与 BruteForceIndex 一致。降维打分记为 score，精确重排记为 rescore。
+
+        返回:
+            tuple: (scores, indices)，形状均为 (nq, top_k)，按相似度降序。
+        """
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        total = self.ntotal if subset is None else len(subset)
+        top_k = min(top_k, total)
+        with span(trace, "score"):
+            projected = queries @ self.components.T
+            n_candidates = self._candidate_count(top_k, total)
+            if not n_candidates:
+                scores, indices = self._approximate_top_k(projected, top_k, subset=subset)
+                # 补上 q·mean，分数近似为余弦相似度
+                return scores + (queries @ self.mean)[:, None], indices
+            _, candidates = self._approximate_top_k(projected, n_candidates, subset=subset)
+        with span(trace, "rescore"):
+            return self._rescore(queries, candidates, top_k)
+
+
+# ===== 命令行：预先生成量化 / 降维文件 =====
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="生成 float16 / int8 量化或 PCA 降维的案例嵌入向量文件")
+    parser.add_argument("embedding_file", help="float32 嵌入向量文件(.npy)")
+    parser.add_argument("--dtype", choices=QUANTIZED_DTYPES + ("pca",), default="int8")
+    parser.add_argument("--pca-dim", type=int, default=128, help="--dtype pca 时降维后的维度")
+    args = parser.parse_args()
+    if args.dtype == "pca":
+        print(fit_pca_projection(args.embedding_file, args.pca_dim))
+    else:
+        print(quantize_embeddings(args.embedding_file, args.dtype))
@@ -7,6 +7,7 @@ from utils.db import init_db, cors
 from routes.user_routes import user_bp
 from routes.ai_routes import ai_bp
 from routes.law_routes import law_bp
+from routes.health_routes import health_bp
 
 
 if __name__ == "__main__":
@@ -21,5 +22,6 @@ if __name__ == "__main__":
     app.register_blueprint(user_bp)
     app.register_blueprint(ai_bp)
     app.register_blueprint(law_bp)
+    app.register_blueprint(health_bp)
 
     app.run(debug=True)
\ No newline at end of file
@@ -12,6 +12,85 @@ class AppConfig:
     # JWT 配置
     JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your_jwt_secret_key")
 
+    # 随机推荐（猜您想看 / 案例文书推荐）的内存 id 池刷新间隔秒数
+    RANDOM_POOL_TTL = float(os.getenv("RANDOM_POOL_TTL", "600"))
+    # 司法案例页面快照检查案例类别表是否重新生成的间隔秒数，重新生成后重新读取页面数据
+    BOARD_CHECK_INTERVAL = float(os.getenv("BOARD_CHECK_INTERVAL", "60"))
+
+class SearchConfig:
+    # 案例嵌入向量 / 元数据 / 编码模型（python -m algo.build_embeddings 可从数据库重新生成前两者）
+    EMBEDDING_FILE = os.getenv("SEARCH_EMBEDDING_FILE", "E:\Desktop\LawAI\LawAI-algoend\搜索\案例搜索\case_embeddings.npy")
+    METADATA_FILE = os.getenv("SEARCH_METADATA_FILE", "E:\Desktop\LawAI\LawAI-algoend\搜索\案例搜索\案例库数据全（清洗后）.json")
+    MODEL_NAME = os.getenv("SEARCH_MODEL_NAME", "E:\\Desktop\\LawAI\\LawAI-algoend\\multilingual-e5-large-instruct")
+    # 启动时即在后台加载案例检索系统，为 0 时在首次检索时加载
+    PRELOAD = os.getenv("SEARCH_PRELOAD", "1") == "1"
+    # /search 等待检索系统就绪的最长秒数
+    READY_TIMEOUT = float(os.getenv("SEARCH_READY_TIMEOUT", "5"))
+    # 检索系统加载失败后的首次重试间隔秒数（之后每次翻倍，不超过最大间隔），0 为不重试
+    LOAD_RETRY_INTERVAL = float(os.getenv("SEARCH_LOAD_RETRY_INTERVAL", "5"))
+    LOAD_RETRY_MAX = float(os.getenv("SEARCH_LOAD_RETRY_MAX", "300"))
+    # 查询编码器: sentence_transformers / onnx(动态 int8 量化) / onnx_fp32 / service(独立编码服务，web worker 不加载模型)
+    ENCODER_BACKEND = os.getenv("SEARCH_ENCODER_BACKEND", "sentence_transformers")
+    # 编码服务的 Unix 套接字路径（python -m algo.embedding_service 启动）/ 单次请求超时秒数
+    EMBEDDING_SERVICE_SOCKET = os.getenv("SEARCH_EMBEDDING_SOCKET", "/tmp/lawai-embedding.sock")
+    EMBEDDING_SERVICE_TIMEOUT = float(os.getenv("SEARCH_EMBEDDING_TIMEOUT", "30"))
+    # ONNX 导出目录（python -m algo.encoder export 生成）
+    ONNX_MODEL_DIR = os.getenv("SEARCH_ONNX_MODEL_DIR")
+    # ONNX Runtime 单算子线程数，0 为默认值
+    ENCODER_THREADS = int(os.getenv("SEARCH_ENCODER_THREADS", "0"))
+    # 案例向量索引: brute(精确检索) / float16 / int8(量化全量扫描) / pca(降维打分 + 精确重排) / ivf / hnsw / sharded(多进程分片精确检索)
+    INDEX_BACKEND = os.getenv("SEARCH_INDEX_BACKEND", "brute")
+    # 分片检索的子进程数，0 为 CPU 核数
+    SHARD_COUNT = int(os.getenv("SEARCH_SHARD_COUNT", "0"))
+    # 嵌入向量与列式元数据是否以内存映射方式打开（多 worker 共享页缓存）
+    EMBEDDING_MMAP = os.getenv("SEARCH_EMBEDDING_MMAP", "1") == "1"
+    # 量化 / 降维索引用 float32 向量精确重排的最少候选数（不少于 top_k 的 2 倍），0 为不重排
+    RESCORE_CANDIDATES = int(os.getenv("SEARCH_RESCORE_CANDIDATES", "200"))
+    # pca 索引降维后的维度（越小第一阶段越快、召回越低）
+    PCA_DIM = int(os.getenv("SEARCH_PCA_DIM", "128"))
+    # FAISS 索引缓存文件，为空时每次启动重新构建
+    INDEX_FILE = os.getenv("SEARCH_INDEX_FILE")
+    # IVF 参数：聚类数 / 查询扫描聚类数
+    IVF_NLIST = int(os.getenv("SEARCH_IVF_NLIST", "1024"))
+    IVF_NPROBE = int(os.getenv("SEARCH_IVF_NPROBE", "16"))
+    # HNSW 参数：邻居数 / 构建候选队列 / 查询候选队列
+    HNSW_M = int(os.getenv("SEARCH_HNSW_M", "32"))
+    HNSW_EF_CONSTRUCTION = int(os.getenv("SEARCH_HNSW_EF_CONSTRUCTION", "200"))
+    HNSW_EF_SEARCH = int(os.getenv("SEARCH_HNSW_EF_SEARCH", "64"))
+    # 裁判文书段落嵌入向量 / 元数据（python -m algo.documents 生成），为空时不启用裁判文书检索
+    DOCUMENT_EMBEDDING_FILE = os.getenv("SEARCH_DOCUMENT_EMBEDDING_FILE")
+    DOCUMENT_METADATA_FILE = os.getenv("SEARCH_DOCUMENT_METADATA_FILE")
+    # 裁判文书段落索引类型（默认与案例索引相同）/ FAISS 索引缓存文件
+    DOCUMENT_INDEX_BACKEND = os.getenv("SEARCH_DOCUMENT_INDEX_BACKEND", INDEX_BACKEND)
+    DOCUMENT_INDEX_FILE = os.getenv("SEARCH_DOCUMENT_INDEX_FILE")
+    # 每篇文书检索的段落候选倍数，段落按文书聚合后取 top_k
+    DOCUMENT_PASSAGE_OVERSAMPLE = int(os.getenv("SEARCH_DOCUMENT_PASSAGE_OVERSAMPLE", "4"))
+    # 混合检索：BM25 关键词检索与向量检索并行，结果以 RRF 融合（开启后 /search 的 score 为归一化 RRF 得分而非余弦相似度）
+    HYBRID_SEARCH = os.getenv("SEARCH_HYBRID", "0") == "1"
+    # 分词方式: bigram(字符二元组，当事人名等未登录词也能精确命中) / jieba
+    LEXICAL_TOKENIZER = os.getenv("SEARCH_LEXICAL_TOKENIZER", "bigram")
+    # 每路参与融合的候选数 / RRF 平滑参数
+    HYBRID_CANDIDATES = int(os.getenv("SEARCH_HYBRID_CANDIDATES", "100"))
+    RRF_K = int(os.getenv("SEARCH_RRF_K", "60"))
+    # /search 分页：每次检索保留的排名窗口大小 / 默认与最大分页大小
+    WINDOW_SIZE = int(os.getenv("SEARCH_WINDOW_SIZE", "200"))
+    PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "20"))
+    MAX_PAGE_SIZE = int(os.getenv("SEARCH_MAX_PAGE_SIZE", "50"))
+    # 检索结果缓存：最大条目数 / 有效期(秒)
+    RESULT_CACHE_SIZE = int(os.getenv("SEARCH_RESULT_CACHE_SIZE", "2048"))
+    RESULT_CACHE_TTL = float(os.getenv("SEARCH_RESULT_CACHE_TTL", "3600"))
+    # 检查语料文件（嵌入向量 / 元数据 / 增量）是否更新的间隔秒数，更新后后台重新加载，0 为不检查
+    CORPUS_CHECK_INTERVAL = float(os.getenv("SEARCH_CORPUS_CHECK_INTERVAL", "60"))
+    # 增量（新增 / 修改行与墓碑）超过基础语料该比例时在后台压缩进基础语料，0 为不自动压缩
+    COMPACT_THRESHOLD = float(os.getenv("SEARCH_COMPACT_THRESHOLD", "0.1"))
+    # 查询合并：每批最多查询数 / 最长等待毫秒数
+    BATCH_MAX_SIZE = int(os.getenv("SEARCH_BATCH_MAX_SIZE", "16"))
+    BATCH_MAX_WAIT_MS = float(os.getenv("SEARCH_BATCH_MAX_WAIT_MS", "5"))
+    # 查询向量缓存：最大条目数 / 有效期(秒，为空不过期) / 持久化文件(为空不持久化)
+    QUERY_CACHE_SIZE = int(os.getenv("SEARCH_QUERY_CACHE_SIZE", "10000"))
+    QUERY_CACHE_TTL = float(os.getenv("SEARCH_QUERY_CACHE_TTL")) if os.getenv("SEARCH_QUERY_CACHE_TTL") else None
+    QUERY_CACHE_FILE = os.getenv("SEARCH_QUERY_CACHE_FILE")
+
 class OssConfig:
     OSS_SECRET_ID = os.getenv("OSS_SECRET_ID")
     OSS_SECRET_KEY = os.getenv("OSS_SECRET_KEY")
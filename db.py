@@ -1,11 +1,15 @@
 # db.py
 from flask import current_app
+import hashlib
 import traceback
 from extension import db
 from model.ai import ApiSession, Question, WebSearchResult, RAGResult, Session
 from model.user import User, Collect, UserSession
-from model.law import JudicalCase, JudgmentDocument, Law, LitigationDocument
+from model.law import JudicalCase, JudgmentDocument, Law, LitigationDocument, CaseCategory
 from model.uploads import UploadFile, UploadPic
+from config import AppConfig
+from utils.sampling import RandomIdPool
+from algo.filters import CASE_CATEGORIES, case_categories
 
 """注册用户"""
 def user_register(username, password):
@@ -201,17 +205,24 @@ def add_session_title(session_id, title):
     db.session.commit()
     return True, session.id
 
-# 获取用户历史AI会话
-def get_user_history_sessions(user_id):
-    # 获取用户的所有session_id
-    user_sessions = UserSession.query.filter_by(user_id=user_id).all()
-    # 查找每个session_id对应的session
-    sessions = []
-    for user_session in user_sessions:
-        session = Session.query.filter_by(session_id=user_session.session_id).first()
-        if session:
-            sessions.append(session)
-    return True, sessions
+# 获取用户历史AI会话：一次联表查询，按创建时间倒序，keyset 分页
+def get_user_history_sessions(user_id, limit=20, before=None):
+    """
+    :param limit: 每页会话数
+    :param before: 上一页最后一条会话的 (created_at, id)，为空时取第一页
+    :return: (True, 本页会话列表, 是否还有更多)
+    """
+    query = Session.query.join(UserSession, UserSession.session_id == Session.session_id) \
+        .filter(UserSession.user_id == user_id)
+    if before is not None:
+        created_at, session_pk = before
+        query = query.filter(db.or_(
+            Session.created_at < created_at,
+            db.and_(Session.created_at == created_at, Session.id < session_pk)
+        ))
+    # 同一会话可能被关联多次，去重；多取一条判断是否还有下一页
+    sessions = query.distinct().order_by(Session.created_at.desc(), Session.id.desc()).limit(limit + 1).all()
+    return True, sessions[:limit], len(sessions) > limit
 
 # 用户上传文件(docx / pptx / xlsx)
 def add_upload_file(user_id, file_name, file_url):
@@ -255,12 +266,27 @@ def get_hot_cases():
     hot_cases = JudicalCase.query.filter(JudicalCase.id >= 301, JudicalCase.id <= 310).all()
     return True, hot_cases
 
+# 随机抽样：每张表一个内存 id 池，按池中随机 id 一次 IN 查询取行，不再 ORDER BY random() 全表排序
+_id_pools = {}
+
+def sample_rows(model, k):
+    pool = _id_pools.get(model)
+    if pool is None:
+        pool = _id_pools.setdefault(model, RandomIdPool(
+            lambda: (row_id for row_id, in db.session.query(model.id).yield_per(10000)),
+            ttl=AppConfig.RANDOM_POOL_TTL
+        ))
+    ids = pool.sample(k)
+    rows = {row.id: row for row in model.query.filter(model.id.in_(ids)).all()} if ids else {}
+    # 池刷新前被删除的 id 直接跳过
+    return [rows[row_id] for row_id in ids if row_id in rows]
+
 # 用户推荐-猜您想看
 def get_interest():
     # 随机获取judical_case表中5个案例
-    case_interest = JudicalCase.query.order_by(db.func.random()).limit(5).all()
+    case_interest = sample_rows(JudicalCase, 5)
     # 随机获取judgment_document表中5个案例
-    document_interest = JudgmentDocument.query.order_by(db.func.random()).limit(5).all()
+    document_interest = sample_rows(JudgmentDocument, 5)
 
     return True, case_interest, document_interest
 
@@ -273,48 +299,102 @@ def get_judgment_document_by_id(id):
         return False, "Judgment document not found"
     
 # 获取id裁判文书的相关判决
-def get_related_judgment(id):
-    # TODO：相关判决获取方式
+def get_related_judgment(id, related_ids=None):
+    # related_ids 为近邻图中的相关文书 id（按相似度排序），一次 IN 查询取回
+    if related_ids is not None:
+        return True, get_judgment_documents_by_ids(related_ids)
 
-    # 获取民事判决5条,从id为115开始
+    # 未构建近邻图时：获取民事判决5条,从id为115开始
     civil_judgment = JudgmentDocument.query.filter(JudgmentDocument.document_type == '民事案件', JudgmentDocument.id >= 115).limit(5).all()
     # 获取刑事判决5条
     criminal_judgment = JudgmentDocument.query.filter(JudgmentDocument.document_type == '刑事案件', JudgmentDocument.id!= id).limit(5).all()
 
-    judgments = [civil_judgment, criminal_judgment]
+    judgments = civil_judgment + criminal_judgment
 
     return True, judgments
 
-
-# 司法案例页面-获取指导性案例
-def get_judicial_direction_cases_board():
-    # 获取关键词中包含 “刑事” 且 title中包含 “指导” 的案例 前10个
-    criminal_direction_cases = JudicalCase.query.filter(JudicalCase.keywords.like('%刑事%'), JudicalCase.title.like('%指导%')).limit(10).all()
-    # 获取关键词中包含 “民事” 且 title中包含 “指导” 的案例
-    civil_direction_cases = JudicalCase.query.filter(JudicalCase.keywords.like('%民事%'), JudicalCase.title.like('%指导%')).limit(10).all()
-    # 获取关键词中包含 “行政” 且 title中包含 “指导” 的案例
-    administrative_direction_cases = JudicalCase.query.filter(JudicalCase.keywords.like('%行政%'), JudicalCase.title.like('%指导%')).limit(10).all()
-    # 获取关键词中包含 “赔偿” 且 title中包含 “指导” 的案例
-    compensation_direction_cases = JudicalCase.query.filter(JudicalCase.keywords.like('%赔偿%'), JudicalCase.title.like('%指导%')).limit(10).all()
-    # 获取关键词中包含 “执行” 且 title中包含 “指导” 的案例
-    execution_direction_cases = JudicalCase.query.filter(JudicalCase.keywords.like('%执行%'), JudicalCase.title.like('%指导%')).limit(10).all()
-
-    return True, criminal_direction_cases, civil_direction_cases, administrative_direction_cases, compensation_direction_cases, execution_direction_cases
-
-# 司法案例页面-获取参考性案例
-def get_judicial_reference_cases_board():
-    # 获取关键词中包含 “刑事” 且 title中不包含 “指导” 的案例 前10个
-    criminal_reference_cases = JudicalCase.query.filter(JudicalCase.keywords.like('%刑事%'), JudicalCase.title.notlike('%指导%')).limit(10).all()
-    # 获取关键词中包含 “民事” 且 title中不包含 “指导” 的案例
-    civil_reference_cases = JudicalCase.query.filter(JudicalCase.keywords.like('%民事%'), JudicalCase.title.notlike('%指导%')).limit(10).all()
-    # 获取关键词中包含 “行政” 且 title中不包含 “指导” 的案例
-    administrative_reference_cases = JudicalCase.query.filter(JudicalCase.keywords.like('%行政%'), JudicalCase.title.notlike('%指导%')).limit(10).all()
-    # 获取关键词中包含 “赔偿” 且 title中不包含 “指导” 的案例
-    compensation_reference_cases = JudicalCase.query.filter(JudicalCase.keywords.like('%赔偿%'), JudicalCase.title.notlike('%指导%')).limit(10).all()
-    # 获取关键词中包含 “执行” 且 title中不包含 “指导” 的案例
-    execution_reference_cases = JudicalCase.query.filter(JudicalCase.keywords.like('%执行%'), JudicalCase.title.notlike('%指导%')).limit(10).all()
-
-    return True, criminal_reference_cases, civil_reference_cases, administrative_reference_cases, compensation_reference_cases, execution_reference_cases
+# 按 id 列表获取裁判文书，保持 ids 的顺序，不存在的跳过
+def get_judgment_documents_by_ids(ids):
+    if not ids:
+        return []
+    documents = {doc.id: doc for doc in JudgmentDocument.query.filter(JudgmentDocument.id.in_(ids)).all()}
+    return [documents[doc_id] for doc_id in ids if doc_id in documents]
+
+# 按 id 列表获取司法案例，保持 ids 的顺序，不存在的跳过
+def get_judicial_cases_by_ids(ids):
+    if not ids:
+        return []
+    cases = {case.id: case for case in JudicalCase.query.filter(JudicalCase.id.in_(ids)).all()}
+    return [cases[case_id] for case_id in ids if case_id in cases]
+
+
+# 案例类别表版本号：(行数, 最大 id)；表使用自增主键，每次重新生成后都会变化
+def get_case_categories_version():
+    count, max_id = db.session.query(db.func.count(CaseCategory.id), db.func.max(CaseCategory.id)).one()
+    return count, max_id
+
+# 由 judicial_cases 计算案例类别行 (case_id, category, is_guidance)，按 case_id 排序
+def _expected_case_category_rows(batch_size):
+    query = db.session.query(JudicalCase.id, JudicalCase.title, JudicalCase.keywords).order_by(JudicalCase.id)
+    for case_id, title, keywords in query.yield_per(batch_size):
+        # 与原先的 LIKE 条件一致：关键词包含类别匹配词、标题包含“指导”
+        is_guidance = '指导' in (title or '')
+        for category in case_categories(keywords) or [None]:
+            yield case_id, category, is_guidance
+
+def _rows_digest(rows):
+    digest = hashlib.sha1()
+    for row in rows:
+        digest.update(repr(tuple(row)).encode('utf-8'))
+    return digest.hexdigest()
+
+# 由 judicial_cases 生成 case_categories，内容已一致时跳过；
+# 会写库，只在启动（init_db）或离线（python -m utils.db sync-case-categories）时调用，不在请求中调用
+def sync_case_categories(full=False, batch_size=10000):
+    """
+    :param full: 为 True 时不比较内容，直接重新生成
+    :param batch_size: 每批读取 / 写入行数
+    :return: 是否重新生成
+    """
+    if not full:
+        # 逐行比较内容（而非行数与最大 id），案例标题 / 关键词被原地修改也能发现
+        current = db.session.query(CaseCategory.case_id, CaseCategory.category, CaseCategory.is_guidance) \
+            .order_by(CaseCategory.case_id, CaseCategory.id).yield_per(batch_size)
+        if _rows_digest(current) == _rows_digest(_expected_case_category_rows(batch_size)):
+            return False
+
+    CaseCategory.query.delete()
+    rows = []
+    for case_id, category, is_guidance in _expected_case_category_rows(batch_size):
+        rows.append({"case_id": case_id, "category": category, "is_guidance": is_guidance})
+        if len(rows) >= batch_size:
+            db.session.bulk_insert_mappings(CaseCategory, rows)
+            rows = []
+    db.session.bulk_insert_mappings(CaseCategory, rows)
+    db.session.commit()
+    return True
+
+# 司法案例页面：每个类别的指导性 / 参考性案例各取前 limit 个（一次窗口查询 + 一次 IN 查询）
+def get_judicial_cases_board(limit=10):
+    """
+    :return: (True, {类别: {"direction_cases": [案例], "reference_cases": [案例]}})
+    """
+    ranked = db.session.query(
+        CaseCategory.category, CaseCategory.is_guidance, CaseCategory.case_id,
+        db.func.row_number().over(
+            partition_by=(CaseCategory.category, CaseCategory.is_guidance),
+            order_by=CaseCategory.case_id
+        ).label("rank")
+    ).filter(CaseCategory.category.isnot(None)).subquery()
+    rows = db.session.query(ranked.c.category, ranked.c.is_guidance, ranked.c.case_id) \
+        .filter(ranked.c.rank <= limit).order_by(ranked.c.case_id).all()
+    cases = {case.id: case for case in get_judicial_cases_by_ids(list({row.case_id for row in rows}))}
+
+    board = {category: {"direction_cases": [], "reference_cases": []} for category in CASE_CATEGORIES}
+    for category, is_guidance, case_id in rows:
+        if case_id in cases:
+            board[category]["direction_cases" if is_guidance else "reference_cases"].append(cases[case_id])
+    return True, board
 
 
 # 裁判文书页面-获取count
@@ -346,13 +426,13 @@ def get_judgement_docs_board():
 def get_docs_recommend():
     # TODO： 基于用户行为获取案例文书推荐
     # 随机获取案例15个
-    case_judgement_docs = JudicalCase.query.order_by(db.func.random()).limit(15).all()
+    case_judgement_docs = sample_rows(JudicalCase, 15)
     # 随机获取裁判文书15个
-    document_judgement_docs = JudgmentDocument.query.order_by(db.func.random()).limit(15).all()
+    document_judgement_docs = sample_rows(JudgmentDocument, 15)
     # 随机获取法律文书15个
-    law_judgement_docs = Law.query.order_by(db.func.random()).limit(15).all()
+    law_judgement_docs = sample_rows(Law, 15)
     # 获取诉讼文书15个
-    litigation_judgement_docs = LitigationDocument.query.order_by(db.func.random()).limit(15).all()
+    litigation_judgement_docs = sample_rows(LitigationDocument, 15)
 
     return True, case_judgement_docs, document_judgement_docs, law_judgement_docs, litigation_judgement_docs
     
@@ -370,78 +450,66 @@ def get_case_knowledge_graph(keyword):
     return True, results
 
 
-# 获取用户收藏统计
+# 收藏类型 -> (文书模型, 列表项字段)
+COLLECT_TYPES = {
+    'LAWS': (Law, lambda law: {
+        "title": law.title,
+        "law_category": law.law_category
+    }),
+    'JUDICIAL_CASES': (JudicalCase, lambda case: {
+        "title": case.title,
+        "keywords": case.keywords.split(' ')
+    }),
+    'JUDGMENT_DOCUMENTS': (JudgmentDocument, lambda doc: {
+        "title": doc.title,
+        "cause": doc.cause.split('、') if doc.cause else []
+    }),
+}
+
+# 获取用户收藏统计：一次 GROUP BY 得到各类型收藏数
 def get_collect_dashboard(user_id):
-    # 获取用户收藏法律文书统计
-    collect_laws_count = Collect.query.filter_by(user_id=user_id, doc_type='LAWS').count()
-
-    # 获取用户收藏案例统计
-    collect_case_count = Collect.query.filter_by(user_id=user_id, doc_type='JUDICIAL_CASES').count()
-    
-    # 获取用户收藏的判决书统计
-    collect_doc_count = Collect.query.filter_by(user_id=user_id, doc_type='JUDGMENT_DOCS').count()
+    counts = dict(
+        db.session.query(Collect.doc_type, db.func.count(Collect.id))
+        .filter(Collect.user_id == user_id)
+        .group_by(Collect.doc_type)
+        .all()
+    )
+    collect_laws_count = counts.get('LAWS', 0)
 
     # 案例文书统计
-    sum_case_doc_count = collect_case_count + collect_doc_count
+    sum_case_doc_count = counts.get('JUDICIAL_CASES', 0) + counts.get('JUDGMENT_DOCUMENTS', 0)
 
     return True, collect_laws_count, sum_case_doc_count
 
-# 获取用户收藏-法律文书收藏
-def get_collect_laws(user_id):
-    collect_laws_count = Collect.query.filter_by(user_id=user_id, doc_type='LAWS').count()
-    collect_laws = Collect.query.filter_by(user_id=user_id, doc_type='LAWS').limit(10).all()
-
-    collect_list = []
-    # 获取对应的法律文书
-    for idx, collect_law in enumerate(collect_laws):
-        law = Law.query.get(collect_law.doc_id)
-        collect_list.append({
-            "doc_id": law.id,
-            "index": idx,
-            "title": law.title,
-            "law_category": law.law_category,
-            "doc_type": "LAWS",
-            "collect_date": collect_law.collect_date.strftime("%Y-%m-%d")
-        })
-
-    return True, collect_list, collect_laws_count
-
-# 获取用户收藏-案例
-def get_collect_cases(user_id):
-    collect_cases_count = Collect.query.filter_by(user_id=user_id, doc_type='JUDICIAL_CASES').count()
-    collect_cases = Collect.query.filter_by(user_id=user_id, doc_type='JUDICIAL_CASES').limit(10).all()
-
-    collect_list = []
-    # 获取对应的案例
-    for idx, collect_case in enumerate(collect_cases):
-        case = JudicalCase.query.get(collect_case.doc_id)
-        collect_list.append({
-            "doc_id": case.id,
-            "index": idx,
-            "title": case.title,
-            "keywords": case.keywords.split(' '),
-            "doc_type": "JUDICIAL_CASES",
-            "collect_date": collect_case.collect_date.strftime("%Y-%m-%d")
-        })
-
-    return True, collect_list, collect_cases_count
-
-# 获取用户收藏-裁判文书
-def get_collect_docs(user_id):
-    collect_docs_count = Collect.query.filter_by(user_id=user_id, doc_type='JUDGMENT_DOCUMENTS').count()
-    collect_docs = Collect.query.filter_by(user_id=user_id, doc_type='JUDGMENT_DOCUMENTS').limit(10).all()
-
-    collect_list = []
-    # 获取对应的法律文书
-    for idx, collect_doc in enumerate(collect_docs):
-        doc = JudgmentDocument.query.get(collect_doc.doc_id)
-        collect_list.append({
-            "doc_id": doc.id,
-            "index": idx,
-            "title": doc.title,
-            "cause": doc.cause.split('、') if doc.cause else [],
-            "doc_type": "JUDGMENT_DOCUMENTS",
-            "collect_date": collect_doc.collect_date.strftime("%Y-%m-%d")
-        })
-
-    return True, collect_list, collect_docs_count
\ No newline at end of file
+# 获取用户收藏列表：收藏与对应文书联表一次取出，按收藏时间倒序，keyset 分页
+def get_collects(user_id, doc_type, limit=10, before=None):
+    """
+    :param doc_type: 收藏类型，COLLECT_TYPES 的键
+    :param limit: 每页条数
+    :param before: 上一页最后一条收藏的 (collect_date, id)，为空时取第一页
+    :return: (True, [(收藏, 文书)], 是否还有更多, 该类型收藏总数) 或 (False, 错误信息)
+    """
+    if doc_type not in COLLECT_TYPES:
+        return False, f"不支持的收藏类型: {doc_type}"
+    model = COLLECT_TYPES[doc_type][0]
+
+    filters = (Collect.user_id == user_id, Collect.doc_type == doc_type)
+    count = Collect.query.filter(*filters).count()
+    # 已删除的文书不会出现在联表结果中
+    query = db.session.query(Collect, model).join(model, model.id == Collect.doc_id).filter(*filters)
+    if before is not None:
+        collect_date, collect_pk = before
+        query = query.filter(db.or_(
+            Collect.collect_date < collect_date,
+            db.and_(Collect.collect_date == collect_date, Collect.id < collect_pk)
+        ))
+    rows = query.order_by(Collect.collect_date.desc(), Collect.id.desc()).limit(limit + 1).all()
+    return True, rows[:limit], len(rows) > limit, count
+
+# 收藏列表项
+def serialize_collect(collect, doc, index):
+    item = {"doc_id": doc.id, "index": index}
+    item.update(COLLECT_TYPES[collect.doc_type][1](doc))
+    item["doc_type"] = collect.doc_type
+    item["collect_date"] = collect.collect_date.strftime("%Y-%m-%d")
+    return item
\ No newline at end of file
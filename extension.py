@@ -1,19 +1,29 @@
 from rich.console import Console
-from config import AppConfig, ApiKeyConfig, PromptConfig
+from config import AppConfig, ApiKeyConfig, PromptConfig, SearchConfig
 from openai import OpenAI
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-from algo.search import initialize_case_retrieval_system
+from algo.retrieval import CaseRetrievalSystem, DocumentRetrievalSystem
 
 db = SQLAlchemy()
 
 console = Console()
 
 # ===== 配置参数 =====
-EMBEDDING_FILE = "E:\Desktop\LawAI\LawAI-algoend\搜索\案例搜索\case_embeddings.npy"
-METADATA_FILE = "E:\Desktop\LawAI\LawAI-algoend\搜索\案例搜索\案例库数据全（清洗后）.json"
-MODEL_NAME = "E:\\Desktop\\LawAI\\LawAI-algoend\\multilingual-e5-large-instruct"
-model, embeddings, metadata = initialize_case_retrieval_system(EMBEDDING_FILE, METADATA_FILE, MODEL_NAME)
+EMBEDDING_FILE = SearchConfig.EMBEDDING_FILE
+METADATA_FILE = SearchConfig.METADATA_FILE
+MODEL_NAME = SearchConfig.MODEL_NAME
+# 案例检索系统在后台线程加载，不阻塞导入；SEARCH_PRELOAD=0 时在首次检索时加载
+case_retrieval = CaseRetrievalSystem(EMBEDDING_FILE, METADATA_FILE, MODEL_NAME, SearchConfig)
+if SearchConfig.PRELOAD:
+    case_retrieval.start()
+# 裁判文书检索与案例检索共用编码模型，未配置段落嵌入向量时不启用
+document_retrieval = None
+if SearchConfig.DOCUMENT_EMBEDDING_FILE:
+    document_retrieval = DocumentRetrievalSystem(SearchConfig.DOCUMENT_EMBEDDING_FILE, SearchConfig.DOCUMENT_METADATA_FILE,
+                                                 case_retrieval, SearchConfig)
+    if SearchConfig.PRELOAD:
+        document_retrieval.start()
 
 qwen_client = OpenAI(
     api_key=ApiKeyConfig.QWEN_API_KEY,
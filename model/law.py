@@ -13,6 +13,21 @@ class JudicalCase(db.Model):
     related_laws = db.Column(db.Text, nullable=True) # 关联索引-关联法条
     related_trial = db.Column(db.Text, nullable=True) # 关联索引-关联审判程序
 
+# 司法案例类别（由 judicial_cases 派生，db.sync_case_categories 在启动时 / 离线生成）：案例 id -> 类别 + 是否指导性案例
+# 一个案例可属于多个类别，不属于任何类别的案例 category 为空，保证每个案例至少一行，便于判断是否需要重新生成
+class CaseCategory(db.Model):
+    __tablename__ = "case_categories"
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    case_id = db.Column(db.Integer, nullable=False, index=True)
+    category = db.Column(db.String(20), nullable=True) # 刑事 / 民事 / 行政 / 国家赔偿 / 执行
+    is_guidance = db.Column(db.Boolean, nullable=False) # 标题含“指导”为指导性案例，否则为参考性案例
+
+    # 主键单调递增（重新生成后不复用旧 id），(行数, 最大 id) 可作为表的版本号
+    __table_args__ = (
+        db.Index('ix_case_categories_board', 'category', 'is_guidance', 'case_id'),
+        {'sqlite_autoincrement': True},
+    )
+
 # 裁判文书
 class JudgmentDocument(db.Model):
     __tablename__ = "judgment_documents"
@@ -24,8 +24,13 @@ class Collect(db.Model):
     doc_type = db.Column(db.String(50), nullable=False)
     collect_date = db.Column(db.DateTime, nullable=False, default=datetime.now(timezone.utc))
 
+    # 收藏列表按 (用户, 类型) 过滤、按收藏时间排序
+    __table_args__ = (
+        db.Index('ix_collects_user_type_date', 'user_id', 'doc_type', 'collect_date'),
+    )
+
 class UserSession(db.Model):
     __tablename__ = "user_sessions"
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     session_id = db.Column(db.String(100), nullable=False)
\ No newline at end of file
@@ -2,6 +2,7 @@ from flask import Blueprint, Response, request, current_app, stream_with_context
 import uuid
 import json
 import re
+from datetime import datetime
 from http import HTTPStatus
 import requests
 
@@ -13,6 +14,7 @@ from config import  AppConfig, ApiKeyConfig, OssConfig, PromptConfig
 from utils.result import error_response, success_response
 from utils.jwt import generate_token, token_required
 from utils.upload import file_uploader
+from utils.pagination import encode_cursor, decode_cursor, parse_page_size
 
 from db import add_pic_file, add_question_answer, add_question_summary, add_upload_file, create_apisession, create_session, associate_user_with_session, add_question_to_session, get_apisession, get_question_by_id, get_answer_by_question_id, get_user_history_sessions
 from db import add_session_title
@@ -20,6 +22,10 @@ from db import add_web_search_result, get_retrieve_data
 
 ai_bp = Blueprint('ai', __name__)
 
+# 历史会话列表默认 / 最大分页大小
+HISTORY_PAGE_SIZE = 20
+HISTORY_MAX_PAGE_SIZE = 100
+
 # 提取用户问题关键词
 def extract_search_keywords(user_question):
     prompt = PromptConfig.KEYWORD_EXTRACTION_PROMPT + f'用户问题：{user_question}'
@@ -437,8 +443,16 @@ def title_refresh():
 @token_required
 def chat_history():
     user_id = request.user_id
-    # 获取用户全部历史记录
-    success, sessions = get_user_history_sessions(user_id)
+    # 分页：按创建时间倒序，cursor 记录上一页最后一条会话的 (创建时间, id)
+    page_size = parse_page_size(request.args.get('page_size'), default=HISTORY_PAGE_SIZE, max_size=HISTORY_MAX_PAGE_SIZE)
+    before = None
+    if request.args.get('cursor'):
+        cursor = decode_cursor(request.args.get('cursor'))
+        try:
+            before = (datetime.fromisoformat(cursor['t']), int(cursor['i']))
+        except (TypeError, KeyError, ValueError):
+            return error_response('无效的分页游标', 400)
+    success, sessions, has_more = get_user_history_sessions(user_id, limit=page_size, before=before)
     if not success:
         return error_response(sessions)
     # 整理返回数据
@@ -451,8 +465,13 @@ def chat_history():
 
         })
 
+    next_cursor = None
+    if has_more:
+        next_cursor = encode_cursor({"t": sessions[-1].created_at.isoformat(), "i": sessions[-1].id})
     res = {
         "count": len(history_items),
-        "historyItems": history_items
+        "historyItems": history_items,
+        "has_more": has_more,
+        "next_cursor": next_cursor
     }
     return success_response(res)
@@ -0,0 +1,29 @@
+from flask import Blueprint
+
+from utils.result import error_response, success_response
+from utils.timing import metrics_sink
+from extension import case_retrieval, document_retrieval
+
+health_bp = Blueprint('health', __name__)
+
+# 存活探针：进程能响应即可
+@health_bp.route('/healthz', methods=['GET'])
+def healthz():
+    return success_response({"status": "ok"})
+
+# 就绪探针：案例检索系统加载并预热完成后才返回 200
+@health_bp.route('/readyz', methods=['GET'])
+def readyz():
+    status = case_retrieval.status()
+    if not case_retrieval.ready:
+        # 探针依赖 HTTP 状态码，这里同时设置响应状态
+        return error_response(f"案例检索系统未就绪: {status['state']}", 503), 503
+    # 裁判文书检索为附加功能，不影响就绪状态
+    if document_retrieval is not None:
+        status["documents"] = document_retrieval.status()
+    return success_response(status)
+
+# 检索各阶段耗时分位数（最近样本）
+@health_bp.route('/metrics', methods=['GET'])
+def metrics():
+    return success_response(metrics_sink.summary())
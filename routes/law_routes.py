@@ -1,23 +1,41 @@
 from flask import Blueprint, request
-import time
+import hashlib
 import json
+import os
 import random
+from datetime import datetime
 from utils.result import error_response, success_response
 from utils.jwt import generate_token, token_required
-from db import get_judicial_case_by_id, get_judgment_document_by_id, get_judicial_direction_cases_board, get_judicial_reference_cases_board
+from utils.pagination import encode_cursor, decode_cursor, parse_page_size
+from db import get_judicial_case_by_id, get_judgment_document_by_id, get_judicial_cases_board, get_case_categories_version
 from db import get_judgement_count, get_judgement_docs_board
 from db import get_hot_cases, get_interest, get_related_judgment
-from db import get_docs_recommend
-from db import get_collect_dashboard, get_collect_laws, get_collect_cases, get_collect_docs
+from db import get_docs_recommend, get_judicial_cases_by_ids
+from db import get_collect_dashboard, get_collects, serialize_collect
 from db import get_case_knowledge_graph
 
-from algo.search import find_similar_cases
+from algo.retrieval import RetrievalNotReady
+from algo.filters import CASE_CATEGORIES
+from algo.neighbors import open_neighbor_graph, neighbor_graph_path
+from utils.timing import SearchTrace, metrics_sink
+from utils.snapshot import VersionedSnapshot
 
+from config import AppConfig, SearchConfig
 from extension import console
-from extension import model, embeddings, metadata
+from extension import case_retrieval, document_retrieval
 
 law_bp = Blueprint('law', __name__)
 
+
+# 离线构建的近邻图（python -m algo.neighbors），未构建时返回 None
+def case_neighbor_graph():
+    return open_neighbor_graph(neighbor_graph_path(SearchConfig.EMBEDDING_FILE))
+
+def document_neighbor_graph():
+    if not SearchConfig.DOCUMENT_EMBEDDING_FILE:
+        return None
+    return open_neighbor_graph(neighbor_graph_path(SearchConfig.DOCUMENT_EMBEDDING_FILE))
+
 # 首页搜索
 @law_bp.route('/search', methods=['POST'])
 def search():
@@ -25,56 +43,123 @@ def search():
     query_str = data.get('user_input')
     if not query_str:
         return error_response('请输入关键词')
-    
-    # 案例搜索开始计时
-    case_search_start_time = time.time()
 
-    top_k = 20
-    results = find_similar_cases(model, embeddings, metadata, query_str, top_k)
+    # 类别过滤（刑事 / 民事 / 行政 / 国家赔偿 / 执行），可传单个类别或类别列表
+    categories = data.get('category') or []
+    if isinstance(categories, str):
+        categories = [categories]
+    if not isinstance(categories, list) or any(category not in CASE_CATEGORIES for category in categories):
+        return error_response('无效的案例类别', 400)
+
+    # 检索对象：JUDICIAL_CASES（司法案例，默认）/ JUDGMENT_DOCUMENT（裁判文书，按段落检索后聚合）
+    doc_type = data.get('doc_type') or 'JUDICIAL_CASES'
+    if doc_type not in ('JUDICIAL_CASES', 'JUDGMENT_DOCUMENT'):
+        return error_response('无效的 doc_type', 400)
+    if doc_type == 'JUDGMENT_DOCUMENT':
+        if document_retrieval is None:
+            return error_response('裁判文书检索未启用', 400)
+        if categories:
+            return error_response('裁判文书检索不支持类别过滤', 400)
+    retrieval = case_retrieval if doc_type == 'JUDICIAL_CASES' else document_retrieval
+
+    # 分页：首次请求取排名窗口的第一页，后续用 cursor（或 offset）从同一窗口取下一页
+    page_size = parse_page_size(data.get('page_size'), default=SearchConfig.PAGE_SIZE, max_size=SearchConfig.MAX_PAGE_SIZE)
+    query_hash = hashlib.sha1(json.dumps([" ".join(query_str.split()), sorted(set(categories)), doc_type], ensure_ascii=False).encode('utf-8')).hexdigest()[:12]
+    offset = 0
+    if data.get('cursor'):
+        cursor = decode_cursor(data.get('cursor'))
+        if cursor is None or cursor.get('q') != query_hash or not isinstance(cursor.get('o'), int) or cursor['o'] < 0:
+            return error_response('无效的分页游标', 400)
+        offset = cursor['o']
+    elif data.get('offset') is not None:
+        try:
+            offset = max(0, int(data.get('offset')))
+        except (TypeError, ValueError):
+            return error_response('无效的 offset', 400)
     
-    # 展示结果
-    for rank, (idx, score) in enumerate(results, 1):
-        print('原索引:', idx, ' 相似度:', score)
-        case_info = metadata[idx]
-        print(f"\n▌ 相似度排名 {rank} （相似度：{score:.4f}）")
-        print(f"案例标题：{case_info['案例']}")
-        print(f"核心关键词：{', '.join(case_info['关键词'])}")
-        print(f"裁判要旨：{case_info['基本案情']}")
-
-    # 结束计时
-    case_search_end_time = time.time()
-    case_search_execution_time = case_search_end_time - case_search_start_time
-
-    # law_search_time 随机0.01s-0.05s
-    law_search_time = round(random.uniform(0.01, 0.05),2)
-    # doc_search_time 随机0.01s-0.05s
-    doc_search_time = round(case_search_execution_time, 2)
-    # keyword_search_time 随机0.01s-0.05s
-    keyword_search_time = round(random.uniform(0.01, 0.05),2)
-    # 总搜索时间
-    search_time = round( law_search_time + doc_search_time + keyword_search_time, 2)
+    trace = SearchTrace()
+    with trace.span('total'):
+        # 整个排名窗口按 (查询, 窗口大小, 过滤条件, 语料版本) 缓存，翻页不再重新 encode 和打分
+        try:
+            window = retrieval.search(query_str, SearchConfig.WINDOW_SIZE, timeout=SearchConfig.READY_TIMEOUT, trace=trace,
+                                      filters={"category": categories})
+        except RetrievalNotReady:
+            return error_response(f'{retrieval.name}正在加载，请稍后再试', 503)
+        results = window[offset:offset + page_size]
+
+        with trace.span('metadata'):
+            items = []
+            if doc_type == 'JUDGMENT_DOCUMENT':
+                # 裁判文书：片段为文书中与查询最相似的段落
+                for idx, (doc_id, score, position) in enumerate(results, offset):
+                    doc_info = document_retrieval.get_document(doc_id, position)
+                    if doc_info is None:
+                        continue
+                    items.append({
+                        "doc_id": doc_id,
+                        "index": idx,
+                        "title": doc_info['标题'],
+                        "trial_court": doc_info['审理法院'],
+                        "judgment_date": doc_info['裁判日期'],
+                        "cause": doc_info['案由'],
+                        "snippet": doc_info['片段'],
+                        "doc_type": "JUDGMENT_DOCUMENT",
+                        "score": float(score),
+                    })
+            else:
+                # 按案例 id 读取元数据，缓存窗口生成后被删除的案例跳过
+                for idx, (case_id, score) in enumerate(results, offset):
+                    case_info = case_retrieval.get_case(case_id)
+                    if case_info is None:
+                        continue
+                    items.append({
+                        "doc_id": case_id,
+                        "index": idx,
+                        "title": case_info['案例'],
+                        "keywords": case_info['关键词'],
+                        "judgment_short": case_info['基本案情'],
+                        "doc_type": "JUDICIAL_CASES", 
+                        "score": float(score),
+                    })
+
+    # doc_search_time 向量检索耗时（排队 + encode + 打分 + top_k）
+    doc_search_time = round(trace.get('dense'), 2)
+    # keyword_search_time BM25 关键词检索耗时（与向量检索并行）
+    keyword_search_time = round(trace.get('lexical'), 2)
+    # law_search_time 暂无法条检索
+    law_search_time = 0.0
+    # 总搜索时间（并行阶段不重复计算）
+    search_time = round(trace.get('total'), 2)
+
+    next_offset = offset + len(results)
+    has_more = next_offset < len(window)
     
     res = {
         "search_time": search_time,
         "law_search_time": law_search_time,
         "doc_search_time": doc_search_time,
         "keyword_search_time": keyword_search_time,
+        # 各阶段耗时（毫秒）
+        "stage_times": trace.as_ms(),
         "search_res": {
-            "count": len(results), 
-            "items": [ 
-                {
-                    "doc_id": int(item[0])+1,
-                    "index": idx,
-                    "title": metadata[item[0]]['案例'],
-                    "keywords": metadata[item[0]]['关键词'],
-                    "judgment_short": metadata[item[0]]['基本案情'],
-                    "doc_type": "JUDICIAL_CASES", 
-                    "score": float(item[1]),
-                } for idx, item in enumerate(results)
-            ]
+            "count": len(items), 
+            "total": len(window),
+            "offset": offset,
+            "page_size": page_size,
+            "category": categories,
+            "doc_type": doc_type,
+            # items 中 score 的含义：cosine（余弦相似度）/ rrf（混合检索的归一化 RRF 得分）
+            "score_type": retrieval.score_type,
+            "has_more": has_more,
+            "next_cursor": encode_cursor({"q": query_hash, "o": next_offset}) if has_more else None,
+            "items": items
         }
     }
-    return success_response(res)
+    # 序列化耗时无法写入自身响应，只上报指标
+    with trace.span('serialize'):
+        response = success_response(res)
+    metrics_sink.report('search', trace)
+    return response
 
 
 # 获取id案例具体信息
@@ -84,8 +169,20 @@ def get_judicial_case(id):
     if not success:
         return error_response(msg)
 
-    # TODO: 查找聚类中和该案例相关的related_category
-    related_category = [{"category": "合同纠纷", "score": 40}, {"category": "侵权责任", "score": 79}]
+    # 相关类别与相关案例来自近邻图：近邻案例的关键词按相似度加权聚合
+    graph = case_neighbor_graph()
+    related_category, related_cases = [], []
+    if graph is not None:
+        related_category = [{"category": label, "score": score} for label, score in graph.related_labels(id)]
+        scores = dict(graph.related(id))
+        related_cases = [
+            {
+                "doc_id": case.id,
+                "title": case.title,
+                "doc_type": "JUDICIAL_CASES",
+                "score": scores[case.id],
+            } for case in get_judicial_cases_by_ids(list(scores))
+        ]
     
     res = {
         "case_title": msg.title,
@@ -97,7 +194,8 @@ def get_judicial_case(id):
             "judgment_reasons": msg.judgment_reasons,
             "judgment_essence": msg.judgment_essence
         },
-        "related_category": related_category
+        "related_category": related_category,
+        "related_cases": related_cases
     }
 
     return success_response(res)
@@ -110,8 +208,11 @@ def get_judgment_document(id):
     if not success:
         return error_response(msg) 
     
-    # TODO: 查找聚类中和该文书相关的related_keywords
-    related_keywords = [{"keyword": "盗窃", "score": 40}, {"keyword": "诈骗", "score": 79}]
+    # 相关关键词来自近邻图：近邻文书的案由按相似度加权聚合
+    graph = document_neighbor_graph()
+    related_keywords = [
+        {"keyword": label, "score": score} for label, score in graph.related_labels(id)
+    ] if graph is not None else []
     
     # 反序列化法律依据
     def deserialize_law_basis(serialized_law_basis):
@@ -168,13 +269,20 @@ def related_judgment():
     judgment_document_id = query_params.get('judgment_document_id')
     console.print('[green]judgment_document_id:[/green]', judgment_document_id)
 
-    # TODO: 获取相关判决
-    success, judgments = get_related_judgment(judgment_document_id)
+    try:
+        judgment_document_id = int(judgment_document_id)
+    except (TypeError, ValueError):
+        return error_response('无效的 judgment_document_id', 400)
+
+    # 相关判决来自近邻图，一次 IN 查询取回；未构建近邻图时沿用固定的民事 / 刑事判决
+    graph = document_neighbor_graph()
+    related_ids = [doc_id for doc_id, _ in graph.related(judgment_document_id)] if graph is not None else None
+    success, judgments = get_related_judgment(judgment_document_id, related_ids)
     if not success:
         return error_response(judgments)
 
     res = {
-        "count": 10,  
+        "count": len(judgments),
         "related_judgment": [
             {
                 "doc_id": item.id,
@@ -182,7 +290,7 @@ def related_judgment():
                 "doc_type": "JUDGMENT_DOCUMENT",
                 "trial_procedure": item.trial_procedure,
                 "cause": item.cause.split('、') if item.cause else [],
-            } for judgment in judgments for  item in judgment
+            } for item in judgments
         ]
     }
 
@@ -288,68 +396,53 @@ def legal_rules_board():
     return success_response(res)
 
 
-# 司法案例页面
-@law_bp.route('/judicial_cases', methods=['GET'])
-def judicial_cases_board():
+# 司法案例页面-各类别关键词图表数据
+CASE_TOP_KEYWORDS_FILE = 'static/case_top_keywords.json'
+
+# 构建司法案例页面数据（各类别的指导性 / 参考性案例与关键词图表）
+def build_judicial_cases_board():
     # 加载case_top_keywords
-    with open('static/case_top_keywords.json', 'r', encoding='utf-8') as file:
+    with open(CASE_TOP_KEYWORDS_FILE, 'r', encoding='utf-8') as file:
         case_top_keywords = json.load(file)
+    success, board = get_judicial_cases_board()
 
-    # 获取指导性案例
-    success, criminal_direction_cases, civil_direction_cases, administrative_direction_cases, compensation_direction_cases, execution_direction_cases = get_judicial_direction_cases_board()
-    # 获取参考性案例
-    success, criminal_reference_cases, civil_reference_cases, administrative_reference_cases, compensation_reference_cases, execution_reference_cases = get_judicial_reference_cases_board()
-
-   # 定义map数据
-    categories = [
-        {"title": "刑事", "direction_cases": criminal_direction_cases, "reference_cases": criminal_reference_cases},
-        {"title": "民事", "direction_cases": civil_direction_cases, "reference_cases": civil_reference_cases},
-        {"title": "行政", "direction_cases": administrative_direction_cases, "reference_cases": administrative_reference_cases},
-        {"title": "国家赔偿", "direction_cases": compensation_direction_cases, "reference_cases": compensation_reference_cases},
-        {"title": "执行", "direction_cases": execution_direction_cases, "reference_cases": execution_reference_cases}
-
-    ]
-
-    # 使用 map 函数动态生成 judicial_cases_board
-    def create_board(category, index):
+    def case_items(cases):
         return {
-            "board_index": index + 1,
-            "board_title": category["title"],
-            "guidance_cases_board": {
-                "count": len(category["direction_cases"]),
-                "items": [
-                    {
-                        "doc_id": case.id,
-                        "index": idx,
-                        "title": case.title,
-                        "doc_type": "JUDICIAL_CASES",
-                        "keywords": case.keywords.split(' ')
-                    } for idx, case in enumerate(category["direction_cases"])
-                ]
-            },
-            "reference_cases_board": {
-                "count": len(category["reference_cases"]),
-                "items": [
-                    {
-                        "doc_id": case.id,
-                        "index": idx,
-                        "title": case.title,
-                        "doc_type": "JUDICIAL_CASES",
-                        "keywords": case.keywords.split(' ')
-                    } for idx, case in enumerate(category["reference_cases"])
-                ]
-            },
-            "keywords_chart_data": case_top_keywords[category["title"]]
+            "count": len(cases),
+            "items": [
+                {
+                    "doc_id": case.id,
+                    "index": idx,
+                    "title": case.title,
+                    "doc_type": "JUDICIAL_CASES",
+                    "keywords": case.keywords.split(' ')
+                } for idx, case in enumerate(cases)
+            ]
         }
 
-    # 生成 judicial_cases_board
-    judicial_cases_board = list(map(lambda category, index: create_board(category, index), categories, range(len(categories))))
+    return [
+        {
+            "board_index": index + 1,
+            "board_title": category,
+            "guidance_cases_board": case_items(cases["direction_cases"]),
+            "reference_cases_board": case_items(cases["reference_cases"]),
+            "keywords_chart_data": case_top_keywords[category]
+        } for index, (category, cases) in enumerate(board.items())
+    ]
+
+# 司法案例页面快照：案例类别表重新生成或关键词统计文件变化时重新构建（只读），其余请求直接读内存
+judicial_cases_snapshot = VersionedSnapshot(
+    lambda: (get_case_categories_version(), os.path.getmtime(CASE_TOP_KEYWORDS_FILE)),
+    build_judicial_cases_board,
+    check_interval=AppConfig.BOARD_CHECK_INTERVAL
+)
 
-    # 构建最终结果
+# 司法案例页面
+@law_bp.route('/judicial_cases', methods=['GET'])
+def judicial_cases_board():
     res = {
-        "judicial_cases_board": judicial_cases_board,
+        "judicial_cases_board": judicial_cases_snapshot.get(),
     }
-        
     return success_response(res)
 
 
@@ -493,42 +586,65 @@ def collect_dashboard():
     }
     return success_response(res)
 
-# 获取用户收藏-法律文书收藏
-@law_bp.route('/collect/law_collect', methods=['GET'])
-@token_required
-def collect_law_collect():
+# 收藏列表默认 / 最大分页大小
+COLLECT_PAGE_SIZE = 10
+COLLECT_MAX_PAGE_SIZE = 50
+
+# 收藏列表分页：cursor 记录上一页最后一条收藏的 (收藏时间, id) 与已返回条数
+def collect_page(doc_type):
     user_id = request.user_id
-    success, collect_list, collect_laws_count = get_collect_laws(user_id)
+    page_size = parse_page_size(request.args.get('page_size'), default=COLLECT_PAGE_SIZE, max_size=COLLECT_MAX_PAGE_SIZE)
+    before, offset = None, 0
+    if request.args.get('cursor'):
+        cursor = decode_cursor(request.args.get('cursor'))
+        try:
+            before = (datetime.fromisoformat(cursor['t']), int(cursor['i']))
+            offset = int(cursor['n'])
+        except (TypeError, KeyError, ValueError):
+            return error_response('无效的分页游标', 400)
+
+    result = get_collects(user_id, doc_type, limit=page_size, before=before)
+    if not result[0]:
+        return error_response(result[1], 400)
+    _, rows, has_more, count = result
+
+    collect_list = [serialize_collect(collect, doc, offset + idx) for idx, (collect, doc) in enumerate(rows)]
+    next_cursor = None
+    if has_more:
+        last = rows[-1][0]
+        next_cursor = encode_cursor({"t": last.collect_date.isoformat(), "i": last.id, "n": offset + len(rows)})
     res = {
-        'count': collect_laws_count,
-        'collect_list': collect_list
+        'count': count,
+        'collect_list': collect_list,
+        'has_more': has_more,
+        'next_cursor': next_cursor
     }
     return success_response(res)
 
+# 获取用户收藏列表，doc_type: LAWS / JUDICIAL_CASES / JUDGMENT_DOCUMENTS
+@law_bp.route('/collect/list', methods=['GET'])
+@token_required
+def collect_list():
+    return collect_page(request.args.get('doc_type', ''))
+
+# 获取用户收藏-法律文书收藏
+@law_bp.route('/collect/law_collect', methods=['GET'])
+@token_required
+def collect_law_collect():
+    return collect_page('LAWS')
+
 
 # 获取用户收藏-案例收藏
 @law_bp.route('/collect/case_collect', methods=['GET'])
 @token_required
 def collect_case_collect():
-    user_id = request.user_id
-    success, collect_list, collect_cases_count = get_collect_cases(user_id)
-    res = {
-        'count': collect_cases_count,
-        'collect_list': collect_list
-    }
-    return success_response(res)
+    return collect_page('JUDICIAL_CASES')
 
 # 获取用户收藏-文书收藏
 @law_bp.route('/collect/doc_collect', methods=['GET'])
 @token_required
 def collect_doc_collect():
-    user_id = request.user_id
-    success, collect_list, collect_docs_count = get_collect_docs(user_id)
-    res = {
-        'count': collect_docs_count,
-        'collect_list': collect_list
-    }
-    return success_response(res)
+    return collect_page('JUDGMENT_DOCUMENTS')
 
 # 图表-法典关系图
 @law_bp.route('/chart/law_relation', methods=['GET'])
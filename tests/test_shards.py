@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from algo.index import BruteForceIndex, l2_normalize
+from algo.shards import ShardedIndex
+
+
+@pytest.fixture
+def sharded(tmp_path):
+    embeddings = l2_normalize(np.random.default_rng(0).standard_normal((600, 16)).astype(np.float32))
+    embedding_file = tmp_path / "embeddings.npy"
+    np.save(embedding_file, embeddings)
+    index = ShardedIndex(str(embedding_file), len(embeddings), n_shards=3)
+    yield embeddings, index
+    index.close()
+
+
+def test_killed_shard_is_restarted_and_results_stay_aligned(sharded):
+    embeddings, index = sharded
+    exact = BruteForceIndex(embeddings)
+    queries = embeddings[:4]
+
+    index.shards[1].process.kill()
+    index.shards[1].process.wait()
+    with pytest.raises(RuntimeError):
+        index.search(queries, 5)
+
+    # 之后的每次检索都返回本次查询的结果，而不是上一组残留的结果
+    for start in (4, 8, 12):
+        queries = embeddings[start:start + 4]
+        scores, indices = index.search(queries, 5)
+        expected_scores, expected_indices = exact.search(queries, 5)
+        np.testing.assert_array_equal(indices, expected_indices)
+        np.testing.assert_allclose(scores, expected_scores, atol=1e-5)
@@ -1,10 +1,47 @@
+import argparse
+
 from extension import db
 from flask_cors import CORS
+# 导入全部模型，create_all 才会创建案例类别表等派生表
+from db import sync_case_categories
+from model.user import Collect, UserSession
+
+# 已有部署中表已存在、之后才在模型中声明了索引的模型（分页查询依赖这些索引）
+INDEXED_MODELS = (UserSession, Collect)
+
+def ensure_indexes(models):
+    """create_all 不会为已存在的表补建索引，这里创建模型中声明、数据库中尚不存在的索引。"""
+    for model in models:
+        for index in model.__table__.indexes:
+            index.create(bind=db.engine, checkfirst=True)
 
 def init_db(app):
     db.init_app(app)
     with app.app_context():
         db.create_all()
+        ensure_indexes(INDEXED_MODELS)
+        # 案例类别表由 judicial_cases 派生，启动时与案例表内容不一致（如替换了数据库文件）则重新生成
+        sync_case_categories()
 
 def cors(app):
-    CORS(app, resources={r"/*": {"origins": "http://localhost:5173", "supports_credentials": True}})
\ No newline at end of file
+    CORS(app, resources={r"/*": {"origins": "http://localhost:5173", "supports_credentials": True}})
+
+
+# ===== 命令行：案例数据更新后离线重新生成派生表 =====
+if __name__ == "__main__":
+    from flask import Flask
+    from config import AppConfig
+
+    parser = argparse.ArgumentParser(description="数据库维护")
+    parser.add_argument("command", choices=("sync-case-categories",),
+                        help="sync-case-categories：由 judicial_cases 重新生成案例类别表")
+    parser.add_argument("--full", action="store_true", help="不比较内容，直接重新生成")
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config.from_object(AppConfig)
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        ensure_indexes(INDEXED_MODELS)
+        print("案例类别表已重新生成。" if sync_case_categories(full=args.full) else "案例类别表已是最新。")
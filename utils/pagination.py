@@ -0,0 +1,41 @@
+import base64
+import json
+
+
+def encode_cursor(payload):
+    """
+    将分页状态编码为不透明游标（URL 安全的 base64 JSON）。
+    :param payload: 分页状态字典
+    :return: 游标字符串
+    """
+    data = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor):
+    """
+    解码游标，格式错误时返回 None。
+    :param cursor: 游标字符串
+    :return: 分页状态字典或 None
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+    except (ValueError, UnicodeError):
+        return None
+    return payload if isinstance(payload, dict) else None
+
+def parse_page_size(value, default=20, max_size=50):
+    """
+    解析分页大小，非法值使用默认值，并限制在 [1, max_size]。
+    :param value: 请求中的分页大小
+    :param default: 默认分页大小
+    :param max_size: 最大分页大小
+    :return: 分页大小
+    """
+    try:
+        page_size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(page_size, max_size))
@@ -0,0 +1,50 @@
+import random
+import threading
+import time
+from array import array
+
+
+class RandomIdPool:
+    """
+    表主键的内存 id 池：每隔 ttl 秒重新读取一次全部 id，随机抽样只在池中随机取下标，
+    代价与样本数成正比，与表大小无关（替代 ORDER BY random() 的全表扫描 + 排序）。
+    池在两次刷新之间可能包含已删除的 id，调用方按 id 取行时跳过即可。
+    """
+
+    def __init__(self, load_ids, ttl=600):
+        """
+        :param load_ids: 无参函数，返回表中全部 id 的可迭代对象
+        :param ttl: 池的有效期(秒)
+        """
+        self.load_ids = load_ids
+        self.ttl = ttl
+        self._ids = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def ids(self):
+        """返回当前 id 池，过期时重新加载（并发请求只加载一次）。"""
+        # 只读一次 self._ids 到局部变量，并发的 invalidate() 不会让本次调用拿到 None
+        ids = self._ids
+        if ids is None or time.monotonic() - self._loaded_at > self.ttl:
+            with self._lock:
+                ids = self._ids
+                if ids is None or time.monotonic() - self._loaded_at > self.ttl:
+                    ids = array('q', self.load_ids())
+                    self._ids = ids
+                    self._loaded_at = time.monotonic()
+        return ids
+
+    def sample(self, k):
+        """
+        无放回随机抽取 k 个 id（池中不足 k 个时全部返回，顺序随机）。
+        :param k: 样本数
+        :return: id 列表
+        """
+        ids = self.ids()
+        return [ids[i] for i in random.sample(range(len(ids)), min(k, len(ids)))]
+
+    def invalidate(self):
+        """丢弃当前池，下次抽样时重新加载。"""
+        with self._lock:
+            self._ids = None
@@ -0,0 +1,43 @@
+import threading
+import time
+
+
+class VersionedSnapshot:
+    """
+    按版本号缓存的内存快照：每隔 check_interval 秒计算一次版本号，版本变化时重新构建，
+    两次检查之间的请求直接返回内存中的快照，不访问数据库。
+    """
+
+    def __init__(self, version, build, check_interval=60):
+        """
+        :param version: 无参函数，返回可比较的版本号（如表的行数与最大 id、文件修改时间）
+        :param build: 无参函数，构建快照
+        :param check_interval: 检查版本号的间隔秒数，0 为每次都检查
+        """
+        self.version = version
+        self.build = build
+        self.check_interval = check_interval
+        self._value = None
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _stale(self):
+        return self._value is None or time.monotonic() - self._checked_at >= self.check_interval
+
+    def get(self):
+        """返回当前快照，到期时检查版本号，变化时重新构建（并发请求只构建一次）。"""
+        if self._stale():
+            with self._lock:
+                if self._stale():
+                    version = self.version()
+                    if self._value is None or version != self._version:
+                        self._value = self.build()
+                        self._version = version
+                    self._checked_at = time.monotonic()
+        return self._value
+
+    def invalidate(self):
+        """丢弃当前快照，下次访问时重新构建。"""
+        with self._lock:
+            self._value = None
@@ -0,0 +1,103 @@
+import json
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager, nullcontext
+
+metrics_logger = logging.getLogger("lawai.metrics")
+
+
+class SearchTrace:
+    """
+    记录一次请求内各阶段耗时（秒），同名阶段多次出现时累加，可跨线程写入。
+    """
+
+    def __init__(self):
+        self.spans = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start_time)
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def count(self, name, value):
+        with self._lock:
+            self.counters[name] = value
+
+    def merge(self, other):
+        """合并另一个 trace 的阶段耗时，如批处理线程中整批共享的阶段。"""
+        for name, seconds in other.spans.items():
+            self.record(name, seconds)
+        for name, value in other.counters.items():
+            self.count(name, value)
+
+    def get(self, name):
+        return self.spans.get(name, 0.0)
+
+    def as_ms(self, ndigits=2):
+        return {name: round(seconds * 1000, ndigits) for name, seconds in self.spans.items()}
+
+
+def span(trace, name):
+    """trace 为空时不计时，便于可选地传入 trace。"""
+    return trace.span(name) if trace is not None else nullcontext()
+
+
+# ===== 指标汇总 =====
+class MetricsSink:
+    """
+    汇总各阶段耗时：每条 trace 以一行 JSON 写入 lawai.metrics 日志，
+    并保留每个阶段最近 window 个样本，用于计算 p50 / p95 / p99。
+
+    参数:
+        window (int): 每个阶段保留的样本数。
+    """
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._samples = defaultdict(lambda: deque(maxlen=self.window))
+        self._counts = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def report(self, name, trace):
+        with self._lock:
+            self._counts[name] += 1
+            for stage, seconds in trace.spans.items():
+                self._samples[f"{name}.{stage}"].append(seconds)
+        metrics_logger.info(json.dumps({"name": name, "spans_ms": trace.as_ms(), **trace.counters}))
+
+    def summary(self):
+        """返回各阶段耗时分位数（毫秒）。"""
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self._samples.items()}
+            counts = dict(self._counts)
+
+        def percentile(values, q):
+            return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 2)
+
+        return {
+            "requests": counts,
+            "stages_ms": {
+                stage: {
+                    "count": len(values),
+                    "p50": percentile(values, 0.50),
+                    "p95": percentile(values, 0.95),
+                    "p99": percentile(values, 0.99),
+                    "max": round(values[-1] * 1000, 2)
+                } for stage, values in samples.items()
+            }
+        }
+
+
+# 全局指标汇总
+metrics_sink = MetricsSink()